@@ -0,0 +1,32 @@
+from django.core.urlresolvers import reverse
+from django.db import models
+
+import url_tracker
+
+
+class BenchmarkModel(url_tracker.URLTrackingMixin, models.Model):
+    slug = models.SlugField(max_length=50)
+    counter = models.IntegerField(default=0)
+
+    def get_url(self, method):
+        return reverse(
+            'benchmark-detail',
+            kwargs={'method': method, 'slug': self.slug}
+        )
+
+    def get_url_1(self):
+        return self.get_url(1)
+
+    def get_url_2(self):
+        return self.get_url(2)
+
+    def get_url_3(self):
+        return self.get_url(3)
+
+    def get_url_4(self):
+        return self.get_url(4)
+
+    def get_url_5(self):
+        return self.get_url(5)
+
+    url_tracking_methods = ['get_url_1']
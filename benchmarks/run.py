@@ -0,0 +1,308 @@
+"""
+Benchmarks for the redirect middleware and the tracking signal handlers.
+
+Run them from the repository root with::
+
+    python -m benchmarks.run --rows 10000 --rows 1000000 --output results.json
+
+The benchmarks use a throw-away database created like Django's test
+database, SQLite by default or Postgres with ``BENCHMARK_DATABASE=postgres``.
+Results are written as JSON so that they can be compared between versions.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+timer = getattr(time, 'perf_counter', time.time)
+
+BATCH_SIZE = 5000
+
+
+def seed(rows):
+    """
+    Replaces all tracked URLs with *rows* old URLs, each redirecting to a new
+    URL of its own ``URLChangeMethod``.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from django.db import transaction
+    from url_tracker.models import (
+        OldURL, URLChangeMethod, URLRedirect, hash_url, hash_current_url
+    )
+
+    from benchmarks.models import BenchmarkModel
+
+    Relation = URLChangeMethod.old_urls.through
+    for model in (URLRedirect, Relation, URLChangeMethod, OldURL):
+        model.objects.all()._raw_delete(model.objects.db)
+
+    content_type = ContentType.objects.get_for_model(BenchmarkModel)
+    for start in range(1, rows + 1, BATCH_SIZE):
+        ids = range(start, min(start + BATCH_SIZE, rows + 1))
+        with transaction.atomic():
+            OldURL.objects.bulk_create([
+                OldURL(id=i, url='/old/%d/' % i, url_hash=hash_url('/old/%d/' % i))
+                for i in ids
+            ])
+            URLChangeMethod.objects.bulk_create([
+                URLChangeMethod(
+                    id=i,
+                    content_type=content_type,
+                    object_id=str(i),
+                    method_name='get_url_1',
+                    current_url='/new/%d/' % i,
+                    current_url_hash=hash_current_url('/new/%d/' % i)
+                )
+                for i in ids
+            ])
+            Relation.objects.bulk_create([
+                Relation(urlchangemethod_id=i, oldurl_id=i) for i in ids
+            ])
+            URLRedirect.objects.bulk_create([
+                URLRedirect(
+                    url_hash=hash_url('/old/%d/' % i),
+                    url='/old/%d/' % i,
+                    old_url_id=i,
+                    target='/new/%d/' % i,
+                    target_hash=hash_url('/new/%d/' % i)
+                )
+                for i in ids
+            ])
+
+
+def measure(name, func, iterations, **info):
+    """
+    Calls *func* with the iteration number *iterations* times and returns
+    the latency statistics and the number of queries per call.
+    """
+    from django.db import connection
+
+    timings = []
+    query_count = 0
+    # the query log is bounded, count the queries of each call separately
+    force_debug_cursor = connection.force_debug_cursor
+    connection.force_debug_cursor = True
+    try:
+        for i in range(iterations):
+            connection.queries_log.clear()
+            start = timer()
+            func(i)
+            timings.append((timer() - start) * 1e6)
+            query_count += len(connection.queries_log)
+    finally:
+        connection.force_debug_cursor = force_debug_cursor
+        connection.queries_log.clear()
+    timings.sort()
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+    result = {
+        'name': name,
+        'iterations': iterations,
+        'mean_us': sum(timings) / len(timings),
+        'p50_us': percentile(0.5),
+        'p95_us': percentile(0.95),
+        'p99_us': percentile(0.99),
+        'queries_per_call': query_count / iterations,
+    }
+    result.update(info)
+    print(
+        '%(name)-40s %(mean_us)10.1fus mean %(p99_us)10.1fus p99 '
+        '%(queries_per_call)5.1f queries' % result,
+        file=sys.stderr
+    )
+    return result
+
+
+def benchmark_middleware(rows, iterations):
+    from django.http import HttpResponseNotFound
+    from django.test import RequestFactory
+    from django.test.utils import override_settings
+    from url_tracker.bloom import reset_bloom_filter
+    from url_tracker.middleware import URLChangePermanentRedirectMiddleware
+
+    factory = RequestFactory()
+    middleware = URLChangePermanentRedirectMiddleware()
+    not_found = HttpResponseNotFound()
+
+    def lookup(path):
+        def func(i):
+            request = factory.get(path(i))
+            middleware.process_response(request, not_found)
+        return func
+
+    scenarios = [
+        ('hit', False, lambda i: '/old/%d/' % random.randint(1, rows)),
+        ('miss', False, lambda i: '/missing/%d/' % i),
+        ('append_slash_miss', True, lambda i: '/missing/%d' % i),
+    ]
+    directory = tempfile.mkdtemp()
+    configurations = [
+        ('database', {}),
+        ('bloom_filter', {
+            'URL_TRACKER_BLOOM_FILTER': True,
+            'URL_TRACKER_BLOOM_FILTER_FILE': os.path.join(directory, 'bloom'),
+        }),
+    ]
+    results = []
+    try:
+        for configuration, extra_settings in configurations:
+            reset_bloom_filter()
+            for scenario, append_slash, path in scenarios:
+                with override_settings(APPEND_SLASH=append_slash, **extra_settings):
+                    # builds the bloom filter and warms up the database
+                    lookup(path)(0)
+                    results.append(measure(
+                        'middleware.%s.%s' % (configuration, scenario),
+                        lookup(path),
+                        iterations,
+                        rows=rows,
+                        group='middleware',
+                        configuration=configuration,
+                        scenario=scenario
+                    ))
+    finally:
+        reset_bloom_filter()
+        shutil.rmtree(directory)
+    return results
+
+
+def benchmark_saves(saves):
+    from benchmarks.models import BenchmarkModel
+
+    results = []
+    for configuration, declare_fields in (('methods', False), ('fields', True)):
+        for method_count in range(1, 6):
+            results.extend(benchmark_save(
+                BenchmarkModel, configuration, declare_fields, method_count, saves
+            ))
+    return results
+
+
+def benchmark_save(model, configuration, declare_fields, method_count, saves):
+    """
+    Measures saves that change the tracked URLs and saves that don't with
+    *method_count* tracked methods, with or without ``url_tracking_fields``.
+    """
+    from url_tracker import track_url_changes_for_model
+
+    model.url_tracking_methods = [
+        'get_url_%d' % i for i in range(1, method_count + 1)
+    ]
+    if declare_fields:
+        model.url_tracking_fields = dict(
+            (method_name, ['slug']) for method_name in model.url_tracking_methods
+        )
+    else:
+        model.url_tracking_fields = {}
+    # connecting the same receivers again is a no-op
+    track_url_changes_for_model(model)
+    try:
+        model.objects.all().delete()
+        model.objects.bulk_create([
+            model(slug='object-%d' % i) for i in range(saves)
+        ])
+        # loaded after the tracking fields are set up to take snapshots
+        objects = list(model.objects.order_by('pk'))
+
+        def change_slug(i):
+            objects[i].slug += '-changed'
+            objects[i].save()
+
+        def change_counter(i):
+            objects[i].counter += 1
+            objects[i].save()
+
+        return [
+            measure(
+                'save.%s.%d.%s' % (configuration, method_count, scenario),
+                func,
+                saves,
+                group='save',
+                configuration=configuration,
+                methods=method_count,
+                scenario=scenario
+            )
+            for scenario, func in (('slug', change_slug), ('counter', change_counter))
+        ]
+    finally:
+        model.url_tracking_fields = {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument(
+        '--rows',
+        type=int,
+        action='append',
+        help="Number of old URLs to benchmark the middleware with, can be "
+             "given more than once. Defaults to 10000."
+    )
+    parser.add_argument(
+        '--iterations',
+        type=int,
+        default=1000,
+        help="Number of requests per middleware benchmark."
+    )
+    parser.add_argument(
+        '--saves',
+        type=int,
+        default=200,
+        help="Number of saves per save benchmark."
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help="Write the JSON results to this file instead of stdout."
+    )
+    args = parser.parse_args(argv)
+
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, keepdb=False)
+    try:
+        results = []
+        for rows in args.rows or [10000]:
+            print('seeding %d old URLs' % rows, file=sys.stderr)
+            seed(rows)
+            results.extend(benchmark_middleware(rows, args.iterations))
+        results.extend(benchmark_saves(args.saves))
+    finally:
+        connection.creation.destroy_test_db(
+            connection.settings_dict['NAME'],
+            verbosity=0
+        )
+
+    output = json.dumps({
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
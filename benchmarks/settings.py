@@ -0,0 +1,37 @@
+import os
+
+# SQLite by default, set BENCHMARK_DATABASE=postgres to run against the
+# local Postgres configured through the usual PG* environment variables
+if os.environ.get('BENCHMARK_DATABASE') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('PGDATABASE', 'url_tracker_benchmarks'),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('BENCHMARK_SQLITE_NAME', 'benchmarks.sqlite3'),
+            'TEST': {
+                'NAME': os.environ.get('BENCHMARK_SQLITE_NAME', 'benchmarks.sqlite3'),
+            },
+        }
+    }
+SECRET_KEY = "_"
+DEBUG = False
+INSTALLED_APPS = (
+    'url_tracker',
+    'benchmarks',
+    'django.contrib.contenttypes',
+)
+MIDDLEWARE_CLASSES = (
+    'url_tracker.middleware.URLChangePermanentRedirectMiddleware',
+)
+ROOT_URLCONF = 'benchmarks.urls'
+URL_TRACKER_CACHE_SIZE = 0
@@ -0,0 +1,11 @@
+from django.conf.urls import url
+from django.http import HttpResponse
+
+
+def detail(request, slug, method):
+    return HttpResponse()
+
+
+urlpatterns = [
+    url(r'^(?P<method>\d+)/(?P<slug>[-\w]+)/$', detail, name='benchmark-detail'),
+]
@@ -12,10 +12,10 @@ setup(
                  "to provide HTTP 301 & 410 on request."),
     long_description = open('README.rst').read(),
     license = "BSD",
-    packages = find_packages(exclude=["docs*", "tests*"]),
+    packages = find_packages(exclude=["docs*", "tests*", "benchmarks*"]),
     include_package_data = True,
     install_requires=[
-        'django>=1.3.1,<1.11',
+        'django>=1.8,<1.11',
     ],
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -27,7 +27,6 @@ setup(
         "License :: OSI Approved :: BSD License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.6",
         "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
         "Programming Language :: Python :: 3.3",
@@ -1,3 +1,5 @@
+import re
+
 import url_tracker
 
 from django.core.urlresolvers import reverse
@@ -5,6 +7,19 @@ from django.db import models
 from django.db.models import signals
 
 
+def captured_sql(queries, *statements):
+    """
+    Returns the SQL of the *queries* captured by ``CaptureQueriesContext``
+    that start with any of *statements*, or of all of them. On SQLite
+    Django 1.8 captures them as ``QUERY = '...' - PARAMS = (...)``.
+    """
+    sql = [
+        re.sub(r"^QUERY = u?'(.*)' - PARAMS = .*$", r'\1', query['sql'], flags=re.S)
+        for query in queries.captured_queries
+    ]
+    return [query for query in sql if not statements or query.startswith(statements)]
+
+
 def reverse_model(slug):
         return reverse('model-detail', kwargs={'slug': slug})
 
@@ -27,7 +42,28 @@ class TestModel(url_tracker.URLTrackingMixin, models.Model):
 
 class RemoveSignals(object):
     def tearDown(self):
+        from url_tracker.trackers import (
+            lookup_previous_url,
+            track_changed_url,
+            take_url_tracking_snapshot,
+            capture_deleted_urls,
+            track_deleted_urls,
+        )
+
         def remove_reciever_from_signal(signal):
-            signal.receivers = []
+            signal.receivers = [
+                receiver for receiver in signal.receivers
+                if receiver[1] not in (
+                    lookup_previous_url,
+                    track_changed_url,
+                    take_url_tracking_snapshot,
+                    capture_deleted_urls,
+                    track_deleted_urls,
+                )
+            ]
+            signal.sender_receivers_cache.clear()
         remove_reciever_from_signal(signals.post_save)
         remove_reciever_from_signal(signals.pre_save)
+        remove_reciever_from_signal(signals.post_init)
+        remove_reciever_from_signal(signals.pre_delete)
+        remove_reciever_from_signal(signals.post_delete)
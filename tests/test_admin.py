@@ -0,0 +1,75 @@
+from django.contrib.admin.sites import AdminSite
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from url_tracker.admin import EstimatedCountPaginator, OldURLAdmin, URLChangeMethodAdmin
+from url_tracker.models import OldURL, URLChangeMethod
+
+from .models import TestModel
+
+
+class TestAdmin(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        for i in range(5):
+            url_method = URLChangeMethod.objects.create(
+                content_object=TestModel.objects.create(slug='slug%d' % i),
+                method_name='get_absolute_url',
+                current_url='/new%d' % i,
+            )
+            url_method.old_urls.create(url='/old%d' % i)
+        OldURL.objects.create(url='/orphan')
+
+    def test_url_methods_prefetch_objects(self):
+        admin = URLChangeMethodAdmin(URLChangeMethod, AdminSite())
+        with self.assertNumQueries(2):
+            objects = [
+                url_method.content_object
+                for url_method in admin.get_queryset(self.request)
+            ]
+        self.assertEqual(len(objects), 5)
+        self.assertTrue(all(isinstance(obj, TestModel) for obj in objects))
+
+    def test_old_url_targets(self):
+        admin = OldURLAdmin(OldURL, AdminSite())
+        url_method = URLChangeMethod.objects.get(current_url='/new0')
+        url_method.current_url = ''
+        url_method.save()
+        with self.assertNumQueries(2):
+            targets = dict(
+                (old_url.url, admin.target(old_url))
+                for old_url in admin.get_queryset(self.request)
+            )
+        self.assertEqual(targets['/old0'], '(gone)')
+        self.assertEqual(targets['/old1'], '/new1')
+
+    def test_search(self):
+        admin = OldURLAdmin(OldURL, AdminSite())
+        queryset, distinct = admin.get_search_results(
+            self.request, OldURL.objects.all(), ' /old1 '
+        )
+        self.assertFalse(distinct)
+        self.assertEqual(list(queryset.values_list('url', flat=True)), ['/old1'])
+        queryset, __ = admin.get_search_results(
+            self.request, OldURL.objects.all(), '/old'
+        )
+        self.assertFalse(queryset.exists())
+
+        admin = URLChangeMethodAdmin(URLChangeMethod, AdminSite())
+        queryset, __ = admin.get_search_results(
+            self.request, URLChangeMethod.objects.all(), '/new1'
+        )
+        self.assertEqual(list(queryset.values_list('current_url', flat=True)), ['/new1'])
+        queryset, __ = admin.get_search_results(
+            self.request, URLChangeMethod.objects.all(), '/new'
+        )
+        self.assertFalse(queryset.exists())
+
+    def test_capped_count(self):
+        paginator = EstimatedCountPaginator(OldURL.objects.order_by('pk'), 2)
+        paginator.count_limit = 3
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+        paginator = EstimatedCountPaginator(OldURL.objects.order_by('pk'), 2)
+        self.assertEqual(paginator.count, 6)
@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.bloom import (
+    BloomFilter,
+    build_bloom_filter,
+    get_bloom_filter,
+    reset_bloom_filter,
+)
+from url_tracker.middleware import URLChangePermanentRedirectMiddleware
+from url_tracker.models import OldURL, URLChangeMethod
+
+from .models import TestModel
+
+
+class TestBloomFilter(TestCase):
+    def test_contains_added_urls(self):
+        bloom_filter = BloomFilter.for_capacity(100, 0.01)
+        urls = ['/old/%d/' % i for i in range(100)]
+        for url in urls:
+            bloom_filter.add(url)
+        for url in urls:
+            self.assertIn(url, bloom_filter)
+
+    def test_does_not_contain_other_urls(self):
+        bloom_filter = BloomFilter.for_capacity(100, 0.01)
+        bloom_filter.add('/old/')
+        self.assertNotIn('/new/', bloom_filter)
+
+    def test_build_from_database(self):
+        OldURL.objects.create(url='/old/')
+        self.assertIn('/old/', build_bloom_filter())
+
+
+class TestSharedBloomFilter(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bloom')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_additions_are_shared(self):
+        OldURL.objects.create(url='/old/')
+        first = build_bloom_filter(self.path)
+        second = BloomFilter.open(self.path)
+        first.add('/added/')
+
+        self.assertIn('/old/', second)
+        self.assertIn('/added/', second)
+        first.close()
+        second.close()
+
+    def test_command(self):
+        OldURL.objects.create(url='/old/')
+        call_command('url_tracker_bloom_filter', path=self.path, stdout=StringIO())
+        bloom_filter = BloomFilter.open(self.path)
+        self.assertIn('/old/', bloom_filter)
+        bloom_filter.close()
+
+
+@override_settings(
+    APPEND_SLASH=True,
+    URL_TRACKER_BLOOM_FILTER=True,
+    URL_TRACKER_CACHE_SIZE=0
+)
+class TestMiddlewareBloomFilter(TestCase):
+    def setUp(self):
+        reset_bloom_filter()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = self.settings(
+            URL_TRACKER_BLOOM_FILTER_FILE=os.path.join(directory, 'bloom')
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target/',
+        )
+        self.url_method.old_urls.create(url='/initial/')
+
+    def tearDown(self):
+        reset_bloom_filter()
+
+    def test_miss_without_queries(self):
+        self.client.get('/untracked')
+        with self.assertNumQueries(0):
+            response = self.client.get('/untracked')
+        self.assertEqual(response.status_code, 404)
+
+    def test_hit(self):
+        response = self.client.get('/initial')
+        self.assertRedirects(
+            response,
+            '/new_target/',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_hit_after_filter_is_loaded(self):
+        self.client.get('/untracked')
+        self.url_method.old_urls.create(url='/other/')
+
+        response = self.client.get('/other/')
+        self.assertRedirects(
+            response,
+            '/new_target/',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_changed_url_added(self):
+        self.client.get('/untracked')
+        old_url = self.url_method.old_urls.get()
+        old_url.url = '/changed/'
+        old_url.save()
+
+        response = self.client.get('/changed/')
+        self.assertRedirects(
+            response,
+            '/new_target/',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_loaded_with_middleware(self):
+        URLChangePermanentRedirectMiddleware()
+        with self.assertNumQueries(0):
+            self.assertIn('/initial/', get_bloom_filter())
+
+    def test_requires_file(self):
+        with self.settings(URL_TRACKER_BLOOM_FILTER_FILE=None):
+            self.assertRaises(ImproperlyConfigured, get_bloom_filter)
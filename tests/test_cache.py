@@ -0,0 +1,237 @@
+from unittest import skipIf
+
+import django
+from django.core.cache import caches
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.cache import RedirectCache, redirect_cache, shared_redirect_cache, MISSING
+from url_tracker.models import OldURL, URLChangeMethod, URLRedirect
+from url_tracker.trackers import add_old_url
+
+from .models import TestModel
+
+
+class TestRedirectCache(TestCase):
+    def test_missing(self):
+        cache = RedirectCache(max_size=2)
+        self.assertIs(cache.get('/initial'), MISSING)
+
+    def test_stores_negative_results(self):
+        cache = RedirectCache(max_size=2)
+        cache.set('/initial', None)
+        self.assertIsNone(cache.get('/initial'))
+
+    def test_evicts_least_recently_used(self):
+        cache = RedirectCache(max_size=2)
+        cache.set('/a', '/new_a')
+        cache.set('/b', '/new_b')
+        cache.get('/a')
+        cache.set('/c', '/new_c')
+
+        self.assertEqual(cache.get('/a'), '/new_a')
+        self.assertIs(cache.get('/b'), MISSING)
+        self.assertEqual(cache.get('/c'), '/new_c')
+        self.assertEqual(len(cache), 2)
+
+    def test_expires(self):
+        cache = RedirectCache(max_size=2, timeout=0)
+        cache.set('/a', '/new_a')
+        self.assertIs(cache.get('/a'), MISSING)
+        self.assertEqual(len(cache), 0)
+
+        cache = RedirectCache(max_size=2, timeout=60)
+        cache.set('/a', '/new_a')
+        self.assertEqual(cache.get('/a'), '/new_a')
+
+    def test_disabled(self):
+        cache = RedirectCache(max_size=0)
+        cache.set('/a', '/new_a')
+        self.assertIs(cache.get('/a'), MISSING)
+
+
+@override_settings(APPEND_SLASH=False)
+class TestMiddlewareCache(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        self.old_url = OldURL.objects.create(url='/initial')
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.url_method.old_urls.add(self.old_url)
+
+    def test_hit_without_queries(self):
+        self.client.get('/initial')
+        with self.assertNumQueries(0):
+            response = self.client.get('/initial')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_miss_without_queries(self):
+        self.client.get('/untracked')
+        with self.assertNumQueries(0):
+            response = self.client.get('/untracked')
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalidated_on_change(self):
+        self.client.get('/initial')
+        self.url_method.current_url = ''
+        self.url_method.save()
+
+        response = self.client.get('/initial')
+        self.assertEqual(response.status_code, 410)
+
+    def test_invalidated_on_new_old_url(self):
+        self.client.get('/other')
+        self.url_method.old_urls.create(url='/other')
+
+        response = self.client.get('/other')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_invalidated_on_delete(self):
+        self.client.get('/initial')
+        self.old_url.delete()
+
+        response = self.client.get('/initial')
+        self.assertEqual(response.status_code, 404)
+
+
+SHARED_CACHE_SETTINGS = {
+    'CACHES': {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'url_tracker_tests',
+        },
+    },
+    'URL_TRACKER_SHARED_CACHE': 'default',
+}
+
+
+@override_settings(APPEND_SLASH=False, **SHARED_CACHE_SETTINGS)
+class TestSharedCache(TransactionTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.old_url = OldURL.objects.create(url='/initial')
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.url_method.old_urls.add(self.old_url)
+
+    def test_hit_without_queries(self):
+        self.client.get('/initial')
+        with self.assertNumQueries(0):
+            response = self.client.get('/initial')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_miss_without_queries(self):
+        self.client.get('/untracked')
+        with self.assertNumQueries(0):
+            response = self.client.get('/untracked')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(URL_TRACKER_SHARED_CACHE_MISS_TIMEOUT=0)
+    def test_miss_timeout(self):
+        self.client.get('/untracked')
+        with self.assertNumQueries(1):
+            self.client.get('/untracked')
+
+    @override_settings(APPEND_SLASH=True)
+    def test_append_slash_candidates_cached(self):
+        self.url_method.old_urls.create(url='/other/')
+        self.client.get('/other')
+        with self.assertNumQueries(0):
+            response = self.client.get('/other')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_invalidated_on_change(self):
+        self.client.get('/initial')
+        self.url_method.current_url = ''
+        self.url_method.save()
+
+        response = self.client.get('/initial')
+        self.assertEqual(response.status_code, 410)
+
+    def test_invalidated_on_add_old_url(self):
+        self.client.get('/other')
+        add_old_url(self.url_method.content_object, 'get_absolute_url', '/other')
+
+        response = self.client.get('/other')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @skipIf(django.VERSION < (1, 9), "on_commit() was added in Django 1.9")
+    def test_generation_bumped_after_commit(self):
+        generation = shared_redirect_cache.get_generation()
+        with transaction.atomic():
+            self.url_method.current_url = '/changed'
+            self.url_method.save()
+            self.old_url.url = '/moved'
+            self.old_url.save()
+            self.assertEqual(shared_redirect_cache.get_generation(), generation)
+        self.assertEqual(shared_redirect_cache.get_generation(), generation + 1)
+
+    def test_generation_bumped_after_rolled_back_transaction(self):
+        generation = shared_redirect_cache.get_generation()
+        try:
+            with transaction.atomic():
+                self.url_method.current_url = '/rolled-back'
+                self.url_method.save()
+                raise ValueError
+        except ValueError:
+            pass
+        generation_after_rollback = shared_redirect_cache.get_generation()
+        with transaction.atomic():
+            self.url_method.current_url = '/changed'
+            self.url_method.save()
+        self.assertEqual(
+            shared_redirect_cache.get_generation(),
+            generation_after_rollback + 1
+        )
+
+    def test_rebuild_keeps_other_entries(self):
+        caches['default'].set('unrelated', 'value')
+        generation = shared_redirect_cache.get_generation()
+        URLRedirect.objects.rebuild()
+
+        self.assertNotEqual(shared_redirect_cache.get_generation(), generation)
+        self.assertEqual(caches['default'].get('unrelated'), 'value')
+
+    def test_evicted_generation_not_reused(self):
+        self.client.get('/initial')
+        caches['default'].delete(shared_redirect_cache.generation_key)
+        self.url_method.current_url = ''
+        self.url_method.save()
+
+        response = self.client.get('/initial')
+        self.assertEqual(response.status_code, 410)
@@ -0,0 +1,172 @@
+from unittest import skipIf, skipUnless
+
+import django
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.utils.six import StringIO
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker import track_url_changes_for_model
+from url_tracker.executors import get_executor, _executors
+from url_tracker.models import URLChangeMethod, PendingURLChange
+
+from .models import TestModel, reverse_model, RemoveSignals
+
+try:
+    import concurrent.futures
+except ImportError:
+    concurrent = None
+
+
+@override_settings(URL_TRACKER_EXECUTOR='url_tracker.executors.ImmediateExecutor')
+class TestImmediateExecutor(RemoveSignals, TransactionTestCase):
+    def setUp(self):
+        track_url_changes_for_model(TestModel)
+        self.instance = TestModel.objects.create(slug='initial')
+
+    @skipIf(django.VERSION < (1, 9), "on_commit() was added in Django 1.9")
+    def test_records_after_commit(self):
+        with transaction.atomic():
+            self.instance.slug = 'final'
+            self.instance.save()
+            self.assertFalse(URLChangeMethod.objects.exists())
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+    @skipIf(django.VERSION < (1, 9), "on_commit() was added in Django 1.9")
+    def test_coalesces_saves_in_transaction(self):
+        with transaction.atomic():
+            for slug in ('second', 'third', 'final'):
+                self.instance.slug = slug
+                self.instance.save()
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+    def test_nothing_recorded_on_rollback(self):
+        try:
+            with transaction.atomic():
+                self.instance.slug = 'final'
+                self.instance.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.instance.refresh_from_db()
+        self.instance.text = 'changed'
+        self.instance.save()
+
+        self.assertEqual(
+            list(URLChangeMethod.objects.values_list('method_name', flat=True)),
+            []
+        )
+
+    def test_recorded_after_rolled_back_transaction(self):
+        try:
+            with transaction.atomic():
+                self.instance.slug = 'second'
+                self.instance.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.instance.refresh_from_db()
+        with transaction.atomic():
+            self.instance.slug = 'final'
+            self.instance.save()
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+    def test_current_url_set_without_old_url(self):
+        for text in ('first', None, 'second'):
+            self.instance.text = text
+            self.instance.save()
+
+        url_method = URLChangeMethod.objects.get(method_name='get_text')
+        self.assertEqual(url_method.current_url, 'second')
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            ['first']
+        )
+
+    def test_unchanged_urls_not_deferred(self):
+        # fetching the previous state and the save itself
+        with self.assertNumQueries(3):
+            self.instance.save()
+
+
+@skipUnless(concurrent, "ThreadExecutor requires the 'futures' package on Python 2")
+@override_settings(URL_TRACKER_EXECUTOR='url_tracker.executors.ThreadExecutor')
+class TestThreadExecutor(RemoveSignals, TransactionTestCase):
+    def test_records_in_thread(self):
+        track_url_changes_for_model(TestModel)
+        instance = TestModel.objects.create(slug='initial')
+        instance.slug = 'final'
+        instance.save()
+        get_executor().pool.shutdown(wait=True)
+        _executors.clear()
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+
+
+@override_settings(URL_TRACKER_EXECUTOR='url_tracker.executors.QueueExecutor')
+class TestQueueExecutor(RemoveSignals, TransactionTestCase):
+    def test_queued_until_processed(self):
+        track_url_changes_for_model(TestModel)
+        instance = TestModel.objects.create(slug='initial')
+        instance.slug = 'second'
+        instance.save()
+        instance.slug = 'final'
+        instance.save()
+        self.assertEqual(PendingURLChange.objects.count(), 2)
+        self.assertFalse(URLChangeMethod.objects.exists())
+
+        call_command('url_tracker_process_queue', stdout=StringIO())
+
+        self.assertFalse(PendingURLChange.objects.exists())
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+    def test_queued_in_transaction(self):
+        track_url_changes_for_model(TestModel)
+        instance = TestModel.objects.create(slug='initial')
+        with transaction.atomic():
+            instance.slug = 'final'
+            instance.save()
+            self.assertEqual(PendingURLChange.objects.count(), 1)
+
+        self.assertEqual(PendingURLChange.objects.count(), 1)
+
+    def test_nothing_queued_on_rollback(self):
+        track_url_changes_for_model(TestModel)
+        instance = TestModel.objects.create(slug='initial')
+        try:
+            with transaction.atomic():
+                instance.slug = 'final'
+                instance.save()
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertFalse(PendingURLChange.objects.exists())
@@ -0,0 +1,141 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils.six import StringIO
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.export import export_redirects
+from url_tracker.models import (
+    OldURL, URLChangeMethod, URLRedirect, URLRedirectChange, hash_url
+)
+
+from .models import TestModel
+
+
+@override_settings(URL_TRACKER_CHANGE_LOG=True)
+class TestExport(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'redirects')
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.url_method.old_urls.create(url='/initial')
+        URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+        ).old_urls.create(url='/gone')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with io.open(self.path, encoding='utf-8') as file_obj:
+            return file_obj.read()
+
+    def test_nginx(self):
+        self.url_method.old_urls.create(url='/with "quotes"')
+        count, generation, incremental = export_redirects(self.path, 'nginx')
+
+        self.assertEqual((count, incremental), (3, False))
+        lines = self.read().splitlines()
+        self.assertEqual(lines[0], '# url_tracker generation %d' % generation)
+        self.assertEqual(sorted(lines[1:]), [
+            '"/gone" "410";',
+            '"/initial" "/new_target";',
+            '"/with \\"quotes\\"" "/new_target";',
+        ])
+
+    def test_apache(self):
+        self.url_method.old_urls.create(url='/with space')
+        count, __, __ = export_redirects(self.path, 'apache')
+
+        self.assertEqual(count, 2)
+        self.assertEqual(sorted(self.read().splitlines()[1:]), [
+            '/gone 410',
+            '/initial /new_target',
+        ])
+
+    def test_json(self):
+        __, generation, __ = export_redirects(self.path, 'json')
+        self.assertEqual(json.loads(self.read()), {
+            'generation': generation,
+            'redirects': {'/initial': '/new_target', '/gone': ''},
+        })
+
+    def test_incremental(self):
+        for format in ('nginx', 'apache', 'json'):
+            export_redirects(self.path, format)
+            self.url_method.old_urls.create(url='/added/%s' % format)
+            OldURL.objects.get(url='/gone').delete()
+
+            count, __, incremental = export_redirects(self.path, format, incremental=True)
+            self.assertTrue(incremental)
+            self.assertEqual(count, len(URLRedirect.objects.all()))
+            full_path = self.path + '.full'
+            export_redirects(full_path, format)
+            with io.open(full_path, encoding='utf-8') as full:
+                self.assertEqual(
+                    sorted(self.read().splitlines()[1:]),
+                    sorted(full.read().splitlines()[1:])
+                )
+            OldURL.objects.get(url='/added/%s' % format).delete()
+            URLChangeMethod.objects.create(
+                content_object=TestModel.objects.create(),
+                method_name='get_absolute_url',
+            ).old_urls.create(url='/gone')
+
+    def test_incremental_reads_changes_only(self):
+        export_redirects(self.path, 'nginx')
+        self.url_method.old_urls.create(url='/added')
+        with self.assertNumQueries(4):
+            # the log, the changes, the changed redirects and the pruning
+            export_redirects(self.path, 'nginx', incremental=True)
+        self.assertIn('"/added" "/new_target";', self.read())
+
+    def test_incremental_reads_changes_committed_late(self):
+        late_id = URLRedirectChange.objects.order_by('pk')[1].pk
+        URLRedirectChange.objects.filter(pk=late_id).delete()
+        export_redirects(self.path, 'nginx')
+        with override_settings(URL_TRACKER_CHANGE_LOG=False):
+            self.url_method.old_urls.create(url='/late')
+        # committed after the export with an id below its generation
+        URLRedirectChange.objects.create(pk=late_id, url_hash=hash_url('/late'))
+
+        __, __, incremental = export_redirects(self.path, 'nginx', incremental=True)
+        self.assertTrue(incremental)
+        self.assertIn('"/late" "/new_target";', self.read())
+
+    def test_incremental_without_log_falls_back(self):
+        export_redirects(self.path, 'nginx')
+        self.url_method.old_urls.create(url='/added')
+        URLRedirectChange.objects.all().delete()
+        __, __, incremental = export_redirects(self.path, 'nginx', incremental=True)
+        self.assertFalse(incremental)
+        self.assertIn('"/added" "/new_target";', self.read())
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('url_tracker_export', self.path, format='json', stdout=stdout)
+        self.assertIn("Wrote 2 redirects", stdout.getvalue())
+        self.assertFalse([
+            name for name in os.listdir(self.directory) if name != 'redirects'
+        ])
+
+    @override_settings(URL_TRACKER_CHANGE_LOG=False)
+    def test_incremental_requires_change_log(self):
+        self.assertRaises(
+            CommandError,
+            call_command, 'url_tracker_export', self.path, incremental=True
+        )
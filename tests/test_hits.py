@@ -0,0 +1,108 @@
+from django.contrib.admin.sites import AdminSite
+from django.core.cache import caches
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.admin import OldURLAdmin
+from url_tracker.cache import redirect_cache
+from url_tracker.hits import hit_buffer, flush_hits
+from url_tracker.models import OldURL, URLChangeMethod
+
+from .models import TestModel
+
+
+@override_settings(
+    APPEND_SLASH=True,
+    URL_TRACKER_HIT_COUNTS=True,
+    URL_TRACKER_HIT_BUFFER_SIZE=1000,
+    URL_TRACKER_HIT_FLUSH_INTERVAL=3600,
+)
+class TestHitCounts(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        flush_hits()
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.first = self.url_method.old_urls.create(url='/first/')
+        self.second = self.url_method.old_urls.create(url='/second')
+
+    def test_buffered(self):
+        self.client.get('/first/')
+        with self.assertNumQueries(0):
+            self.client.get('/first/')
+        self.assertEqual(len(hit_buffer), 2)
+        self.assertEqual(OldURL.objects.get(pk=self.first.pk).hits, 0)
+
+    def test_flush_writes_counts(self):
+        for url in ('/first/', '/first', '/second', '/first/', '/untracked'):
+            self.client.get(url)
+        with self.assertNumQueries(2):
+            flush_hits()
+
+        first = OldURL.objects.get(pk=self.first.pk)
+        self.assertEqual(first.hits, 3)
+        self.assertIsNotNone(first.last_hit)
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 1)
+        self.assertEqual(len(hit_buffer), 0)
+
+    def test_counts_added_up(self):
+        self.client.get('/second')
+        flush_hits()
+        self.client.get('/second')
+        flush_hits()
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 2)
+
+    @override_settings(URL_TRACKER_HIT_BUFFER_SIZE=2)
+    def test_flushed_after_buffer_size(self):
+        self.client.get('/second')
+        self.client.get('/second')
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 2)
+
+    @override_settings(URL_TRACKER_HIT_COUNTS=False)
+    def test_disabled(self):
+        self.client.get('/second')
+        self.assertEqual(len(hit_buffer), 0)
+
+    @override_settings(
+        CACHES={
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'url_tracker_hits',
+            },
+        },
+        URL_TRACKER_HIT_SHARED_CACHE='default'
+    )
+    def test_shared_accumulator(self):
+        caches['default'].clear()
+        # the first flush takes the lock for the flush interval and starts
+        # a new period
+        self.client.get('/second')
+        flush_hits()
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 0)
+
+        # hits of other processes are accumulated until the lock expires
+        self.client.get('/second')
+        flush_hits()
+        self.client.get('/second')
+        flush_hits()
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 0)
+
+        # each drain writes the period before the previous one
+        caches['default'].delete('url_tracker:hits:lock')
+        flush_hits()
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 1)
+        caches['default'].delete('url_tracker:hits:lock')
+        flush_hits()
+        self.assertEqual(OldURL.objects.get(pk=self.second.pk).hits, 3)
+        self.assertFalse(caches['default'].get('url_tracker:hits:slots:1'))
+
+    def test_admin_sortable(self):
+        admin = OldURLAdmin(OldURL, AdminSite())
+        self.assertIn('hits', admin.list_display)
+        self.assertIn('last_hit', admin.list_display)
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils.six import StringIO
+
+from url_tracker.imports import OldURLImporter, read_records
+from url_tracker.models import OldURL, URLChangeMethod, URLRedirect
+
+from .models import TestModel, reverse_model
+
+SITEMAP = """<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://old.example.com/posts/first/</loc></url>
+  <url><loc>http://old.example.com/posts/second/?page=2</loc></url>
+  <url><loc>http://old.example.com/about/</loc></url>
+</urlset>
+"""
+
+
+class TestImport(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.first = TestModel.objects.create(slug='first', text='/text')
+        self.second = TestModel.objects.create(slug='second')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file_obj:
+            file_obj.write(content)
+        return path
+
+    def test_csv(self):
+        path = self.write('urls.csv', 'old_url,id,method\n/a,%d\n/b,%d,get_text\n/c,%d\n/d,999\n' % (
+            self.first.pk, self.first.pk, self.second.pk
+        ))
+        stdout = StringIO()
+        call_command('url_tracker_import', path, model='tests.TestModel', stdout=stdout)
+
+        self.assertIn("Imported 3 old URLs, skipped 2 records.", stdout.getvalue())
+        self.assertEqual(
+            dict(URLRedirect.objects.values_list('url', 'target')),
+            {
+                '/a': reverse_model('first'),
+                '/b': '/text',
+                '/c': reverse_model('second'),
+            }
+        )
+
+    def test_jsonl_by_lookup_field(self):
+        path = self.write('urls.jsonl', '\n'.join(json.dumps(record) for record in [
+            {'url': '/a', 'object': 'first'},
+            {'url': '/b', 'object': 'second', 'method': 'get_absolute_url'},
+            {'url': '/c', 'object': 'missing'},
+        ]))
+        call_command(
+            'url_tracker_import', path,
+            model='tests.TestModel', lookup_field='slug', stdout=StringIO()
+        )
+        self.assertEqual(
+            URLRedirect.objects.lookup_many(['/a', '/b', '/c']),
+            {'/a': reverse_model('first'), '/b': reverse_model('second')}
+        )
+
+    def test_sitemap_with_pattern(self):
+        path = self.write('sitemap.xml', SITEMAP)
+        call_command(
+            'url_tracker_import', path,
+            model='tests.TestModel',
+            lookup_field='slug',
+            pattern=r'^/posts/(?P<key>[\w-]+)/',
+            stdout=StringIO()
+        )
+        self.assertEqual(
+            set(OldURL.objects.values_list('url', flat=True)),
+            set(['/posts/first/', '/posts/second/?page=2'])
+        )
+
+    def test_existing_old_urls_not_duplicated(self):
+        path = self.write('urls.csv', '/a,%d\n/a,%d\n' % (self.first.pk, self.first.pk))
+        call_command('url_tracker_import', path, model='tests.TestModel', stdout=StringIO())
+        call_command('url_tracker_import', path, model='tests.TestModel', stdout=StringIO())
+        self.assertEqual(OldURL.objects.count(), 1)
+        self.assertEqual(URLChangeMethod.objects.count(), 1)
+
+    def test_current_url_skipped(self):
+        path = self.write('urls.csv', '%s,%d\n' % (reverse_model('first'), self.first.pk))
+        call_command('url_tracker_import', path, model='tests.TestModel', stdout=StringIO())
+        self.assertFalse(OldURL.objects.exists())
+
+    def test_constant_queries_per_chunk(self):
+        importer = OldURLImporter(TestModel, batch_size=1000)
+        # creates the URL change methods of both objects
+        importer.run([('/warm-up', obj.pk, None) for obj in (self.first, self.second)])
+        with CaptureQueriesContext(connection) as one:
+            importer.run([('/one', self.first.pk, None)])
+        with CaptureQueriesContext(connection) as many:
+            importer.run(
+                [('/first/%d' % i, self.first.pk, None) for i in range(20)] +
+                [('/second/%d' % i, self.second.pk, None) for i in range(20)]
+            )
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(OldURL.objects.count(), 42)
+
+    def test_progress_and_offset(self):
+        records = [('/%d' % i, self.first.pk, None) for i in range(5)]
+        reported = []
+        importer = OldURLImporter(TestModel, batch_size=2)
+        counts = importer.run(
+            records,
+            offset=1,
+            progress=lambda *counts: reported.append(counts)
+        )
+        self.assertEqual(counts, (5, 4, 0))
+        self.assertEqual(reported, [(3, 2, 0), (5, 4, 0)])
+        self.assertFalse(OldURL.objects.filter(url='/0').exists())
+
+    def test_read_records_streams_csv(self):
+        path = self.write('urls.csv', '/a,1\n\n/b\n')
+        self.assertEqual(
+            list(read_records(path, 'csv')),
+            [('/a', '1', None), ('/b', None, None)]
+        )
+
+    def test_untracked_model(self):
+        path = self.write('urls.csv', '/a,1\n')
+        self.assertRaises(
+            CommandError,
+            call_command, 'url_tracker_import', path, model='auth.User'
+        )
+
+    def test_unknown_format(self):
+        path = self.write('urls.txt', '/a,1\n')
+        self.assertRaises(
+            CommandError,
+            call_command, 'url_tracker_import', path, model='tests.TestModel'
+        )
@@ -0,0 +1,124 @@
+import socket
+from unittest import skipIf
+
+from django.db import connection
+from django.test import TestCase
+from django.test.client import RequestFactory
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.cache import redirect_cache
+from url_tracker.metrics import get_metrics, metrics_view, StatsdMetrics
+from url_tracker.models import URLChangeMethod
+from url_tracker.trackers import track_url_changes_for_model
+
+from .models import TestModel, RemoveSignals
+
+
+@override_settings(
+    APPEND_SLASH=False,
+    URL_TRACKER_METRICS='url_tracker.metrics.LocalMetrics'
+)
+class TestLocalMetrics(RemoveSignals, TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        self.metrics = get_metrics()
+        self.metrics.reset()
+        url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        url_method.old_urls.create(url='/initial')
+        URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+        ).old_urls.create(url='/gone')
+
+    def tearDown(self):
+        super(TestLocalMetrics, self).tearDown()
+        redirect_cache.clear()
+
+    @override_settings(DEBUG=True)
+    def test_lookups(self):
+        self.client.get('/initial')
+        self.client.get('/initial')
+        self.client.get('/gone')
+        self.client.get('/untracked')
+
+        self.assertEqual(self.metrics.counters, {
+            'lookup_redirect': 2,
+            'lookup_gone': 1,
+            'lookup_miss': 1,
+            'memory_hit': 1,
+            'memory_miss': 3,
+        })
+        self.assertEqual(self.metrics.histograms['lookup_seconds'].count, 4)
+        queries = self.metrics.histograms['lookup_queries']
+        self.assertEqual(queries.count, 4)
+        self.assertGreater(queries.sum, 0)
+        self.assertFalse(connection.force_debug_cursor)
+
+    @skipIf(hasattr(connection, 'execute_wrapper'), "queries always counted")
+    def test_queries_counted_in_debug_only(self):
+        self.client.get('/initial')
+        self.assertEqual(self.metrics.histograms['lookup_seconds'].count, 1)
+        self.assertNotIn('lookup_queries', self.metrics.histograms)
+        self.assertFalse(connection.force_debug_cursor)
+
+    @override_settings(DEBUG=True)
+    def test_tracked_save(self):
+        track_url_changes_for_model(TestModel)
+        instance = TestModel.objects.create(slug='initial')
+        instance.slug = 'final'
+        instance.save()
+
+        for name in ('pre_save', 'post_save'):
+            self.assertEqual(self.metrics.histograms[name + '_seconds'].count, 2)
+            self.assertGreater(self.metrics.histograms[name + '_queries'].sum, 0)
+        # the previous and the current URLs of both methods
+        self.assertEqual(self.metrics.histograms['reverse_seconds'].count, 4)
+
+    @override_settings(DEBUG=True)
+    def test_render(self):
+        self.client.get('/initial')
+        text = self.metrics.render()
+        self.assertIn('# TYPE url_tracker_lookup_redirect_total counter\n', text)
+        self.assertIn('url_tracker_lookup_redirect_total 1\n', text)
+        self.assertIn('# TYPE url_tracker_lookup_seconds histogram\n', text)
+        self.assertIn('url_tracker_lookup_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn('url_tracker_lookup_queries_count 1\n', text)
+
+        response = metrics_view(RequestFactory().get('/metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+
+class TestMetricsDisabled(TestCase):
+    def test_no_backend(self):
+        self.assertIsNone(get_metrics())
+
+
+class TestStatsdMetrics(TestCase):
+    def test_send(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(1)
+        try:
+            with override_settings(
+                    URL_TRACKER_METRICS_STATSD_HOST='127.0.0.1',
+                    URL_TRACKER_METRICS_STATSD_PORT=server.getsockname()[1]):
+                metrics = StatsdMetrics()
+                metrics.increment('lookup_redirect')
+                metrics.observe('lookup_seconds', 0.0042)
+                metrics.observe('lookup_queries', 1)
+            received = [server.recv(1024) for __ in range(3)]
+        finally:
+            server.close()
+        self.assertEqual(received, [
+            b'url_tracker.lookup_redirect:1|c',
+            b'url_tracker.lookup:4|ms',
+            b'url_tracker.lookup_queries:1|h',
+        ])
@@ -1,25 +1,32 @@
+from django.core.management import call_command
+from django.db import connection
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
 
-from url_tracker.models import OldURL, URLChangeMethod
+from url_tracker.models import (
+    OldURL, URLChangeMethod, URLRedirect, hash_url, hash_current_url
+)
+from url_tracker.trackers import record_url_changes
 
 from .models import TestModel, RemoveSignals
 
 
 class TestOldUrlGetNewUrl(TransactionTestCase, RemoveSignals):
     def setUp(self):
-        instance = TestModel.objects.create()
+        # an old URL can belong to the methods of several objects
         self.url_method_blank = URLChangeMethod.objects.create(
-            content_object=instance,
+            content_object=TestModel.objects.create(),
             method_name='get_absolute_url',
             current_url=''
         )
         self.url_method_initial = URLChangeMethod.objects.create(
-            content_object=instance,
+            content_object=TestModel.objects.create(),
             method_name='get_absolute_url',
             current_url='initial'
         )
         self.url_method_initial_2 = URLChangeMethod.objects.create(
-            content_object=instance,
+            content_object=TestModel.objects.create(),
             method_name='get_absolute_url',
             current_url='initial'
         )
@@ -49,3 +56,174 @@ class TestOldUrlGetNewUrl(TransactionTestCase, RemoveSignals):
         self.old_url.model_method.add(self.url_method_initial)
         self.old_url.model_method.add(self.url_method_initial_2)
         self.assertEqual(self.old_url.get_new_url(), 'initial')
+
+    def test_without_url_method_returns_blank(self):
+        self.assertEqual(self.old_url.get_new_url(), '')
+
+
+class TestOldURLHash(TransactionTestCase, RemoveSignals):
+    def test_set_on_save(self):
+        old_url = OldURL.objects.create(url='/old')
+        self.assertEqual(old_url.url_hash, hash_url('/old'))
+
+        old_url.url = '/other'
+        old_url.save(update_fields=['url'])
+        self.assertEqual(OldURL.objects.get().url_hash, hash_url('/other'))
+
+    def test_rehash(self):
+        old_url = OldURL.objects.create(url='/Old/')
+        taken = OldURL.objects.create(url='/other/')
+        OldURL.objects.create(url='/Other/')
+        with self.settings(URL_TRACKER_NORMALIZE_LOWERCASE=True):
+            OldURL.objects.rehash(OldURL.objects.values_list('pk', flat=True))
+            self.assertEqual(
+                OldURL.objects.get(pk=old_url.pk).url_hash, hash_url('/old/')
+            )
+        # taken by another old URL
+        self.assertEqual(
+            OldURL.objects.get(url='/Other/').url_hash, hash_url('/Other/')
+        )
+        self.assertEqual(OldURL.objects.get(pk=taken.pk).url_hash, hash_url('/other/'))
+
+
+class TestCurrentURLHash(TransactionTestCase, RemoveSignals):
+    def test_set_on_save(self):
+        url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new'
+        )
+        self.assertEqual(url_method.current_url_hash, hash_current_url('/new'))
+
+        url_method.current_url = '/other'
+        url_method.save(update_fields=['current_url'])
+        self.assertEqual(
+            URLChangeMethod.objects.get().current_url_hash,
+            hash_current_url('/other')
+        )
+
+    def test_set_on_recorded_change(self):
+        instance = TestModel.objects.create(slug='initial')
+        record_url_changes([(instance, 'get_absolute_url', '/old', '/first')])
+        record_url_changes([(instance, 'get_absolute_url', '/first', '/final')])
+        self.assertEqual(
+            URLChangeMethod.objects.get().current_url_hash,
+            hash_current_url('/final')
+        )
+
+
+class TestURLRedirect(TransactionTestCase):
+    def setUp(self):
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new'
+        )
+        self.old_url = self.url_method.old_urls.create(url='/old')
+
+    def test_created_with_target(self):
+        redirect = URLRedirect.objects.get(url_hash=hash_url('/old'))
+        self.assertEqual(redirect.url, '/old')
+        self.assertEqual(redirect.target, '/new')
+
+    def test_not_refreshed_without_change(self):
+        url_method = URLChangeMethod.objects.get()
+        with CaptureQueriesContext(connection) as queries:
+            url_method.save()
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'url_tracker_oldurl' in query['sql']
+        ])
+
+    def test_lookup_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(URLRedirect.objects.lookup(['/old', '/old/']), '/new')
+
+    def test_lookup_untracked(self):
+        self.assertIsNone(URLRedirect.objects.lookup(['/other']))
+
+    def test_updated_with_current_url(self):
+        self.url_method.current_url = ''
+        self.url_method.save()
+        self.assertEqual(URLRedirect.objects.lookup(['/old']), '')
+
+    def test_removed_with_old_url(self):
+        self.url_method.old_urls.filter(url='/old').delete()
+        self.assertFalse(URLRedirect.objects.exists())
+
+    def test_updated_when_relation_cleared(self):
+        self.url_method.old_urls.clear()
+        self.assertEqual(URLRedirect.objects.lookup(['/old']), '')
+
+    def test_updated_when_url_method_deleted(self):
+        other = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/other'
+        )
+        other.old_urls.add(self.old_url)
+        self.assertEqual(URLRedirect.objects.lookup(['/old']), '/other')
+        other.delete()
+        self.assertEqual(URLRedirect.objects.lookup(['/old']), '/new')
+
+    def test_rebuild(self):
+        URLRedirect.objects.all().delete()
+        call_command('url_tracker_rebuild_redirects', stdout=StringIO())
+        self.assertEqual(URLRedirect.objects.lookup(['/old']), '/new')
+
+
+class TestRedirectChains(TransactionTestCase):
+    def create_url_method(self, current_url):
+        return URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url=current_url
+        )
+
+    def test_points_at_end_of_existing_chain(self):
+        self.create_url_method('/c').old_urls.create(url='/b')
+        self.create_url_method('/b').old_urls.create(url='/a')
+
+        self.assertEqual(URLRedirect.objects.lookup(['/a']), '/c')
+
+    def test_existing_chain_updated_with_new_url(self):
+        self.create_url_method('/b').old_urls.create(url='/a')
+        url_method = self.create_url_method('/c')
+        url_method.old_urls.create(url='/b')
+        self.assertEqual(URLRedirect.objects.lookup(['/a']), '/c')
+
+        url_method.old_urls.create(url='/c')
+        url_method.current_url = '/d'
+        url_method.save()
+        self.assertEqual(URLRedirect.objects.lookup(['/a']), '/d')
+        self.assertEqual(URLRedirect.objects.lookup(['/b']), '/d')
+
+    def test_cycle_keeps_target(self):
+        self.create_url_method('/b').old_urls.create(url='/a')
+        self.create_url_method('/a').old_urls.create(url='/b')
+
+        self.assertEqual(URLRedirect.objects.lookup(['/a']), '/b')
+        self.assertEqual(URLRedirect.objects.lookup(['/b']), '/a')
+
+    def test_url_being_recorded_ends_chain(self):
+        # the previous URL is added before the current URL is updated
+        final_targets, cycles = URLRedirect.objects.follow_chains({
+            '/a': '/b',
+            '/b': '/b',
+        })
+        self.assertEqual(final_targets['/a'], '/b')
+        self.assertEqual(cycles, set())
+
+    def test_collapse_chains_command(self):
+        self.create_url_method('/b').old_urls.create(url='/a')
+        self.create_url_method('/c').old_urls.create(url='/b')
+        URLRedirect.objects.filter(url='/a').update(target='/b', target_hash=hash_url('/b'))
+        self.create_url_method('/y').old_urls.create(url='/x')
+        self.create_url_method('/x').old_urls.create(url='/y')
+
+        stdout, stderr = StringIO(), StringIO()
+        call_command('url_tracker_collapse_chains', stdout=stdout, stderr=stderr)
+
+        self.assertEqual(URLRedirect.objects.lookup(['/a']), '/c')
+        self.assertIn('Collapsed 1 redirect chains, found 2 redirect cycles', stdout.getvalue())
+        self.assertIn('Redirect cycle: /x', stderr.getvalue())
@@ -0,0 +1,114 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.cache import redirect_cache
+from url_tracker.models import OldURL, URLChangeMethod
+from url_tracker.normalize import normalize_url
+from url_tracker.trackers import add_old_url, track_changed_url
+
+from .models import TestModel, reverse_model
+
+
+class TestNormalizeURL(TestCase):
+    def test_unchanged_by_default(self):
+        self.assertEqual(normalize_url('/Path/?b=2&a=1'), '/Path/?b=2&a=1')
+
+    @override_settings(URL_TRACKER_NORMALIZE_LOWERCASE=True)
+    def test_lowercase_path(self):
+        self.assertEqual(normalize_url('/Path/?Q=A'), '/path/?Q=A')
+
+    @override_settings(URL_TRACKER_NORMALIZE_TRAILING_SLASH=True)
+    def test_trailing_slash(self):
+        self.assertEqual(normalize_url('/path/?a=1'), '/path?a=1')
+        self.assertEqual(normalize_url('/path'), '/path')
+        self.assertEqual(normalize_url('/'), '/')
+
+    @override_settings(URL_TRACKER_NORMALIZE_QUERY='sort')
+    def test_sort_query(self):
+        self.assertEqual(normalize_url('/path?b=2&a=1'), '/path?a=1&b=2')
+
+    @override_settings(URL_TRACKER_NORMALIZE_QUERY='ignore')
+    def test_ignore_query(self):
+        self.assertEqual(normalize_url('/path?b=2&a=1'), '/path')
+
+    @override_settings(URL_TRACKER_NORMALIZE_STRIP_PARAMS=['utm_*', 'ref'])
+    def test_strip_params(self):
+        self.assertEqual(
+            normalize_url('/path?utm_source=x&page=2&ref=y&utm_medium=z'),
+            '/path?page=2'
+        )
+        self.assertEqual(normalize_url('/path?utm_source=x'), '/path')
+
+    @override_settings(URL_TRACKER_NORMALIZE_QUERY='unknown')
+    def test_invalid_query_mode(self):
+        self.assertRaises(ImproperlyConfigured, normalize_url, '/path')
+
+
+@override_settings(
+    APPEND_SLASH=True,
+    URL_TRACKER_CACHE_SIZE=0,
+    URL_TRACKER_NORMALIZE_LOWERCASE=True,
+    URL_TRACKER_NORMALIZE_TRAILING_SLASH=True,
+    URL_TRACKER_NORMALIZE_QUERY='sort',
+    URL_TRACKER_NORMALIZE_STRIP_PARAMS=['utm_*'],
+)
+class TestNormalizedLookup(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        self.instance = TestModel.objects.create(slug='current')
+        add_old_url(self.instance, 'get_absolute_url', '/Old/Page/?b=2&a=1')
+        url_method = URLChangeMethod.objects.get()
+        url_method.current_url = '/new/page/'
+        url_method.save()
+
+    def test_stored_normalized(self):
+        self.assertEqual(OldURL.objects.get().url, '/old/page?a=1&b=2')
+
+    def test_variants_with_one_query(self):
+        for url in ('/old/page?a=1&b=2',
+                    '/Old/Page/?b=2&a=1',
+                    '/OLD/page?utm_source=mail&a=1&b=2'):
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertRedirects(
+                response,
+                '/new/page/',
+                status_code=301,
+                fetch_redirect_response=False
+            )
+
+    def test_unnormalized_old_url(self):
+        # e.g. created in the admin
+        old_url = OldURL.objects.create(url='/Other/')
+        URLChangeMethod.objects.get().old_urls.add(old_url)
+
+        response = self.client.get('/other')
+        self.assertRedirects(
+            response,
+            '/new/page/',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_unnormalized_old_url_reused(self):
+        old_url = OldURL.objects.create(url='/Other/')
+        add_old_url(self.instance, 'get_absolute_url', '/other')
+
+        self.assertEqual(OldURL.objects.filter(url_hash=old_url.url_hash).count(), 1)
+        self.assertEqual(
+            list(URLChangeMethod.objects.get().old_urls.order_by('pk')),
+            [OldURL.objects.get(url='/old/page?a=1&b=2'), old_url]
+        )
+
+    def test_current_url_variant_no_longer_old(self):
+        add_old_url(self.instance, 'get_absolute_url', reverse_model('current').upper())
+        track_changed_url(self.instance)
+
+        self.assertEqual(
+            list(OldURL.objects.values_list('url', flat=True)),
+            ['/old/page?a=1&b=2']
+        )
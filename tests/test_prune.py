@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.six import StringIO
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.models import OldURL, URLChangeMethod, URLRedirect
+
+from .models import TestModel
+
+
+class TestPrune(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.ancient = self.create_old_url('/ancient', days=400)
+        self.hit = self.create_old_url('/hit', days=400, last_hit_days=1)
+        self.recent = self.create_old_url('/recent', days=1)
+        self.orphan = OldURL.objects.create(url='/orphan')
+
+    def create_old_url(self, url, days, last_hit_days=None):
+        old_url = self.url_method.old_urls.create(url=url)
+        OldURL.objects.filter(pk=old_url.pk).update(
+            created=self.now - timedelta(days=days),
+            last_hit=None if last_hit_days is None else self.now - timedelta(days=last_hit_days)
+        )
+        return old_url
+
+    def remaining(self):
+        return set(OldURL.objects.values_list('url', flat=True))
+
+    def test_older_than(self):
+        pruned = OldURL.objects.prune(older_than=self.now - timedelta(days=365))
+        self.assertEqual(pruned, 2)
+        self.assertEqual(self.remaining(), set(['/recent', '/orphan']))
+        self.assertFalse(URLRedirect.objects.filter(url='/ancient').exists())
+        self.assertEqual(self.url_method.old_urls.count(), 1)
+
+    def test_not_hit_since(self):
+        pruned = OldURL.objects.prune(not_hit_since=self.now - timedelta(days=30))
+        self.assertEqual(pruned, 1)
+        self.assertEqual(self.remaining(), set(['/hit', '/recent', '/orphan']))
+
+    def test_older_than_and_not_hit_since(self):
+        pruned = OldURL.objects.prune(
+            older_than=self.now - timedelta(days=365),
+            not_hit_since=self.now - timedelta(days=30),
+            orphans=True
+        )
+        self.assertEqual(pruned, 2)
+        self.assertEqual(self.remaining(), set(['/hit', '/recent']))
+
+    def test_orphans(self):
+        self.assertEqual(OldURL.objects.prune(orphans=True), 1)
+        self.assertNotIn('/orphan', self.remaining())
+
+    def test_url_method_without_old_urls_deleted(self):
+        OldURL.objects.prune(older_than=self.now, orphans=True, batch_size=2)
+        self.assertFalse(OldURL.objects.exists())
+        self.assertFalse(URLChangeMethod.objects.exists())
+        self.assertFalse(URLRedirect.objects.exists())
+
+    def test_dry_run(self):
+        pruned = OldURL.objects.prune(older_than=self.now, orphans=True, dry_run=True)
+        self.assertEqual(pruned, 4)
+        self.assertEqual(OldURL.objects.count(), 4)
+
+    def test_batches(self):
+        pruned = OldURL.objects.prune(older_than=self.now, batch_size=1)
+        self.assertEqual(pruned, 3)
+        self.assertEqual(self.remaining(), set(['/orphan']))
+        self.assertFalse(URLChangeMethod.objects.exists())
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('url_tracker_prune', older_than=365, dry_run=True, stdout=stdout)
+        self.assertIn("Would delete 2 old URLs.", stdout.getvalue())
+
+        call_command('url_tracker_prune', orphans=True, stdout=stdout)
+        self.assertIn("Deleted 1 old URLs.", stdout.getvalue())
+
+    def test_command_without_criteria(self):
+        self.assertRaises(CommandError, call_command, 'url_tracker_prune')
+
+    def test_command_not_hit_for_requires_hit_counts(self):
+        self.assertRaises(
+            CommandError, call_command, 'url_tracker_prune', not_hit_for=30
+        )
+        self.assertEqual(OldURL.objects.count(), 4)
+
+        with override_settings(URL_TRACKER_HIT_COUNTS=True):
+            stdout = StringIO()
+            call_command('url_tracker_prune', not_hit_for=30, stdout=stdout)
+        self.assertIn("Deleted 1 old URLs.", stdout.getvalue())
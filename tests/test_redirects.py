@@ -1,3 +1,6 @@
+from unittest import skipIf
+
+import django
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
@@ -79,3 +82,52 @@ class RedirectTests(TestCase, RemoveSignals):
     def test_sites_not_installed(self):
         with self.assertRaises(ImproperlyConfigured):
             URLChangePermanentRedirectMiddleware()
+
+
+@override_settings(APPEND_SLASH=False, URL_TRACKER_CACHE_SIZE=0)
+class LookupModeTests(TestCase):
+
+    def setUp(self):
+        self.TestModel = TestModel.objects.create(slug='live')
+        self.URLChangeMethod = URLChangeMethod.objects.create(
+            content_object=self.TestModel,
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.URLChangeMethod.old_urls.create(url='/testmodel/live/')
+        self.URLChangeMethod.old_urls.create(url='/initial')
+
+    def test_fallback_ignores_resolving_urls(self):
+        # only the query of the detail view
+        with self.assertNumQueries(1):
+            response = self.client.get('/testmodel/live/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_fallback_redirects_404(self):
+        response = self.client.get('/initial')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @override_settings(URL_TRACKER_EAGER_LOOKUP=True)
+    def test_eager_redirects_resolving_urls(self):
+        response = self.client.get('/testmodel/live/')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @skipIf(django.VERSION < (1, 10), "the MIDDLEWARE setting was added in Django 1.10")
+    @override_settings(
+        MIDDLEWARE=['url_tracker.middleware.URLChangePermanentRedirectMiddleware'],
+        MIDDLEWARE_CLASSES=None
+    )
+    def test_new_style_middleware(self):
+        response = self.client.get('/initial')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(self.client.get('/testmodel/live/').status_code, 200)
@@ -0,0 +1,201 @@
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.cache import redirect_cache
+from url_tracker.models import URLChangeMethod, RedirectRule
+from url_tracker.rules import RuleTrie, is_nested, redirect_rules, suggest_rules
+
+from .models import TestModel
+
+
+class TestRuleTrie(TestCase):
+    def test_prefix(self):
+        trie = RuleTrie([('/blog/2019/', '/articles/')])
+        self.assertEqual(trie.match('/blog/2019/post/'), '/articles/post/')
+        self.assertEqual(trie.match('/blog/2019/'), '/articles/')
+        self.assertEqual(trie.match('/blog/2019'), '/articles/')
+        self.assertIsNone(trie.match('/blog/2019x/post/'))
+        self.assertIsNone(trie.match('/blog/'))
+
+    def test_longest_prefix_wins(self):
+        trie = RuleTrie([
+            ('/blog/', '/news/'),
+            ('/blog/2019/', '/articles/'),
+        ])
+        self.assertEqual(trie.match('/blog/2019/post/'), '/articles/post/')
+        self.assertEqual(trie.match('/blog/2018/post/'), '/news/2018/post/')
+
+    def test_wildcard(self):
+        trie = RuleTrie([
+            ('/blog/*/', '/articles/'),
+            ('/blog/2019/', '/archive/'),
+        ])
+        self.assertEqual(trie.match('/blog/2018/post/'), '/articles/post/')
+        self.assertEqual(trie.match('/blog/2019/post/'), '/archive/post/')
+
+    def test_gone(self):
+        trie = RuleTrie([('/tmp/', '')])
+        self.assertEqual(trie.match('/tmp/file'), '')
+
+    def test_many_rules(self):
+        trie = RuleTrie(
+            ('/section/%d/' % i, '/new/%d/' % i) for i in range(1000)
+        )
+        self.assertEqual(len(trie), 1000)
+        self.assertEqual(trie.match('/section/999/page/'), '/new/999/page/')
+
+    @override_settings(URL_TRACKER_NORMALIZE_LOWERCASE=True)
+    def test_normalized_prefix(self):
+        trie = RuleTrie([('/Blog/', '/news/')])
+        self.assertEqual(trie.match('/blog/post'), '/news/post')
+
+
+class TestRedirectRule(TestCase):
+    def test_nested(self):
+        self.assertTrue(is_nested('/blog/', '/blog/archive/'))
+        self.assertTrue(is_nested('/blog/', '/blog'))
+        self.assertTrue(is_nested('/blog/*/', '/blog/2019/posts/'))
+        self.assertFalse(is_nested('/blog/', '/news/blog/'))
+        self.assertFalse(is_nested('/blog/archive/', '/blog/'))
+        self.assertFalse(is_nested('/blog/', ''))
+
+    def test_clean(self):
+        RedirectRule(old_prefix='/blog/', new_prefix='/news/').full_clean()
+        rule = RedirectRule(old_prefix='/blog/', new_prefix='/blog/archive/')
+        with self.assertRaises(ValidationError) as context:
+            rule.full_clean()
+        self.assertIn('new_prefix', context.exception.message_dict)
+
+
+@override_settings(APPEND_SLASH=False)
+class TestRulesMiddleware(TestCase):
+    def setUp(self):
+        redirect_cache.clear()
+        redirect_rules.reset()
+        RedirectRule.objects.create(old_prefix='/blog/2019/', new_prefix='/articles/')
+
+    def tearDown(self):
+        # the rolled back rules don't send any signals
+        redirect_rules.reset()
+
+    def test_redirect(self):
+        response = self.client.get('/blog/2019/post/?page=2')
+        self.assertRedirects(
+            response,
+            '/articles/post/?page=2',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    def test_gone(self):
+        RedirectRule.objects.create(old_prefix='/tmp/', new_prefix='')
+        self.assertEqual(self.client.get('/tmp/file').status_code, 410)
+
+    def test_tracked_url_takes_precedence(self):
+        url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        url_method.old_urls.create(url='/blog/2019/post/')
+
+        response = self.client.get('/blog/2019/post/')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @override_settings(
+        URL_TRACKER_NORMALIZE_LOWERCASE=True,
+        URL_TRACKER_NORMALIZE_TRAILING_SLASH=True
+    )
+    def test_normalized_path(self):
+        response = self.client.get('/Blog/2019/Post/')
+        self.assertRedirects(
+            response,
+            '/articles/post',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @override_settings(URL_TRACKER_RULES_POLL_INTERVAL=60)
+    def test_compiled_once(self):
+        self.client.get('/blog/2019/post/')
+        with self.assertNumQueries(1):
+            # only the lookup of the tracked URLs
+            self.client.get('/blog/2019/other/')
+
+    @override_settings(URL_TRACKER_RULES_POLL_INTERVAL=60)
+    def test_compiled_again_after_change(self):
+        self.client.get('/blog/2019/post/')
+        RedirectRule.objects.create(old_prefix='/shop/', new_prefix='/store/')
+
+        self.assertRedirects(
+            self.client.get('/shop/item'),
+            '/store/item',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+
+class TestSuggestRules(TestCase):
+    def setUp(self):
+        for i in range(5):
+            url_method = URLChangeMethod.objects.create(
+                content_object=TestModel.objects.create(),
+                method_name='get_absolute_url',
+                current_url='/articles/post-%d/' % i,
+            )
+            url_method.old_urls.create(url='/blog/2019/post-%d/' % i)
+
+    def test_suggest(self):
+        self.assertEqual(
+            suggest_rules(min_urls=5),
+            [('/blog/2019/', '/articles/', 5, 0)]
+        )
+        self.assertEqual(suggest_rules(min_urls=6), [])
+
+    def test_conflicts(self):
+        url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/elsewhere/post-5/',
+        )
+        url_method.old_urls.create(url='/blog/2019/post-5/')
+        self.assertEqual(
+            suggest_rules(min_urls=5),
+            [('/blog/2019/', '/articles/', 5, 1)]
+        )
+
+    def test_nested_rules_left_out(self):
+        for i in range(5):
+            url_method = URLChangeMethod.objects.create(
+                content_object=TestModel.objects.create(),
+                method_name='get_absolute_url',
+                current_url='/shop/archive/item-%d/' % i,
+            )
+            url_method.old_urls.create(url='/shop/item-%d/' % i)
+        self.assertEqual(
+            suggest_rules(min_urls=5),
+            [('/blog/2019/', '/articles/', 5, 0)]
+        )
+
+    def test_command_creates_rules(self):
+        stdout = StringIO()
+        call_command(
+            'url_tracker_suggest_rules',
+            min_urls=5,
+            create=True,
+            stdout=stdout
+        )
+        self.assertIn("/blog/2019/ -> /articles/: 5 redirects", stdout.getvalue())
+        rule = RedirectRule.objects.get()
+        self.assertEqual(rule.new_prefix, '/articles/')
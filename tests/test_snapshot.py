@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.utils.six import StringIO
+from django.test import TestCase
+try:
+    from django.test.utils import override_settings
+except ImportError:
+    from override_settings import override_settings
+
+from url_tracker.cache import redirect_cache, MISSING
+from url_tracker.middleware import URLChangePermanentRedirectMiddleware
+from url_tracker.models import OldURL, URLChangeMethod, URLRedirectChange
+from url_tracker.snapshot import (
+    ChangeLogCursor, RedirectSnapshot, build_snapshot, reset_snapshot_lookup
+)
+
+from .models import TestModel
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot')
+        self.url_method = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+            current_url='/new_target',
+        )
+        self.url_method.old_urls.create(url='/initial')
+
+    def tearDown(self):
+        reset_snapshot_lookup()
+        shutil.rmtree(self.directory)
+
+
+class TestRedirectSnapshot(SnapshotTestCase):
+    def test_lookup(self):
+        self.url_method.old_urls.create(url='/other')
+        gone = URLChangeMethod.objects.create(
+            content_object=TestModel.objects.create(),
+            method_name='get_absolute_url',
+        )
+        gone.old_urls.create(url='/gone')
+        build_snapshot(self.path)
+
+        snapshot = RedirectSnapshot.open(self.path)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot.get('/initial'), '/new_target')
+        self.assertEqual(snapshot.get('/other'), '/new_target')
+        self.assertEqual(snapshot.get('/gone'), '')
+        self.assertIsNone(snapshot.get('/untracked'))
+        snapshot.close()
+
+    def test_lookup_many(self):
+        urls = ['/old/%d' % i for i in range(200)]
+        for url in urls:
+            self.url_method.old_urls.create(url=url)
+        build_snapshot(self.path, batch_size=7)
+
+        snapshot = RedirectSnapshot.open(self.path)
+        for url in urls:
+            self.assertEqual(snapshot.get(url), '/new_target')
+        snapshot.close()
+
+    def test_prunes_changes_of_previous_snapshot(self):
+        with override_settings(URL_TRACKER_SNAPSHOT_FILE=self.path,
+                               URL_TRACKER_CHANGE_LOG_OVERLAP=1):
+            self.url_method.old_urls.create(url='/first')
+            build_snapshot(self.path)
+            snapshot = RedirectSnapshot.open(self.path)
+            generation = snapshot.generation
+            snapshot.close()
+            self.url_method.old_urls.create(url='/second')
+            build_snapshot(self.path)
+
+        self.assertFalse(URLRedirectChange.objects.filter(pk__lt=generation).exists())
+        self.assertTrue(URLRedirectChange.objects.filter(pk=generation).exists())
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command('url_tracker_snapshot', path=self.path, stdout=stdout)
+
+        self.assertIn("Wrote 1 redirects", stdout.getvalue())
+        snapshot = RedirectSnapshot.open(self.path)
+        self.assertEqual(snapshot.get('/initial'), '/new_target')
+        snapshot.close()
+
+
+@override_settings(APPEND_SLASH=False, URL_TRACKER_CACHE_SIZE=0)
+class TestSnapshotMiddleware(SnapshotTestCase):
+    def setUp(self):
+        super(TestSnapshotMiddleware, self).setUp()
+        redirect_cache.clear()
+        build_snapshot(self.path)
+        self.settings = override_settings(URL_TRACKER_SNAPSHOT_FILE=self.path)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        super(TestSnapshotMiddleware, self).tearDown()
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=60)
+    def test_without_queries(self):
+        # polls the changes once
+        self.client.get('/initial')
+        with self.assertNumQueries(0):
+            redirect = self.client.get('/initial')
+            not_found = self.client.get('/untracked')
+        self.assertRedirects(
+            redirect,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+        self.assertEqual(not_found.status_code, 404)
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=60)
+    def test_known_without_io(self):
+        middleware = URLChangePermanentRedirectMiddleware()
+        self.assertIs(middleware.get_known_new_url('/initial', ['/initial']), MISSING)
+        self.client.get('/initial')
+
+        self.assertEqual(
+            middleware.get_known_new_url('/initial', ['/initial']),
+            '/new_target'
+        )
+        self.assertIsNone(middleware.get_known_new_url('/untracked', ['/untracked']))
+        self.url_method.old_urls.create(url='/other')
+        self.assertIs(middleware.get_known_new_url('/other', ['/other']), MISSING)
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=60)
+    def test_changes_in_this_process(self):
+        self.client.get('/initial')
+        self.url_method.current_url = '/changed'
+        self.url_method.save()
+        self.url_method.old_urls.create(url='/other')
+
+        self.assertRedirects(
+            self.client.get('/initial'),
+            '/changed',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+        self.assertRedirects(
+            self.client.get('/other'),
+            '/changed',
+            status_code=301,
+            fetch_redirect_response=False
+        )
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=0)
+    def test_polls_changes(self):
+        self.client.get('/initial')
+        URLRedirectChange.objects.create(url_hash='0' * 32)
+        with self.assertNumQueries(1):
+            self.client.get('/initial')
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=0)
+    def test_deleted_old_url(self):
+        self.client.get('/initial')
+        OldURL.objects.get(url='/initial').delete()
+
+        self.assertEqual(self.client.get('/initial').status_code, 404)
+
+    @override_settings(URL_TRACKER_SNAPSHOT_POLL_INTERVAL=0)
+    def test_switches_to_new_snapshot(self):
+        self.client.get('/initial')
+        self.url_method.old_urls.create(url='/other')
+        # nothing below the generation to read again
+        URLRedirectChange.objects.all().delete()
+        build_snapshot(self.path)
+
+        # only the query polling the changes
+        with self.assertNumQueries(1):
+            response = self.client.get('/other')
+        self.assertRedirects(
+            response,
+            '/new_target',
+            status_code=301,
+            fetch_redirect_response=False
+        )
@@ -1,11 +1,19 @@
+from unittest import skipIf
+
+import django
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.db.models import signals
 
-from url_tracker.trackers import lookup_previous_url, track_changed_url, track_url_changes_for_model, add_old_url
-from url_tracker.models import URLChangeMethod
+from url_tracker import URLTrackingQuerySet, track_bulk_changes
+from url_tracker.trackers import lookup_previous_url, track_changed_url, track_url_changes_for_model, add_old_url, add_old_urls
+from url_tracker.trackers import bulk_create_ignoring_conflicts, record_url_changes
+from url_tracker.models import URLChangeMethod, OldURL, URLRedirect
 
-from .models import TestModel, reverse_model, RemoveSignals
+from .models import TestModel, reverse_model, captured_sql, RemoveSignals
 
 
 class TestTrackUrlForModel(RemoveSignals, TransactionTestCase):
@@ -14,12 +22,16 @@ class TestTrackUrlForModel(RemoveSignals, TransactionTestCase):
         self.function_from_signals = lambda signal: list(map(lambda _: _[1], signal.receivers))
 
     def test_model_without_url_method(self):
+        url_tracking_methods = TestModel.url_tracking_methods
         TestModel.url_tracking_methods = []
-        self.assertRaises(
-            ImproperlyConfigured,
-            track_url_changes_for_model,
-            TestModel,
-        )
+        try:
+            self.assertRaises(
+                ImproperlyConfigured,
+                track_url_changes_for_model,
+                TestModel,
+            )
+        finally:
+            TestModel.url_tracking_methods = url_tracking_methods
 
     def test_adds_pre_save_signal(self):
         self.assertFalse(self.function_from_signals(signals.pre_save))
@@ -48,12 +60,15 @@ class TestLookupUrl(RemoveSignals, TransactionTestCase):
 
     def test_new_instance_create(self):
         instance = TestModel.objects.create(slug='initial')
-        instance.get_absolute_url()
+        instance.slug = 'final'
         lookup_previous_url(instance)
+        self.assertEqual(URLChangeMethod.objects.count(), 0)
+        track_changed_url(instance)
 
         self.assertEqual(URLChangeMethod.objects.count(), 1)
         url_method = URLChangeMethod.objects.all()[0]
         self.assertEqual(url_method.method_name, 'get_absolute_url')
+        self.assertEqual(url_method.current_url, reverse_model('final'))
 
         self.assertEqual(url_method.old_urls.count(), 1)
         old_url = url_method.old_urls.all()[0]
@@ -97,6 +112,25 @@ class TestChangedUrl(RemoveSignals, TransactionTestCase):
         url_method = URLChangeMethod.objects.all()[0]
         self.assertEqual(url_method.current_url, reverse_model('current'))
 
+    def test_looks_up_url_methods_once(self):
+        instance = TestModel.objects.create(slug='current', text='/text')
+        for method_name in ('get_absolute_url', 'get_text'):
+            URLChangeMethod.objects.create(
+                content_object=instance,
+                method_name=method_name,
+            ).old_urls.create(url='/old/%s' % method_name)
+        with CaptureQueriesContext(connection) as queries:
+            track_changed_url(instance)
+        selects = [
+            sql for sql in captured_sql(queries, 'SELECT')
+            if 'FROM "url_tracker_urlchangemethod" ' in sql
+        ]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(
+            set(URLChangeMethod.objects.values_list('current_url', flat=True)),
+            set([reverse_model('current'), '/text'])
+        )
+
     def test_same_url_dont_create(self):
         instance = TestModel.objects.create(slug='initial')
         url_method = URLChangeMethod.objects.create(
@@ -108,6 +142,34 @@ class TestChangedUrl(RemoveSignals, TransactionTestCase):
         self.assertEqual(URLChangeMethod.objects.count(), 0)
 
 
+    def test_unchanged_url_writes_nothing(self):
+        instance = TestModel.objects.create(slug='current')
+        url_method = URLChangeMethod.objects.create(
+            content_object=instance,
+            method_name='get_absolute_url',
+            current_url=reverse_model('current'),
+        )
+        url_method.old_urls.create(url=reverse_model('another'))
+        instance.text = 'changed'
+        with CaptureQueriesContext(connection) as queries:
+            lookup_previous_url(instance)
+            track_changed_url(instance)
+        self.assertEqual(
+            captured_sql(queries, 'INSERT', 'UPDATE', 'DELETE'),
+            []
+        )
+        self.assertEqual(OldURL.objects.count(), 1)
+
+    def test_old_url_never_equal_to_new_url(self):
+        instance = TestModel.objects.create(slug='current')
+        with self.settings(URL_TRACKER_NORMALIZE_TRAILING_SLASH=True):
+            record_url_changes([
+                (instance, 'get_absolute_url', '/current/', '/current'),
+            ])
+        self.assertFalse(URLChangeMethod.objects.exists())
+        self.assertFalse(OldURL.objects.exists())
+
+
 class TestAddOldUrl(RemoveSignals, TransactionTestCase):
     def test_without_previous_tracking(self):
         instance = TestModel.objects.create(slug='initial')
@@ -118,3 +180,320 @@ class TestAddOldUrl(RemoveSignals, TransactionTestCase):
         self.assertEqual(url_method.old_urls.count(), 1)
         old_url = url_method.old_urls.all()[0]
         self.assertEqual(old_url.url, 'old_url')
+
+
+class TestBulkCreateIgnoringConflicts(TransactionTestCase):
+    def test_existing_url_method_not_duplicated(self):
+        instance = TestModel.objects.create(slug='initial')
+        URLChangeMethod.objects.create(
+            content_object=instance,
+            method_name='get_absolute_url'
+        )
+        content_type = ContentType.objects.get_for_model(TestModel)
+        bulk_create_ignoring_conflicts(
+            URLChangeMethod,
+            [
+                URLChangeMethod(
+                    content_type=content_type,
+                    object_id=str(instance.pk),
+                    method_name=method_name
+                )
+                for method_name in ('get_absolute_url', 'get_text')
+            ],
+            ['content_type_id', 'object_id', 'method_name']
+        )
+        self.assertEqual(
+            sorted(URLChangeMethod.objects.values_list('method_name', flat=True)),
+            ['get_absolute_url', 'get_text']
+        )
+
+
+class TestLookupUrlQueries(RemoveSignals, TransactionTestCase):
+    def setUp(self):
+        self.instance = TestModel.objects.create(slug='initial', text='text')
+        # the content type is cached after the first lookup
+        add_old_url(self.instance, 'get_absolute_url', 'warm_up')
+
+    def test_fetches_instance_once(self):
+        self.instance.slug = 'final'
+        self.instance.text = 'final text'
+        with CaptureQueriesContext(connection) as queries:
+            lookup_previous_url(self.instance)
+        track_changed_url(self.instance)
+        selects = [
+            sql for sql in captured_sql(queries) if 'FROM "tests_testmodel"' in sql
+        ]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(
+            set(URLChangeMethod.objects.values_list('method_name', flat=True)),
+            set(['get_absolute_url', 'get_text'])
+        )
+
+    def test_only_fetches_declared_fields(self):
+        TestModel.url_tracking_fields = {
+            'get_absolute_url': ['slug'],
+            'get_text': [],
+        }
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                lookup_previous_url(self.instance)
+        finally:
+            del TestModel.url_tracking_fields
+        select = [
+            sql for sql in captured_sql(queries) if 'FROM "tests_testmodel"' in sql
+        ][0]
+        self.assertIn('"tests_testmodel"."slug"', select)
+        self.assertNotIn('"tests_testmodel"."text"', select)
+
+    def test_constant_number_of_queries(self):
+        other = TestModel.objects.create(slug='other')
+        with CaptureQueriesContext(connection) as one:
+            add_old_urls([(self.instance, 'get_text', '/one')])
+        with CaptureQueriesContext(connection) as many:
+            add_old_urls([
+                (other, method_name, '/%s/%d' % (method_name, i))
+                for method_name in ('get_absolute_url', 'get_text')
+                for i in range(10)
+            ])
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(OldURL.objects.count(), 22)
+
+
+class TestTrackBulkChanges(RemoveSignals, TransactionTestCase):
+    def setUp(self):
+        for i in range(20):
+            TestModel.objects.create(slug='initial%d' % i, text='text%d' % i)
+        # the content type is cached after the first lookup
+        ContentType.objects.get_for_model(TestModel)
+
+    def test_update(self):
+        URLTrackingQuerySet(model=TestModel).filter(slug='initial1').update(slug='final')
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.method_name, 'get_absolute_url')
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial1')]
+        )
+        self.assertEqual(
+            URLRedirect.objects.lookup([reverse_model('initial1')]),
+            reverse_model('final')
+        )
+
+    def test_constant_number_of_queries(self):
+        with CaptureQueriesContext(connection) as one:
+            URLTrackingQuerySet(model=TestModel).filter(
+                slug='initial0').update(slug='final', text='changed')
+        with CaptureQueriesContext(connection) as many:
+            with track_bulk_changes(TestModel.objects.exclude(slug='final')):
+                TestModel.objects.exclude(slug='final').update(
+                    slug='final', text='changed')
+        self.assertEqual(len(many), len(one))
+        self.assertEqual(URLChangeMethod.objects.count(), 2 * 20)
+        self.assertEqual(OldURL.objects.count(), 2 * 20)
+
+    def test_update_of_other_fields_not_tracked(self):
+        TestModel.url_tracking_fields = {
+            'get_absolute_url': ['slug'],
+            'get_text': [],
+        }
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                URLTrackingQuerySet(model=TestModel).update(text='changed')
+            # the objects aren't fetched
+            self.assertFalse(captured_sql(queries, 'SELECT'))
+            URLTrackingQuerySet(model=TestModel).filter(slug='initial1').update(
+                slug='final'
+            )
+        finally:
+            del TestModel.url_tracking_fields
+        self.assertEqual(
+            list(URLChangeMethod.objects.values_list('method_name', flat=True)),
+            ['get_absolute_url']
+        )
+
+    def test_url_changed_back(self):
+        queryset = URLTrackingQuerySet(model=TestModel).filter(slug='initial1')
+        queryset.update(slug='final')
+        URLTrackingQuerySet(model=TestModel).filter(slug='final').update(slug='initial1')
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('initial1'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('final')]
+        )
+        self.assertIsNone(URLRedirect.objects.lookup([reverse_model('initial1')]))
+
+
+class TestTrackingFields(RemoveSignals, TransactionTestCase):
+    def setUp(self):
+        TestModel.url_tracking_fields = {
+            'get_absolute_url': ['slug'],
+            'get_text': ['text'],
+        }
+        track_url_changes_for_model(TestModel)
+        TestModel.objects.create(slug='initial', text='text')
+        self.instance = TestModel.objects.get()
+
+    def tearDown(self):
+        del TestModel.url_tracking_fields
+        super(TestTrackingFields, self).tearDown()
+
+    def test_unchanged_fields_without_queries(self):
+        # only the save itself
+        with self.assertNumQueries(2):
+            self.instance.save()
+        self.assertFalse(URLChangeMethod.objects.exists())
+
+    def test_fields_not_in_update_fields_skipped(self):
+        self.instance.slug = 'final'
+        with self.assertNumQueries(2):
+            self.instance.save(update_fields=['text'])
+        self.assertFalse(URLChangeMethod.objects.exists())
+
+    def test_changed_field_without_fetching_instance(self):
+        self.instance.slug = 'final'
+        with CaptureQueriesContext(connection) as queries:
+            self.instance.save()
+        self.assertFalse([
+            sql for sql in captured_sql(queries, 'SELECT')
+            if 'FROM "tests_testmodel"' in sql
+        ])
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.method_name, 'get_absolute_url')
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+    def count_calls(self):
+        calls = []
+        get_absolute_url = TestModel.get_absolute_url
+
+        def counting(instance):
+            calls.append(instance.slug)
+            return get_absolute_url(instance)
+        TestModel.get_absolute_url = counting
+        self.addCleanup(setattr, TestModel, 'get_absolute_url', get_absolute_url)
+        return calls
+
+    def test_url_computed_once_per_state(self):
+        calls = self.count_calls()
+        self.instance.slug = 'second'
+        self.instance.save()
+        self.instance.slug = 'final'
+        self.instance.save()
+
+        # the URL computed after the first save is the previous URL of the second
+        self.assertEqual(calls, ['initial', 'second', 'final'])
+        self.assertEqual(
+            set(URLChangeMethod.objects.get().old_urls.values_list('url', flat=True)),
+            set([reverse_model('initial'), reverse_model('second')])
+        )
+
+    def test_shared_reverse_cache(self):
+        from url_tracker.trackers import reverse_cache
+
+        calls = self.count_calls()
+        self.addCleanup(reverse_cache.clear)
+        with self.settings(URL_TRACKER_REVERSE_CACHE_SIZE=100):
+            self.instance.slug = 'final'
+            self.instance.save()
+            other = TestModel.objects.get()
+            other.slug = 'initial'
+            other.save()
+        self.assertEqual(calls, ['initial', 'final'])
+        self.assertEqual(
+            URLRedirect.objects.lookup([reverse_model('final')]),
+            reverse_model('initial')
+        )
+
+    def test_snapshot_updated_on_save(self):
+        self.instance.slug = 'second'
+        self.instance.save()
+        self.instance.slug = 'final'
+        self.instance.save()
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(url_method.current_url, reverse_model('final'))
+        self.assertEqual(
+            set(url_method.old_urls.values_list('url', flat=True)),
+            set([reverse_model('initial'), reverse_model('second')])
+        )
+
+    @skipIf(
+        django.VERSION < (1, 10),
+        "instances with deferred fields are of a subclass that doesn't send "
+        "the signals of the model before Django 1.10"
+    )
+    def test_deferred_field_fetched(self):
+        instance = TestModel.objects.only('text').get()
+        instance.slug = 'final'
+        instance.save()
+
+        url_method = URLChangeMethod.objects.get()
+        self.assertEqual(
+            list(url_method.old_urls.values_list('url', flat=True)),
+            [reverse_model('initial')]
+        )
+
+
+class TestTrackDeletedUrls(RemoveSignals, TransactionTestCase):
+    def setUp(self):
+        track_url_changes_for_model(TestModel)
+        self.instance = TestModel.objects.create(slug='initial', text='/text')
+
+    def test_delete_records_gone_urls(self):
+        self.instance.delete()
+
+        self.assertEqual(
+            URLRedirect.objects.lookup_many([reverse_model('initial'), '/text']),
+            {reverse_model('initial'): '', '/text': ''}
+        )
+        response = self.client.get(reverse_model('initial'))
+        self.assertEqual(response.status_code, 410)
+
+    def test_delete_marks_old_urls_gone(self):
+        self.instance.slug = 'final'
+        self.instance.save()
+        self.assertEqual(
+            URLRedirect.objects.lookup([reverse_model('initial')]),
+            reverse_model('final')
+        )
+
+        self.instance.delete()
+        self.assertEqual(URLRedirect.objects.lookup([reverse_model('initial')]), '')
+        self.assertEqual(URLRedirect.objects.lookup([reverse_model('final')]), '')
+
+    def test_queryset_delete(self):
+        for i in range(10):
+            TestModel.objects.create(slug='other%d' % i)
+        with CaptureQueriesContext(connection) as one:
+            TestModel.objects.filter(pk=self.instance.pk).delete()
+        with CaptureQueriesContext(connection) as many:
+            TestModel.objects.all().delete()
+
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(
+            set(URLRedirect.objects.values_list('url', 'target')),
+            set(
+                [(reverse_model('initial'), ''), ('/text', '')] +
+                [(reverse_model('other%d' % i), '') for i in range(10)]
+            )
+        )
+
+    def test_failed_delete_not_recorded(self):
+        from url_tracker.trackers import capture_deleted_urls
+
+        # pre_delete was sent but the delete was rolled back
+        capture_deleted_urls(self.instance, using='default')
+        other = TestModel.objects.create(slug='other')
+        other.delete()
+        self.assertEqual(
+            set(URLRedirect.objects.values_list('url', flat=True)),
+            set([reverse_model('other')])
+        )
@@ -1,4 +1,5 @@
-from url_tracker.trackers import track_url_changes_for_model
+from url_tracker.trackers import track_url_changes_for_model, track_bulk_changes
 from url_tracker.mixins import URLTrackingMixin
+from url_tracker.managers import URLTrackingManager, URLTrackingQuerySet
 
 default_app_config = 'url_tracker.apps.URLTrackerConfig'
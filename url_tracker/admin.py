@@ -1,16 +1,162 @@
+from django.apps import apps
 from django.contrib import admin
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from url_tracker.models import URLChangeMethod, OldURL
+from url_tracker.models import (
+    URLChangeMethod, OldURL, RedirectRule, hash_url, hash_current_url
+)
 
 
-class URLChangeMethodAdmin(admin.ModelAdmin):
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that doesn't count all rows of large tables.
+
+    The unfiltered changelist uses the row estimate PostgreSQL keeps in
+    ``pg_class`` once it exceeds ``count_limit``. Other lists are counted
+    up to ``count_limit`` rows only, later pages of larger results can't be
+    paged to but are narrowed down with search and filters.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = self.estimate_count(queryset)
+        if estimate is not None and estimate > self.count_limit:
+            return estimate
+        return queryset.order_by().values('pk')[:self.count_limit].count()
+
+    def estimate_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+
+class URLTrackerAdmin(admin.ModelAdmin):
+    """
+    Base admin for the tables of old URLs, which may hold millions of rows.
+
+    With ``search_hash_field`` set, searches find the rows whose URL equals
+    the search term through the index of that field, which holds the hash
+    of the URL computed by ``search_hash_function``. The URLs themselves
+    are too long to be indexed.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    search_hash_field = None
+    search_hash_function = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if self.search_hash_field is None:
+            return super(URLTrackerAdmin, self).get_search_results(
+                request, queryset, search_term
+            )
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(**{
+            self.search_hash_field: self.search_hash_function(search_term)
+        }), False
+
+
+def get_tracked_models():
+    return [
+        model for model in apps.get_models()
+        if hasattr(model, 'get_url_tracking_methods')
+    ]
+
+
+class TrackedContentTypeListFilter(admin.SimpleListFilter):
+    """
+    Lists the content types of tracked models instead of all content types.
+    """
+    title = 'content type'
+    parameter_name = 'content_type__id__exact'
+
+    def lookups(self, request, model_admin):
+        content_types = ContentType.objects.get_for_models(*get_tracked_models())
+        return sorted(
+            ((content_type.pk, content_type.name)
+             for content_type in content_types.values()),
+            key=lambda choice: choice[1]
+        )
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(content_type=self.value())
+
+
+class MethodNameListFilter(admin.SimpleListFilter):
+    """
+    Lists the URL methods of tracked models, without the ``DISTINCT`` query
+    over all rows a filter on the field would run.
+    """
+    title = 'method name'
+    parameter_name = 'method_name'
+
+    def lookups(self, request, model_admin):
+        method_names = set()
+        for model in get_tracked_models():
+            method_names.update(model.get_url_tracking_methods())
+        return [(method_name, method_name) for method_name in sorted(method_names)]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(method_name=self.value())
+
+
+class URLChangeMethodAdmin(URLTrackerAdmin):
     list_display = ('content_object', 'method_name', 'current_url')
-    list_filter = ('content_type', 'method_name')
+    list_filter = (TrackedContentTypeListFilter, MethodNameListFilter)
+    search_fields = ('current_url',)
+    search_hash_field = 'current_url_hash'
+    search_hash_function = staticmethod(hash_current_url)
+    raw_id_fields = ('old_urls',)
+
+    def get_queryset(self, request):
+        # the objects of a page are fetched with one query per content type
+        return super(URLChangeMethodAdmin, self).get_queryset(
+            request
+        ).prefetch_related('content_object')
+
+
+class OldURLAdmin(URLTrackerAdmin):
+    list_display = ('url', 'target', 'created', 'hits', 'last_hit')
+    readonly_fields = ('created', 'hits', 'last_hit')
+    search_fields = ('url',)
+    search_hash_field = 'url_hash'
+    search_hash_function = staticmethod(hash_url)
+
+    def get_queryset(self, request):
+        return super(OldURLAdmin, self).get_queryset(
+            request
+        ).prefetch_related('redirects')
+
+    def target(self, obj):
+        """
+        The URL the old URL redirects to, read from the prefetched redirect
+        instead of resolving it through its URL change methods.
+        """
+        for redirect in obj.redirects.all():
+            return redirect.target or '(gone)'
+        return None
 
 
-class OldURLAdmin(admin.ModelAdmin):
-    list_display = ('url',)
+class RedirectRuleAdmin(admin.ModelAdmin):
+    list_display = ('old_prefix', 'new_prefix', 'modified')
+    search_fields = ('old_prefix', 'new_prefix')
 
 
 admin.site.register(URLChangeMethod, URLChangeMethodAdmin)
 admin.site.register(OldURL, OldURLAdmin)
+admin.site.register(RedirectRule, RedirectRuleAdmin)
@@ -1,6 +1,73 @@
 from django.apps import AppConfig
+from django.db.models import signals
 
 
 class URLTrackerConfig(AppConfig):
     name = 'url_tracker'
     verbose_name = "URL Tracker"
+
+    def ready(self):
+        from url_tracker.bloom import update_bloom_filter
+        from url_tracker.cache import invalidate_redirect_cache
+        from url_tracker.rules import reset_redirect_rules
+        from url_tracker.snapshot import log_deleted_old_url
+        from url_tracker.models import (
+            URLChangeMethod,
+            OldURL,
+            RedirectRule,
+            update_redirects_for_old_url,
+            update_redirects_for_url_method,
+            update_redirects_for_deleted_url_method,
+            update_redirects_for_relation,
+        )
+
+        # the redirects have to be updated before the cache is invalidated
+        signals.post_save.connect(
+            update_redirects_for_old_url,
+            sender=OldURL,
+            dispatch_uid='url_tracker_update_redirects_OldURL'
+        )
+        signals.post_save.connect(
+            update_redirects_for_url_method,
+            sender=URLChangeMethod,
+            dispatch_uid='url_tracker_update_redirects_URLChangeMethod'
+        )
+        for signal in (signals.pre_delete, signals.post_delete):
+            signal.connect(
+                update_redirects_for_deleted_url_method,
+                sender=URLChangeMethod,
+                dispatch_uid='url_tracker_update_redirects_deleted_URLChangeMethod'
+            )
+        signals.m2m_changed.connect(
+            update_redirects_for_relation,
+            sender=URLChangeMethod.old_urls.through,
+            dispatch_uid='url_tracker_update_redirects_old_urls'
+        )
+        for model in (URLChangeMethod, OldURL):
+            for signal in (signals.post_save, signals.post_delete):
+                signal.connect(
+                    invalidate_redirect_cache,
+                    sender=model,
+                    dispatch_uid='url_tracker_invalidate_%s' % model.__name__
+                )
+        signals.m2m_changed.connect(
+            invalidate_redirect_cache,
+            sender=URLChangeMethod.old_urls.through,
+            dispatch_uid='url_tracker_invalidate_old_urls'
+        )
+        signals.post_delete.connect(
+            log_deleted_old_url,
+            sender=OldURL,
+            dispatch_uid='url_tracker_log_deleted_old_url'
+        )
+        for signal in (signals.post_save, signals.post_delete):
+            signal.connect(
+                reset_redirect_rules,
+                sender=RedirectRule,
+                dispatch_uid='url_tracker_reset_redirect_rules'
+            )
+        signals.post_save.connect(
+            update_bloom_filter,
+            sender=OldURL,
+            dispatch_uid='url_tracker_update_bloom_filter'
+        )
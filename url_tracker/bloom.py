@@ -0,0 +1,223 @@
+"""
+A Bloom filter over all tracked old URLs.
+
+The middleware consults the filter before querying the database and skips
+the lookup for URLs that are definitely not tracked. The filter is backed by
+a file that is memory-mapped by every worker process so that all of them
+share the same pages and see each other's additions.
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+
+from url_tracker.conf import get_setting
+from url_tracker.normalize import normalize_url
+
+HEADER = struct.Struct('<4sQI')
+MAGIC = b'UTBF'
+
+
+class BloomFilter(object):
+    """
+    A probabilistic set of URLs that can tell for sure that a URL is *not*
+    part of it. The bits are held in an anonymous memory map or, if
+    *file_obj* is given, in a shared memory map of that file. URLs are
+    normalized, so all variants of a URL are part of the set.
+    """
+
+    def __init__(self, num_bits, num_hashes, file_obj=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self._file = file_obj
+        self._lock = threading.Lock()
+        size = HEADER.size + (num_bits + 7) // 8
+        if file_obj is None:
+            self._bits = mmap.mmap(-1, size)
+            self._bits[:HEADER.size] = HEADER.pack(MAGIC, num_bits, num_hashes)
+        else:
+            self._bits = mmap.mmap(file_obj.fileno(), size)
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate, file_obj=None):
+        """
+        Creates a filter sized to hold *capacity* URLs with a false positive
+        rate of *error_rate*.
+        """
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        ))
+        num_hashes = max(1, int(round(num_bits / float(capacity) * math.log(2))))
+        if file_obj is not None:
+            file_obj.write(HEADER.pack(MAGIC, num_bits, num_hashes))
+            file_obj.truncate(HEADER.size + (num_bits + 7) // 8)
+            file_obj.flush()
+        return cls(num_bits, num_hashes, file_obj=file_obj)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps the filter stored in the file at *path*.
+        """
+        file_obj = open(path, 'r+b')
+        magic, num_bits, num_hashes = HEADER.unpack(file_obj.read(HEADER.size))
+        if magic != MAGIC:
+            file_obj.close()
+            raise ValueError("'%s' is not a URL tracker bloom filter" % path)
+        return cls(num_bits, num_hashes, file_obj=file_obj)
+
+    def _positions(self, url):
+        digest = hashlib.md5(force_bytes(normalize_url(url))).digest()
+        first, second = struct.unpack('<QQ', digest)
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def _byte(self, index):
+        return bytearray(self._bits[index:index + 1])[0]
+
+    def add(self, url):
+        with self._lock:
+            if self._file is not None and fcntl is not None:
+                # other processes modify the same bytes of the shared map
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                for position in self._positions(url):
+                    index = HEADER.size + position // 8
+                    value = self._byte(index) | (1 << (position % 8))
+                    self._bits[index:index + 1] = struct.pack('B', value)
+            finally:
+                if self._file is not None and fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def __contains__(self, url):
+        for position in self._positions(url):
+            if not self._byte(HEADER.size + position // 8) & (1 << (position % 8)):
+                return False
+        return True
+
+    def close(self):
+        self._bits.close()
+        if self._file is not None:
+            self._file.close()
+
+
+def build_bloom_filter(path=None):
+    """
+    Builds a new filter from all ``OldURL`` objects in the database. If
+    *path* is given the filter is written to a temporary file first, which
+    then atomically replaces the file at *path*.
+    """
+    from url_tracker.models import OldURL
+
+    capacity = max(
+        get_setting('BLOOM_FILTER_CAPACITY'),
+        2 * OldURL.objects.count()
+    )
+    error_rate = get_setting('BLOOM_FILTER_ERROR_RATE')
+    urls = OldURL.objects.values_list('url', flat=True).iterator()
+
+    if path is None:
+        bloom_filter = BloomFilter.for_capacity(capacity, error_rate)
+        for url in urls:
+            bloom_filter.add(url)
+        return bloom_filter
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'w+b') as file_obj:
+            bloom_filter = BloomFilter.for_capacity(
+                capacity,
+                error_rate,
+                file_obj=file_obj
+            )
+            for url in urls:
+                bloom_filter.add(url)
+            bloom_filter._bits.flush()
+            bloom_filter._bits.close()
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    return BloomFilter.open(path)
+
+
+_bloom_filter = None
+_bloom_filter_lock = threading.Lock()
+
+
+def get_bloom_filter():
+    """
+    Returns the filter of this process or ``None`` if the filter is disabled.
+
+    The file in ``URL_TRACKER_BLOOM_FILTER_FILE`` is mapped on first use,
+    which the middleware does when it's loaded, and only built if it
+    doesn't exist yet. A filter of its own would miss the old URLs other
+    processes create, so the file is required.
+    """
+    global _bloom_filter
+    if not get_setting('BLOOM_FILTER'):
+        return None
+    if not get_setting('BLOOM_FILTER_FILE'):
+        raise ImproperlyConfigured(
+            "URL_TRACKER_BLOOM_FILTER requires URL_TRACKER_BLOOM_FILTER_FILE."
+        )
+    if _bloom_filter is None:
+        with _bloom_filter_lock:
+            if _bloom_filter is None:
+                _bloom_filter = _load_bloom_filter()
+    return _bloom_filter
+
+
+def _load_bloom_filter():
+    path = get_setting('BLOOM_FILTER_FILE')
+    if os.path.exists(path):
+        return BloomFilter.open(path)
+    with open(path + '.lock', 'w') as lock_file:
+        # make sure only one worker builds the shared file
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        if os.path.exists(path):
+            return BloomFilter.open(path)
+        return build_bloom_filter(path)
+
+
+def reset_bloom_filter():
+    """
+    Drops the filter of this process, it's loaded again on next use.
+    """
+    global _bloom_filter
+    with _bloom_filter_lock:
+        if _bloom_filter is not None:
+            _bloom_filter.close()
+        _bloom_filter = None
+
+
+def add_to_bloom_filter(url):
+    """
+    Adds *url* to the filter if it has been loaded in this process already.
+    A filter that is loaded later on is built from the database and will
+    contain the URL anyway.
+    """
+    if _bloom_filter is not None and get_setting('BLOOM_FILTER'):
+        _bloom_filter.add(url)
+
+
+def update_bloom_filter(instance, **kwargs):
+    """
+    Signal receiver adding the URL of saved ``OldURL`` objects to the
+    filter, including URLs changed in the admin. A previous URL stays in
+    the filter and is looked up in the database.
+    """
+    add_to_bloom_filter(instance.url)
@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import django
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from url_tracker.conf import get_setting
+
+MISSING = object()
+
+# stored in the shared cache for paths that are not tracked, as cache
+# backends don't distinguish between a cached ``None`` and a missing key
+NOT_TRACKED = False
+
+
+class RedirectCache(object):
+    """
+    Least recently used map of requested paths to their redirect target.
+
+    The cached value is the new URL for a redirect, ``''`` for a URL that
+    is gone and ``None`` for a path that is not tracked at all. A lookup
+    for a path that is not in the cache returns ``MISSING``.
+
+    Changes clear the cache of the process that made them only, so entries
+    expire after ``timeout`` seconds to bound how long other processes
+    serve stale targets. A ``timeout`` of ``None`` keeps them.
+    """
+
+    def __init__(self, max_size=None, timeout=None):
+        self._max_size = max_size
+        self._timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        if self._max_size is None:
+            return get_setting('CACHE_SIZE')
+        return self._max_size
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            return get_setting('CACHE_TIMEOUT')
+        return self._timeout
+
+    def get(self, path):
+        with self._lock:
+            try:
+                value, expires = self._data.pop(path)
+            except KeyError:
+                return MISSING
+            if expires is not None and expires <= time.time():
+                return MISSING
+            # re-insert to mark the path as the most recently used
+            self._data[path] = (value, expires)
+            return value
+
+    def set(self, path, value):
+        max_size = self.max_size
+        if max_size <= 0:
+            return
+        timeout = self.timeout
+        expires = None if timeout is None else time.time() + timeout
+        with self._lock:
+            self._data.pop(path, None)
+            self._data[path] = (value, expires)
+            while len(self._data) > max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SharedRedirectCache(object):
+    """
+    Map of requested URLs to their redirect target in the Django cache
+    configured in ``URL_TRACKER_SHARED_CACHE``, shared by all processes.
+
+    Keys contain a generation number that is stored in the cache as well.
+    Bumping the generation invalidates all entries at once without flushing
+    the cache, the stale entries simply expire.
+    """
+    generation_key = 'url_tracker:generation'
+
+    def __init__(self, alias=None):
+        self._alias = alias
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+
+        alias = self._alias or get_setting('SHARED_CACHE')
+        if not alias:
+            return None
+        return caches[alias]
+
+    def get_generation(self):
+        cache = self.cache
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # entries of an evicted generation must not become valid again,
+            # so a new generation doesn't start counting at a fixed number
+            cache.add(self.generation_key, random.randint(1, 2 ** 62), None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def bump_generation(self):
+        try:
+            self.cache.incr(self.generation_key)
+        except ValueError:
+            # there is no generation yet, the next lookup starts a new one
+            pass
+
+    def make_key(self, generation, url):
+        from url_tracker.models import hash_url
+
+        # URLs can be longer than memcached allows keys to be
+        return 'url_tracker:%s:%s' % (generation, hash_url(url))
+
+    def get_many(self, generation, urls):
+        """
+        Returns the cached redirect targets of *urls* as a dictionary,
+        leaving out the URLs that are not cached.
+        """
+        keys = dict((self.make_key(generation, url), url) for url in urls)
+        return dict(
+            (keys[key], None if value is NOT_TRACKED else value)
+            for key, value in self.cache.get_many(list(keys)).items()
+        )
+
+    def set_many(self, generation, targets):
+        """
+        Caches the redirect *targets* of URLs given as a dictionary.
+        Negative results expire after ``URL_TRACKER_SHARED_CACHE_MISS_TIMEOUT``.
+        """
+        found = {}
+        not_tracked = {}
+        for url, target in targets.items():
+            if target is None:
+                not_tracked[self.make_key(generation, url)] = NOT_TRACKED
+            else:
+                found[self.make_key(generation, url)] = target
+        if found:
+            self.cache.set_many(found, get_setting('SHARED_CACHE_TIMEOUT'))
+        if not_tracked:
+            self.cache.set_many(
+                not_tracked,
+                get_setting('SHARED_CACHE_MISS_TIMEOUT')
+            )
+
+
+redirect_cache = RedirectCache()
+shared_redirect_cache = SharedRedirectCache()
+
+
+def bump_shared_cache_generation():
+    shared_redirect_cache.bump_generation()
+
+
+class GenerationBump(object):
+    """
+    Bumps the generation of the shared cache once the transaction on the
+    *using* database is committed.
+
+    Only the ``on_commit`` callback holds on to it, the thread-local keeps
+    a weak reference, which is gone once the callback ran or was discarded
+    on rollback.
+    """
+
+    def __init__(self, using):
+        self.using = using
+
+    def run(self):
+        if get_pending_bump(self.using) is self:
+            delattr(_pending_bumps, self.using)
+        bump_shared_cache_generation()
+
+
+_pending_bumps = threading.local()
+
+
+def get_pending_bump(using):
+    ref = getattr(_pending_bumps, using, None)
+    return None if ref is None else ref()
+
+
+def invalidate_redirect_cache(**kwargs):
+    """
+    Signal receiver clearing the redirect cache whenever tracked URLs change.
+
+    A single change to a ``URLChangeMethod`` can affect the target of many
+    old URLs so the whole cache is dropped instead of individual paths.
+    The generation of the shared cache is bumped once the transaction is
+    committed, so that other processes can't cache the old targets again,
+    and only once per transaction. Django 1.8 can't run code after a
+    commit, there it's bumped right away.
+    """
+    redirect_cache.clear()
+    if shared_redirect_cache.cache is None:
+        return
+    using = kwargs.get('using') or DEFAULT_DB_ALIAS
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block or django.VERSION < (1, 9):
+        bump_shared_cache_generation()
+    elif get_pending_bump(using) is None:
+        bump = GenerationBump(using)
+        setattr(_pending_bumps, using, weakref.ref(bump))
+        transaction.on_commit(bump.run, using=using)
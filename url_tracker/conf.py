@@ -0,0 +1,75 @@
+from django.conf import settings
+
+
+DEFAULTS = {
+    # maximum number of paths kept in the per-process redirect cache,
+    # ``0`` disables the cache, and the number of seconds they are kept,
+    # as changes made by other processes don't clear it
+    'CACHE_SIZE': 10000,
+    'CACHE_TIMEOUT': 5,
+    # alias of a Django cache shared by all processes to use instead of the
+    # per-process cache, with separate timeouts for redirects and misses
+    'SHARED_CACHE': None,
+    'SHARED_CACHE_TIMEOUT': 24 * 60 * 60,
+    'SHARED_CACHE_MISS_TIMEOUT': 60,
+    # skip database lookups for URLs that are not in a bloom filter of all
+    # old URLs, optionally shared between processes through a mapped file
+    'BLOOM_FILTER': False,
+    'BLOOM_FILTER_FILE': None,
+    'BLOOM_FILTER_CAPACITY': 100000,
+    'BLOOM_FILTER_ERROR_RATE': 0.001,
+    # memory-mapped file of all redirects written by the
+    # ``url_tracker_snapshot`` command and how often, in seconds, each
+    # process checks for a new file and for redirects changed since
+    'SNAPSHOT_FILE': None,
+    'SNAPSHOT_POLL_INTERVAL': 1,
+    # log changed redirects for incremental exports with the
+    # ``url_tracker_export`` command, always logged with a snapshot file
+    'CHANGE_LOG': False,
+    # number of ids below the last read change that are read again, as
+    # changes with lower ids can be committed later
+    'CHANGE_LOG_OVERLAP': 1000,
+    # how often, in seconds, each process checks for redirect rules changed
+    # by other processes
+    'RULES_POLL_INTERVAL': 5,
+    # normalization of old URLs and requested URLs: lowercase the path,
+    # remove trailing slashes, ``'sort'`` or ``'ignore'`` the query string
+    # and remove the query parameters with the given names or prefixes
+    'NORMALIZE_LOWERCASE': False,
+    'NORMALIZE_TRAILING_SLASH': False,
+    'NORMALIZE_QUERY': None,
+    'NORMALIZE_STRIP_PARAMS': (),
+    # count the redirected requests of each old URL in a buffer that is
+    # written every so many hits or seconds, optionally accumulating the
+    # buffers of all processes in a shared Django cache
+    'HIT_COUNTS': False,
+    'HIT_BUFFER_SIZE': 1000,
+    'HIT_FLUSH_INTERVAL': 60,
+    'HIT_SHARED_CACHE': None,
+    # dotted path of the backend recording lookup and save metrics,
+    # ``None`` measures nothing, and the options of the built-in backends
+    'METRICS': None,
+    'METRICS_PREFIX': 'url_tracker',
+    'METRICS_STATSD_HOST': 'localhost',
+    'METRICS_STATSD_PORT': 8125,
+    # number of URLs computed by URL methods with declared fields that are
+    # shared by all instances of a model, ``0`` only remembers them per
+    # instance
+    'REVERSE_CACHE_SIZE': 0,
+    # look up every request instead of only those that result in a 404
+    'EAGER_LOOKUP': False,
+    # dotted path of the executor recording URL changes after the commit,
+    # ``None`` records them synchronously while saving
+    'EXECUTOR': None,
+    'EXECUTOR_THREADS': 2,
+}
+
+
+def get_setting(name):
+    """
+    Returns the value of the ``URL_TRACKER_<name>`` setting or its default.
+
+    Settings are looked up on every call so that they can be changed with
+    ``override_settings`` in tests.
+    """
+    return getattr(settings, 'URL_TRACKER_' + name, DEFAULTS[name])
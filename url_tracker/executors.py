@@ -0,0 +1,237 @@
+"""
+Deferred recording of URL changes.
+
+With ``URL_TRACKER_EXECUTOR`` set, saving a tracked object only captures
+its old URLs. The changes are recorded once the transaction is committed,
+by the configured executor, so that the queries don't run inside the
+transaction that saved the object. Changes to the same URL method of an
+object within a transaction are coalesced into a single change.
+
+Executors that are ``transactional`` store the changes instead, inside the
+transaction that saved the object, so that they are committed or rolled
+back with it.
+"""
+import logging
+import threading
+import weakref
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction, connections
+from django.utils.encoding import force_text
+from django.utils.module_loading import import_string
+
+from url_tracker.conf import get_setting
+
+logger = logging.getLogger(__file__)
+
+
+def process_url_changes(jobs):
+    """
+    Records URL changes given as ``(content_type_id, object_id, method_name,
+    old_url)`` tuples, comparing the old URLs with the current URLs of the
+    objects. Objects are fetched with one query per content type.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from url_tracker.metrics import call_url_method
+    from url_tracker.trackers import record_url_changes
+
+    by_content_type = {}
+    for content_type_id, object_id, method_name, old_url in jobs:
+        by_content_type.setdefault(content_type_id, []).append(
+            (object_id, method_name, old_url)
+        )
+
+    changes = []
+    for content_type_id, content_type_jobs in by_content_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        objects = dict(
+            (force_text(obj.pk), obj) for obj in model._default_manager.filter(
+                pk__in=set(object_id for object_id, __, __ in content_type_jobs)
+            )
+        )
+        for object_id, method_name, old_url in content_type_jobs:
+            obj = objects.get(object_id)
+            if obj is None:
+                # deleted in the meantime
+                continue
+            changes.append(
+                (obj, method_name, old_url, call_url_method(obj, method_name) or '')
+            )
+    record_url_changes(changes)
+
+
+class ImmediateExecutor(object):
+    """
+    Records the changes right after the commit in the committing thread.
+    """
+
+    def submit(self, jobs):
+        process_url_changes(jobs)
+
+
+class ThreadExecutor(object):
+    """
+    Records the changes in a pool of ``URL_TRACKER_EXECUTOR_THREADS``
+    background threads.
+    """
+
+    def __init__(self):
+        try:
+            from concurrent.futures import ThreadPoolExecutor
+        except ImportError:
+            raise ImproperlyConfigured(
+                "ThreadExecutor requires the 'futures' package on Python 2."
+            )
+        self.pool = ThreadPoolExecutor(get_setting('EXECUTOR_THREADS'))
+
+    def submit(self, jobs):
+        return self.pool.submit(self.run, jobs)
+
+    def run(self, jobs):
+        try:
+            process_url_changes(jobs)
+        except Exception:
+            logger.exception('failed to record URL changes')
+        finally:
+            # connections are per thread and would leak otherwise
+            connections.close_all()
+
+
+class QueueExecutor(object):
+    """
+    Stores the changes in the ``PendingURLChange`` table, to be recorded
+    by the ``url_tracker_process_queue`` management command. The rows are
+    written in the transaction that saved the objects, so no change is lost
+    if the process dies after the commit.
+    """
+    transactional = True
+
+    def submit(self, jobs, using=None):
+        from url_tracker.models import PendingURLChange
+
+        PendingURLChange.objects.using(using).bulk_create([
+            PendingURLChange(
+                content_type_id=content_type_id,
+                object_id=object_id,
+                method_name=method_name,
+                old_url=old_url
+            )
+            for content_type_id, object_id, method_name, old_url in jobs
+        ])
+
+
+def process_queue(batch_size=1000):
+    """
+    Records all changes in the ``PendingURLChange`` table in batches and
+    returns the number of processed rows. Only one process should drain the
+    queue at a time.
+    """
+    from url_tracker.models import PendingURLChange
+
+    processed = 0
+    while True:
+        batch = list(PendingURLChange.objects.order_by('pk').values_list(
+            'pk', 'content_type', 'object_id', 'method_name', 'old_url'
+        )[:batch_size])
+        if not batch:
+            return processed
+        jobs = {}
+        for __, content_type_id, object_id, method_name, old_url in batch:
+            # the oldest change is the one to record
+            jobs.setdefault((content_type_id, object_id, method_name), old_url)
+        with transaction.atomic():
+            process_url_changes([key + (old_url,) for key, old_url in jobs.items()])
+            PendingURLChange.objects.filter(
+                pk__in=[row[0] for row in batch]
+            ).delete()
+        processed += len(batch)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the executor configured in ``URL_TRACKER_EXECUTOR`` or ``None``
+    if changes are recorded synchronously.
+    """
+    path = get_setting('EXECUTOR')
+    if not path:
+        return None
+    if path not in _executors:
+        with _executors_lock:
+            if path not in _executors:
+                _executors[path] = import_string(path)()
+    return _executors[path]
+
+
+class PendingChanges(dict):
+    """
+    The changes deferred within one transaction, keyed by ``instance_key``.
+
+    Only the ``on_commit`` callback holds on to it, the thread-local keeps
+    a weak reference. It's gone once the callback ran or Django discarded
+    the callback because the transaction was rolled back, so that the next
+    transaction starts a new one.
+    """
+
+    def __init__(self, using):
+        super(PendingChanges, self).__init__()
+        self.using = using
+
+    def submit(self):
+        if get_pending_changes(self.using) is self:
+            delattr(_local, self.using)
+        if self:
+            get_executor().submit(
+                [key + (old_url,) for key, old_url in self.items()]
+            )
+
+
+_local = threading.local()
+
+
+def get_pending_changes(using):
+    ref = getattr(_local, using, None)
+    return None if ref is None else ref()
+
+
+def defer_url_changes(old_urls, using):
+    """
+    Hands the changes of ``(instance, method_name, old_url)`` tuples to the
+    executor once the current transaction on the *using* database commits.
+    Transactional executors get them right away. Django 1.8 can't run code
+    after a commit, there the changes are recorded right away.
+    """
+    from url_tracker.trackers import instance_key
+
+    if not old_urls:
+        return
+    executor = get_executor()
+    if getattr(executor, 'transactional', False):
+        executor.submit(
+            [
+                instance_key(instance, method_name) + (old_url,)
+                for instance, method_name, old_url in old_urls
+            ],
+            using=using
+        )
+        return
+    if django.VERSION < (1, 9):
+        process_url_changes([
+            instance_key(instance, method_name) + (old_url,)
+            for instance, method_name, old_url in old_urls
+        ])
+        return
+    pending = get_pending_changes(using)
+    register = pending is None
+    if register:
+        pending = PendingChanges(using)
+        setattr(_local, using, weakref.ref(pending))
+    for instance, method_name, old_url in old_urls:
+        pending.setdefault(instance_key(instance, method_name), old_url)
+    if register:
+        # runs immediately outside of a transaction
+        transaction.on_commit(pending.submit, using=using)
@@ -0,0 +1,211 @@
+"""
+Export of all redirects for serving them from a reverse proxy.
+
+The ``url_tracker_export`` management command writes every old URL and the
+URL at the end of its redirect chain, or ``410`` if it's gone, to an nginx
+``map`` include file, an Apache ``RewriteMap`` text file or a JSON file,
+reading the ``URLRedirect`` table in batches. The file is written to a
+temporary file first that then atomically replaces the previous export.
+
+Every export starts with the id of the last change logged in the
+``URLRedirectChange`` table, its generation. An incremental export only
+reads the redirects changed since the generation of the previous export
+from the database and copies all other entries from the previous file.
+Changes are logged while ``URL_TRACKER_CHANGE_LOG`` or
+``URL_TRACKER_SNAPSHOT_FILE`` is set. The changes in the window of
+``URL_TRACKER_CHANGE_LOG_OVERLAP`` ids below the generation are read again,
+as they may have been committed after the previous export.
+"""
+from __future__ import unicode_literals
+
+import io
+import json
+import os
+import re
+import tempfile
+
+from url_tracker.conf import get_setting
+
+# the target of gone URLs in the nginx and Apache maps
+GONE = '410'
+
+
+class NginxMap(object):
+    """
+    Entries of an nginx ``map`` block, to be included with::
+
+        map $request_uri $url_tracker_target {
+            include /path/to/redirects.map;
+        }
+    """
+    comment = '# url_tracker generation %d\n'
+    entry_pattern = re.compile(r'^"((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)";$')
+
+    def quote(self, value):
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+    def unquote(self, value):
+        return re.sub(r'\\(.)', r'\1', value)
+
+    def header(self, generation):
+        return self.comment % generation
+
+    def entry(self, url, target, first):
+        return '%s %s;\n' % (self.quote(url), self.quote(target or GONE))
+
+    def footer(self):
+        return ''
+
+    def parse_generation(self, line):
+        match = re.match(r'^# url_tracker generation (\d+)$', line.strip())
+        return int(match.group(1)) if match else None
+
+    def parse_entry(self, line):
+        match = self.entry_pattern.match(line.strip())
+        if match is None:
+            return None
+        target = self.unquote(match.group(2))
+        return self.unquote(match.group(1)), '' if target == GONE else target
+
+
+class ApacheRewriteMap(NginxMap):
+    """
+    Entries of an Apache ``RewriteMap`` of type ``txt``, which can be
+    converted to a ``dbm`` map with ``httxt2dbm``. Keys and values can't
+    contain whitespace, such URLs are left out.
+    """
+
+    def entry(self, url, target, first):
+        if any(value.split() != [value] for value in (url, target or GONE)):
+            return ''
+        return '%s %s\n' % (url, target or GONE)
+
+    def parse_entry(self, line):
+        if line.startswith('#'):
+            return None
+        parts = line.split()
+        if len(parts) != 2:
+            return None
+        return parts[0], '' if parts[1] == GONE else parts[1]
+
+
+class JSONMap(object):
+    """
+    A JSON object with the generation and an object of all old URLs and
+    their target, ``''`` for gone URLs. Every entry is on a line of its
+    own so that incremental exports can read the file line by line.
+    """
+
+    def header(self, generation):
+        return '{"generation": %d, "redirects": {\n' % generation
+
+    def entry(self, url, target, first):
+        return '%s%s: %s\n' % ('' if first else ',', json.dumps(url), json.dumps(target))
+
+    def footer(self):
+        return '}}\n'
+
+    def parse_generation(self, line):
+        match = re.match(r'^\{"generation": (\d+), ', line)
+        return int(match.group(1)) if match else None
+
+    def parse_entry(self, line):
+        line = line.strip().lstrip(',')
+        if not line or line.startswith(('{', '}')):
+            return None
+        return list(json.loads('{%s}' % line).items())[0]
+
+
+FORMATS = {
+    'nginx': NginxMap,
+    'apache': ApacheRewriteMap,
+    'json': JSONMap,
+}
+
+
+def read_generation(path, export_format):
+    if not os.path.exists(path):
+        return None
+    with io.open(path, encoding='utf-8') as file_obj:
+        return export_format.parse_generation(file_obj.readline())
+
+
+def export_redirects(path, format='nginx', incremental=False, batch_size=10000):
+    """
+    Writes all redirects to *path* in the given *format* and returns the
+    number of exported redirects, the generation of the export and whether
+    it was incremental. An incremental export falls back to a full one if
+    there is no previous export or the changes since were deleted from the
+    log, e.g. by ``build_snapshot``.
+    """
+    from django.db.models import Max, Min
+    from url_tracker.models import URLRedirect, URLRedirectChange, hash_url
+    from url_tracker.snapshot import ChangeLogCursor
+
+    export_format = FORMATS[format]()
+    log = URLRedirectChange.objects.aggregate(start=Min('pk'), generation=Max('pk'))
+    generation = log['generation'] or 0
+    previous_generation = read_generation(path, export_format)
+
+    overlap = get_setting('CHANGE_LOG_OVERLAP')
+
+    changed = None
+    if incremental and previous_generation is not None:
+        # older changes may have been deleted, but none in the window
+        # below the previous export that is read again
+        start = max(previous_generation - overlap, 0) + 1
+        if log['start'] is not None and log['start'] <= start:
+            cursor = ChangeLogCursor(previous_generation)
+            changed = cursor.read()
+            generation = cursor.last_id
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    counts = [0]
+    try:
+        with io.open(fd, 'w', encoding='utf-8') as file_obj:
+
+            def write(url, target):
+                line = export_format.entry(url, target, not counts[0])
+                if line:
+                    file_obj.write(line)
+                    counts[0] += 1
+
+            file_obj.write(export_format.header(generation))
+            if changed is None:
+                redirects = URLRedirect.objects.order_by('url_hash').values_list(
+                    'url_hash', 'url', 'target'
+                )
+                last_hash = ''
+                while True:
+                    batch = list(redirects.filter(url_hash__gt=last_hash)[:batch_size])
+                    if not batch:
+                        break
+                    for __, url, target in batch:
+                        write(url, target)
+                    last_hash = batch[-1][0]
+            else:
+                with io.open(path, encoding='utf-8') as previous:
+                    previous.readline()
+                    for line in previous:
+                        entry = export_format.parse_entry(line)
+                        if entry is not None and hash_url(entry[0]) not in changed:
+                            write(*entry)
+                changed = sorted(changed)
+                for start in range(0, len(changed), batch_size):
+                    for url, target in URLRedirect.objects.filter(
+                            url_hash__in=changed[start:start + batch_size]).values_list(
+                                'url', 'target'):
+                        write(url, target)
+            file_obj.write(export_format.footer())
+        # readable by the web server like any configuration file
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    if previous_generation and not get_setting('SNAPSHOT_FILE'):
+        # the next export reads the window below this one's generation again
+        URLRedirectChange.objects.filter(pk__lte=previous_generation - overlap).delete()
+    return counts[0], generation, changed is not None
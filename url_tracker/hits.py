@@ -0,0 +1,202 @@
+"""
+Hit statistics of old URLs.
+
+With ``URL_TRACKER_HIT_COUNTS`` enabled, the middleware counts the requests
+redirected for each old URL in a buffer of the process instead of writing
+to the database on every request. The buffer is written every
+``URL_TRACKER_HIT_BUFFER_SIZE`` hits or ``URL_TRACKER_HIT_FLUSH_INTERVAL``
+seconds, whichever comes first, with one ``UPDATE`` statement per batch of
+old URLs.
+
+With ``URL_TRACKER_HIT_SHARED_CACHE`` set, processes add their buffers to
+an accumulator in that cache instead, and only the first process to flush
+after the interval writes the hits of all processes to the database, one
+interval late.
+
+The counts are statistics: hits buffered by a process that is killed, or
+evicted from the cache, are lost.
+"""
+import logging
+import threading
+import time
+
+from django.db.models import Case, When, Value, F, PositiveIntegerField, DateTimeField
+from django.utils import timezone
+
+from url_tracker.conf import get_setting
+
+logger = logging.getLogger(__file__)
+
+UPDATE_BATCH_SIZE = 250
+# the number of flush intervals after which undrained shared hits expire
+SLOT_PERIODS = 10
+
+
+def write_hits(hits):
+    """
+    Adds the hits given as a dictionary of candidate tuples, as returned by
+    ``URLChangePermanentRedirectMiddleware.get_candidates``, and their
+    ``(count, last_hit)`` to the ``OldURL``s that the candidates resolve to.
+    """
+    from url_tracker.models import OldURL, URLRedirect, hash_url
+    from url_tracker.normalize import normalize_url
+
+    urls = set(url for candidates in hits for url in candidates)
+    hashes = dict((hash_url(url), url) for url in urls)
+    old_url_ids = {}
+    for url_hash, url, old_url_id in URLRedirect.objects.filter(
+            url_hash__in=list(hashes)).values_list(
+                'url_hash', 'url', 'old_url_id'):
+        if normalize_url(hashes[url_hash]) == normalize_url(url):
+            old_url_ids[hashes[url_hash]] = old_url_id
+
+    by_old_url = {}
+    for candidates, (count, last_hit) in hits.items():
+        for url in reversed(candidates):
+            if url in old_url_ids:
+                total, latest = by_old_url.get(old_url_ids[url], (0, last_hit))
+                by_old_url[old_url_ids[url]] = (total + count, max(latest, last_hit))
+                break
+
+    items = sorted(by_old_url.items())
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        batch = items[start:start + UPDATE_BATCH_SIZE]
+        OldURL.objects.filter(pk__in=[pk for pk, __ in batch]).update(
+            hits=Case(
+                *[When(pk=pk, then=F('hits') + Value(count))
+                  for pk, (count, __) in batch],
+                output_field=PositiveIntegerField()
+            ),
+            last_hit=Case(
+                *[When(pk=pk, then=Value(last_hit))
+                  for pk, (__, last_hit) in batch],
+                output_field=DateTimeField()
+            )
+        )
+
+
+def merge_hits(hits, other):
+    for candidates, (count, last_hit) in other.items():
+        total, latest = hits.get(candidates, (0, last_hit))
+        hits[candidates] = (total + count, max(latest, last_hit))
+
+
+class SharedHitAccumulator(object):
+    """
+    Collects the buffers of all processes in the cache with the alias
+    ``URL_TRACKER_HIT_SHARED_CACHE``. Every buffer is stored in a slot of
+    its own, numbered by an atomic counter of the current drain period, so
+    that processes never update the same key. Every drain starts a new
+    period and drains the one before the previous period, which processes
+    that read the period number before it changed may still add to. Slots
+    that aren't drained within ``SLOT_PERIODS`` flush intervals expire.
+    """
+    prefix = 'url_tracker:hits:'
+
+    @property
+    def cache(self):
+        from django.core.cache import caches
+
+        return caches[get_setting('HIT_SHARED_CACHE')]
+
+    def get_timeout(self):
+        return max(get_setting('HIT_FLUSH_INTERVAL'), 1) * SLOT_PERIODS
+
+    def add(self, hits):
+        cache = self.cache
+        timeout = self.get_timeout()
+        period = cache.get(self.prefix + 'period', 0)
+        counter = self.prefix + 'slots:%d' % period
+        cache.add(counter, 0, timeout)
+        slot = cache.incr(counter)
+        cache.set(self.prefix + 'slot:%d:%d' % (period, slot), hits, timeout)
+
+    def drain(self):
+        """
+        Returns the hits of all slots of the period before the previous
+        one, or ``None`` if another process is draining or drained within
+        the flush interval.
+        """
+        cache = self.cache
+        interval = get_setting('HIT_FLUSH_INTERVAL')
+        if not cache.add(self.prefix + 'lock', 1, max(interval, 1)):
+            return None
+        period = cache.get(self.prefix + 'period', 0)
+        cache.set(self.prefix + 'period', period + 1, self.get_timeout())
+        counter = self.prefix + 'slots:%d' % (period - 1)
+        keys = [
+            self.prefix + 'slot:%d:%d' % (period - 1, slot)
+            for slot in range(1, cache.get(counter, 0) + 1)
+        ]
+        hits = {}
+        for slot_hits in cache.get_many(keys).values():
+            merge_hits(hits, slot_hits)
+        cache.delete_many(keys + [counter])
+        # the lock expires after the interval, limiting the database writes
+        return hits
+
+
+class HitBuffer(object):
+    """
+    The hits counted by this process since the last flush.
+    """
+
+    def __init__(self):
+        self._hits = {}
+        self._count = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, candidates):
+        now = timezone.now()
+        with self._lock:
+            count, __ = self._hits.get(candidates, (0, now))
+            self._hits[candidates] = (count + 1, now)
+            self._count += 1
+            due = (
+                self._count >= get_setting('HIT_BUFFER_SIZE') or
+                time.time() - self._last_flush >= get_setting('HIT_FLUSH_INTERVAL')
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered hits to the database or the shared accumulator.
+        """
+        with self._lock:
+            hits, self._hits = self._hits, {}
+            self._count = 0
+            self._last_flush = time.time()
+        try:
+            if get_setting('HIT_SHARED_CACHE'):
+                accumulator = SharedHitAccumulator()
+                if hits:
+                    accumulator.add(hits)
+                hits = accumulator.drain()
+            if hits:
+                write_hits(hits)
+        except Exception:
+            # statistics must never break a request
+            logger.exception('failed to write redirect hits')
+
+    def __len__(self):
+        return self._count
+
+
+hit_buffer = HitBuffer()
+
+
+def record_hit(candidates):
+    """
+    Counts a redirected request for the old URL the *candidates* resolve to.
+    """
+    if get_setting('HIT_COUNTS'):
+        hit_buffer.record(tuple(candidates))
+
+
+def flush_hits():
+    """
+    Writes the hits buffered in this process, e.g. before it exits.
+    """
+    hit_buffer.flush()
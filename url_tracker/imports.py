@@ -0,0 +1,198 @@
+"""
+Bulk import of old URLs, e.g. the URLs of a site before a migration.
+
+Records of an old URL and the object it now belongs to are read from a CSV
+file, a JSON lines file or an old sitemap one at a time, and recorded in
+chunks with the bulk queries of ``record_url_changes``: the objects of a
+chunk are fetched with one query, existing old URLs are found with one
+``IN`` query and new rows are written with ``bulk_create``, each chunk in a
+transaction of its own. Memory use only depends on the chunk size.
+"""
+import csv
+import io
+import json
+import re
+from xml.etree import ElementTree
+
+from django.core.exceptions import ValidationError
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from url_tracker.metrics import call_url_method
+from url_tracker.normalize import normalize_url
+
+FORMATS = ('csv', 'jsonl', 'sitemap')
+
+
+def open_text(path):
+    if six.PY2:
+        # the csv module of Python 2 only reads bytes
+        return open(path, 'rb')
+    return io.open(path, encoding='utf-8', newline='')
+
+
+def read_csv(file_obj):
+    """
+    Yields ``(old_url, key, method_name)`` for the rows of a CSV file with
+    the old URL, the key of the object and, optionally, the method name.
+    """
+    for row in csv.reader(file_obj):
+        row = [force_text(cell).strip() for cell in row]
+        if not row or not row[0]:
+            continue
+        row.extend([None] * (3 - len(row)))
+        yield row[0], row[1] or None, row[2] or None
+
+
+def read_jsonl(file_obj):
+    """
+    Yields ``(old_url, key, method_name)`` for the objects with the keys
+    ``url``, ``object`` and, optionally, ``method`` on each line.
+    """
+    for line in file_obj:
+        line = force_text(line).strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        yield record.get('url'), record.get('object'), record.get('method')
+
+
+def read_sitemap(file_obj):
+    """
+    Yields ``(old_url, None, None)`` for the ``<loc>`` of every ``<url>`` in
+    a sitemap. The elements are discarded as soon as they are read.
+    """
+    for __, element in ElementTree.iterparse(file_obj):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag != 'url':
+            continue
+        for child in element:
+            if child.tag.rsplit('}', 1)[-1] == 'loc' and child.text:
+                yield child.text.strip(), None, None
+        element.clear()
+
+
+def read_records(path, format):
+    if format == 'sitemap':
+        with open(path, 'rb') as file_obj:
+            for record in read_sitemap(file_obj):
+                yield record
+        return
+    reader = read_csv if format == 'csv' else read_jsonl
+    with open_text(path) as file_obj:
+        for record in reader(file_obj):
+            yield record
+
+
+def get_path(url):
+    """
+    Returns the path and query string of *url*, the part the middleware
+    looks up, e.g. for the absolute URLs of a sitemap.
+    """
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return path
+
+
+class OldURLImporter(object):
+    """
+    Records old URLs of objects of *model*, identified by the value of
+    their *lookup_field*, for their *method_name*. Records without a key get
+    it from the ``key`` group of the regular expression *pattern* matched
+    against the path of the old URL.
+    """
+
+    def __init__(self, model, lookup_field='pk', method_name='get_absolute_url',
+                 pattern=None, batch_size=500):
+        self.model = model
+        self.lookup_field = lookup_field
+        self.field = model._meta.pk if lookup_field == 'pk' else (
+            model._meta.get_field(lookup_field)
+        )
+        self.method_name = method_name
+        self.method_names = set(model.get_url_tracking_methods())
+        self.pattern = re.compile(pattern) if pattern else None
+        self.batch_size = batch_size
+
+    def run(self, records, offset=0, progress=None):
+        """
+        Imports the *records* after the first *offset* ones and returns the
+        number of processed, imported and skipped records. *progress* is
+        called with these numbers, including the offset, after every chunk,
+        so that an aborted import can be resumed from the last reported
+        number.
+        """
+        counts = [offset, 0, 0]
+
+        def import_chunk(chunk):
+            imported = self.import_chunk(chunk)
+            counts[0] += len(chunk)
+            counts[1] += imported
+            counts[2] += len(chunk) - imported
+            if progress is not None:
+                progress(*counts)
+
+        chunk = []
+        for position, record in enumerate(records):
+            if position < offset:
+                continue
+            chunk.append(record)
+            if len(chunk) >= self.batch_size:
+                import_chunk(chunk)
+                chunk = []
+        if chunk:
+            import_chunk(chunk)
+        return tuple(counts)
+
+    def get_key(self, old_url, key):
+        if key is None and self.pattern is not None:
+            match = self.pattern.search(old_url)
+            key = match and match.group('key')
+        if key is None:
+            return None
+        try:
+            return self.field.to_python(key)
+        except ValidationError:
+            # e.g. the header row of a CSV file
+            return None
+
+    def import_chunk(self, records):
+        """
+        Records the old URLs of a chunk of records and returns the number
+        of imported records. Records of unknown objects or methods are
+        skipped.
+        """
+        from url_tracker.trackers import record_url_changes
+
+        keyed = []
+        for old_url, key, method_name in records:
+            method_name = method_name or self.method_name
+            if not old_url or method_name not in self.method_names:
+                continue
+            old_url = get_path(old_url)
+            key = self.get_key(old_url, key)
+            if key is not None:
+                keyed.append((old_url, key, method_name))
+        objects = {}
+        if keyed:
+            for obj in self.model._default_manager.filter(**{
+                    self.lookup_field + '__in': set(key for __, key, __ in keyed)}):
+                objects[getattr(obj, self.field.attname)] = obj
+
+        changes = []
+        current_urls = {}
+        for old_url, key, method_name in keyed:
+            obj = objects.get(key)
+            if obj is None:
+                continue
+            if (key, method_name) not in current_urls:
+                current_urls[key, method_name] = call_url_method(obj, method_name) or ''
+            current_url = current_urls[key, method_name]
+            if normalize_url(old_url) != normalize_url(current_url):
+                changes.append((obj, method_name, old_url, current_url))
+        # in a transaction of its own
+        record_url_changes(changes)
+        return len(changes)
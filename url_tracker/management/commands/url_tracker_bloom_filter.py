@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from url_tracker.bloom import build_bloom_filter
+from url_tracker.conf import get_setting
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the bloom filter file of all old URLs that is shared by the "
+        "worker processes. Run it before starting the workers, workers that "
+        "are already running keep using the previous file until restarted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=None,
+            help="Write the filter to this file instead of "
+                 "URL_TRACKER_BLOOM_FILTER_FILE."
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or get_setting('BLOOM_FILTER_FILE')
+        if not path:
+            raise CommandError(
+                "Set URL_TRACKER_BLOOM_FILTER_FILE or pass --path."
+            )
+        bloom_filter = build_bloom_filter(path)
+        self.stdout.write(
+            "Wrote bloom filter with %d bits and %d hashes to '%s'." % (
+                bloom_filter.num_bits,
+                bloom_filter.num_hashes,
+                path
+            )
+        )
+        bloom_filter.close()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from url_tracker.models import URLRedirect
+
+
+class Command(BaseCommand):
+    help = (
+        "Points redirects whose target is an old URL itself directly at the "
+        "end of the redirect chain and reports redirect cycles."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of redirects resolved per batch."
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help="Only report the chains and cycles, don't change anything."
+        )
+
+    def handle(self, *args, **options):
+        collapsed, cycles = URLRedirect.objects.collapse_chains(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run']
+        )
+        for url in sorted(cycles):
+            self.stderr.write("Redirect cycle: %s" % url)
+        self.stdout.write(
+            "%s %d redirect chains, found %d redirect cycles." % (
+                "Found" if options['dry_run'] else "Collapsed",
+                collapsed,
+                len(cycles)
+            )
+        )
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from url_tracker.conf import get_setting
+from url_tracker.export import FORMATS, export_redirects
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes all redirects to an nginx map, an Apache RewriteMap or a "
+        "JSON file, so that a reverse proxy can serve them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to write.")
+        parser.add_argument(
+            '--format',
+            choices=sorted(FORMATS),
+            default='nginx',
+            help="The format of the file."
+        )
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            default=False,
+            help="Only read the redirects changed since the previous export "
+                 "at the same path from the database. Requires "
+                 "URL_TRACKER_CHANGE_LOG."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Number of redirects read from the database at once."
+        )
+
+    def handle(self, *args, **options):
+        if options['incremental'] and not (
+                get_setting('CHANGE_LOG') or get_setting('SNAPSHOT_FILE')):
+            raise CommandError(
+                "Set URL_TRACKER_CHANGE_LOG for incremental exports."
+            )
+        count, generation, incremental = export_redirects(
+            options['path'],
+            format=options['format'],
+            incremental=options['incremental'],
+            batch_size=options['batch_size']
+        )
+        self.stdout.write("Wrote %d redirects to '%s'%s, generation %d." % (
+            count,
+            options['path'],
+            ' incrementally' if incremental else '',
+            generation
+        ))
@@ -0,0 +1,111 @@
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+
+from url_tracker.imports import FORMATS, OldURLImporter, read_records
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+    '.xml': 'sitemap',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports old URLs of existing objects from a CSV file, a JSON lines "
+        "file or a sitemap, in chunks of bulk queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="The file to import.")
+        parser.add_argument(
+            '--model',
+            help="The tracked model the old URLs belong to, as "
+                 "app_label.ModelName."
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default=None,
+            help="The format of the file, by default guessed from its "
+                 "extension. CSV rows hold the old URL, the key of the object "
+                 "and optionally the method name, JSON lines the keys 'url', "
+                 "'object' and 'method'."
+        )
+        parser.add_argument(
+            '--lookup-field',
+            default='pk',
+            help="The field of the model the objects are identified by."
+        )
+        parser.add_argument(
+            '--method',
+            default='get_absolute_url',
+            help="The URL method of records that don't name one."
+        )
+        parser.add_argument(
+            '--pattern',
+            default=None,
+            help="Regular expression with a 'key' group that extracts the "
+                 "key of the object from old URLs without one, e.g. those "
+                 "of a sitemap."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Number of records imported per transaction."
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            default=0,
+            help="Number of records to skip, to resume an aborted import."
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if not options['model']:
+            raise CommandError("Pass the --model the old URLs belong to.")
+        try:
+            model = apps.get_model(options['model'])
+        except (LookupError, ValueError) as error:
+            raise CommandError(error)
+        if not hasattr(model, 'get_url_tracking_methods'):
+            raise CommandError("'%s' is not tracked." % options['model'])
+
+        format = options['format']
+        if format is None:
+            extension = '.' + options['path'].rsplit('.', 1)[-1].lower()
+            format = EXTENSIONS.get(extension)
+            if format is None:
+                raise CommandError("Pass the --format of '%s'." % options['path'])
+
+        try:
+            importer = OldURLImporter(
+                model,
+                lookup_field=options['lookup_field'],
+                method_name=options['method'],
+                pattern=options['pattern'],
+                batch_size=options['batch_size']
+            )
+        except FieldDoesNotExist as error:
+            raise CommandError(error)
+
+        processed, imported, skipped = importer.run(
+            read_records(options['path'], format),
+            offset=options['offset'],
+            progress=self.progress
+        )
+        self.stdout.write(
+            "Imported %d old URLs, skipped %d records." % (imported, skipped)
+        )
+
+    def progress(self, processed, imported, skipped):
+        if self.verbosity > 0:
+            self.stdout.write(
+                "Processed %d records, resume with --offset %d." % (
+                    processed, processed
+                )
+            )
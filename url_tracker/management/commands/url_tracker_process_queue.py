@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from url_tracker.executors import process_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Records the URL changes queued by the QueueExecutor. Only run one "
+        "instance of this command at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of queued changes recorded per transaction."
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help="Keep running and check the queue every INTERVAL seconds."
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_queue(batch_size=options['batch_size'])
+            if options['verbosity'] > 0 and (processed or not options['interval']):
+                self.stdout.write("Recorded %d queued URL changes." % processed)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
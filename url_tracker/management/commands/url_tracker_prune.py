@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from url_tracker.conf import get_setting
+from url_tracker.models import OldURL
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes old URLs that were recorded or last requested a given "
+        "number of days ago, along with their redirects, in small batches "
+        "that can run on a live database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than',
+            type=int,
+            default=None,
+            metavar='DAYS',
+            help="Only delete old URLs recorded more than this many days ago."
+        )
+        parser.add_argument(
+            '--not-hit-for',
+            type=int,
+            default=None,
+            metavar='DAYS',
+            help="Only delete old URLs that haven't been requested for this "
+                 "many days. Requires URL_TRACKER_HIT_COUNTS."
+        )
+        parser.add_argument(
+            '--orphans',
+            action='store_true',
+            default=False,
+            help="Also delete old URLs that don't belong to any URL change "
+                 "method."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of old URLs deleted per transaction."
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help="Seconds to pause between batches."
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            default=False,
+            help="Only report the number of old URLs, don't delete anything."
+        )
+
+    def handle(self, *args, **options):
+        if (options['older_than'] is None and options['not_hit_for'] is None and
+                not options['orphans']):
+            raise CommandError(
+                "Pass --older-than, --not-hit-for and/or --orphans."
+            )
+        if options['not_hit_for'] is not None and not get_setting('HIT_COUNTS'):
+            raise CommandError(
+                "--not-hit-for requires URL_TRACKER_HIT_COUNTS, without it "
+                "no old URL has ever been hit."
+            )
+        now = timezone.now()
+        pruned = OldURL.objects.prune(
+            older_than=self.days_ago(now, options['older_than']),
+            not_hit_since=self.days_ago(now, options['not_hit_for']),
+            orphans=options['orphans'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            sleep=options['sleep']
+        )
+        self.stdout.write("%s %d old URLs." % (
+            "Would delete" if options['dry_run'] else "Deleted",
+            pruned
+        ))
+
+    def days_ago(self, now, days):
+        if days is None:
+            return None
+        return now - timedelta(days=days)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from url_tracker.models import URLRedirect
+
+
+class Command(BaseCommand):
+    help = (
+        "Recreates the redirect lookup table from all old URLs and their "
+        "URL change methods."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of old URLs refreshed per batch."
+        )
+
+    def handle(self, *args, **options):
+        URLRedirect.objects.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(
+            "Rebuilt %d redirects." % URLRedirect.objects.count()
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from url_tracker.conf import get_setting
+from url_tracker.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes all redirects to the snapshot file that is memory-mapped by "
+        "the worker processes. Running workers switch to the new file "
+        "automatically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=None,
+            help="Write the snapshot to this file instead of "
+                 "URL_TRACKER_SNAPSHOT_FILE."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help="Number of redirects read from the database at once."
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or get_setting('SNAPSHOT_FILE')
+        if not path:
+            raise CommandError(
+                "Set URL_TRACKER_SNAPSHOT_FILE or pass --path."
+            )
+        count = build_snapshot(path, batch_size=options['batch_size'])
+        self.stdout.write("Wrote %d redirects to '%s'." % (count, path))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from url_tracker.models import RedirectRule
+from url_tracker.rules import suggest_rules
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds groups of redirects that only replace a prefix of the old URL "
+        "and could be replaced by a single redirect rule."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-urls',
+            type=int,
+            default=100,
+            help="Only suggest rules that replace at least this many redirects."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Number of redirects read from the database at once."
+        )
+        parser.add_argument(
+            '--create',
+            action='store_true',
+            default=False,
+            help="Create the suggested rules without conflicts. The old URLs "
+                 "are kept, they take precedence over the rules."
+        )
+
+    def handle(self, *args, **options):
+        suggestions = suggest_rules(
+            min_urls=options['min_urls'],
+            batch_size=options['batch_size']
+        )
+        created = 0
+        for old_prefix, new_prefix, count, conflicts in suggestions:
+            self.stdout.write(
+                "%s -> %s: %d redirects, %d conflicting" % (
+                    old_prefix,
+                    new_prefix,
+                    count,
+                    conflicts
+                )
+            )
+            if options['create'] and not conflicts:
+                __, was_created = RedirectRule.objects.get_or_create(
+                    old_prefix=old_prefix,
+                    defaults={'new_prefix': new_prefix}
+                )
+                created += was_created
+        if options['create']:
+            self.stdout.write("Created %d redirect rules." % created)
@@ -0,0 +1,39 @@
+from django.db import models
+
+from url_tracker.trackers import (
+    get_attnames,
+    get_url_tracking_fields,
+    track_bulk_changes,
+)
+
+
+class URLTrackingQuerySet(models.QuerySet):
+    """
+    QuerySet that records the URL changes caused by ``update()`` in bulk.
+
+    Use it as the default manager of tracked models that are updated in
+    bulk::
+
+        class Project(url_tracker.URLTrackingMixin, models.Model):
+            ...
+
+            objects = url_tracker.URLTrackingManager()
+
+    If all tracked methods declare their fields in ``url_tracking_fields``,
+    updates that don't change any of them, e.g. of counters, aren't tracked.
+    """
+
+    def update(self, **kwargs):
+        fields = get_url_tracking_fields(
+            self.model,
+            self.model.get_url_tracking_methods()
+        )
+        if fields is not None and not (
+                get_attnames(self.model, kwargs) & get_attnames(self.model, fields)):
+            return super(URLTrackingQuerySet, self).update(**kwargs)
+        with track_bulk_changes(self):
+            return super(URLTrackingQuerySet, self).update(**kwargs)
+    update.alters_data = True
+
+
+URLTrackingManager = models.Manager.from_queryset(URLTrackingQuerySet)
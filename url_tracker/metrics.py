@@ -0,0 +1,259 @@
+"""
+Instrumentation of redirect lookups and tracked saves.
+
+With ``URL_TRACKER_METRICS`` set to the dotted path of a metrics backend,
+the middleware records the time and number of queries of every lookup,
+whether it was answered from memory and whether it resulted in a redirect,
+a ``410`` or nothing. Tracked saves record the time and queries of their
+``pre_save`` and ``post_save`` work, and the time spent in URL methods is
+recorded separately as ``reverse_seconds``. Before Django 2.0 queries are
+only counted while ``DEBUG`` is on.
+
+Backends implement ``increment(name, value=1)`` for counters and
+``observe(name, value)`` for histograms. ``LocalMetrics`` keeps them in the
+process and renders them in the Prometheus text format, ``StatsdMetrics``
+sends them to a statsd server. Without the setting nothing is measured.
+"""
+import functools
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from url_tracker.conf import get_setting
+
+SECONDS_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class LocalMetrics(object):
+    """
+    Counters and histograms of this process, rendered in the Prometheus
+    text format by ``render()`` and ``metrics_view``. Each process has its
+    own, so every process has to be scraped.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(
+                    SECONDS_BUCKETS if name.endswith('_seconds') else QUERIES_BUCKETS
+                )
+            histogram.observe(value)
+
+    def render(self):
+        prefix = get_setting('METRICS_PREFIX')
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                full_name = '%s_%s_total' % (prefix, name)
+                lines.append('# TYPE %s counter' % full_name)
+                lines.append('%s %s' % (full_name, value))
+            for name, histogram in sorted(self.histograms.items()):
+                full_name = '%s_%s' % (prefix, name)
+                lines.append('# TYPE %s histogram' % full_name)
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append('%s_bucket{le="%s"} %d' % (full_name, bound, count))
+                lines.append('%s_bucket{le="+Inf"} %d' % (full_name, histogram.count))
+                lines.append('%s_sum %s' % (full_name, histogram.sum))
+                lines.append('%s_count %d' % (full_name, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class StatsdMetrics(object):
+    """
+    Sends the metrics over UDP to the statsd server at
+    ``URL_TRACKER_METRICS_STATSD_HOST`` and ``URL_TRACKER_METRICS_STATSD_PORT``,
+    durations as timers in milliseconds.
+    """
+
+    def __init__(self):
+        self.address = (
+            get_setting('METRICS_STATSD_HOST'),
+            get_setting('METRICS_STATSD_PORT')
+        )
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, kind):
+        data = '%s.%s:%s|%s' % (get_setting('METRICS_PREFIX'), name, value, kind)
+        try:
+            self.socket.sendto(data.encode('ascii'), self.address)
+        except socket.error:
+            # metrics must never break a request
+            pass
+
+    def increment(self, name, value=1):
+        self.send(name, value, 'c')
+
+    def observe(self, name, value):
+        if name.endswith('_seconds'):
+            self.send(name[:-len('_seconds')], int(round(value * 1000)), 'ms')
+        else:
+            self.send(name, value, 'h')
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_metrics():
+    """
+    Returns the metrics backend configured in ``URL_TRACKER_METRICS`` or
+    ``None`` if nothing is measured.
+    """
+    path = get_setting('METRICS')
+    if not path:
+        return None
+    if path not in _backends:
+        with _backends_lock:
+            if path not in _backends:
+                _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def count_new_queries(queries_log, last):
+    """
+    Returns the number of queries logged after *last*. The log is a bounded
+    deque, so its length can't be compared once it's full.
+    """
+    count = 0
+    for query in reversed(queries_log):
+        if query is last:
+            break
+        count += 1
+    return count
+
+
+class QueryCounter(object):
+    """
+    Counts the queries on *connection* in the ``with`` block. Connections
+    with ``execute_wrapper``, added in Django 2.0, count them in a wrapper,
+    others only from the query log, which is only written while ``DEBUG``
+    is on. ``count`` stays ``None`` if the queries aren't counted.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = None
+        self._wrapper = None
+        self._logged = False
+        self._last = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        if hasattr(self.connection, 'execute_wrapper'):
+            self.count = 0
+            self._wrapper = self.connection.execute_wrapper(self)
+            self._wrapper.__enter__()
+        elif self.connection.queries_logged:
+            queries_log = self.connection.queries_log
+            self._logged = True
+            self._last = queries_log[-1] if queries_log else None
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._wrapper is not None:
+            self._wrapper.__exit__(*exc_info)
+        elif self._logged:
+            self.count = count_new_queries(self.connection.queries_log, self._last)
+
+
+@contextmanager
+def measure(metrics, name, using=None):
+    """
+    Observes the time and the number of queries on the *using* database of
+    the ``with`` block as ``<name>_seconds`` and ``<name>_queries``, the
+    latter only if the queries are counted.
+    """
+    counter = QueryCounter(connections[using or DEFAULT_DB_ALIAS])
+    start = time.time()
+    try:
+        with counter:
+            yield
+    finally:
+        metrics.observe(name + '_seconds', time.time() - start)
+        if counter.count is not None:
+            metrics.observe(name + '_queries', counter.count)
+
+
+def instrumented(name):
+    """
+    Decorates a signal receiver to be measured as *name* if metrics are
+    enabled.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = get_metrics()
+            if metrics is None:
+                return func(*args, **kwargs)
+            with measure(metrics, name, kwargs.get('using')):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call_url_method(instance, method_name):
+    """
+    Returns the URL of *instance* for *method_name*, recording the time
+    spent in the method if metrics are enabled.
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return getattr(instance, method_name)()
+    start = time.time()
+    try:
+        return getattr(instance, method_name)()
+    finally:
+        metrics.observe('reverse_seconds', time.time() - start)
+
+
+def metrics_view(request):
+    """
+    Returns the metrics of ``LocalMetrics`` in the Prometheus text format.
+    """
+    from django import http
+
+    metrics = get_metrics()
+    if not hasattr(metrics, 'render'):
+        raise http.Http404("URL_TRACKER_METRICS doesn't render metrics.")
+    return http.HttpResponse(
+        metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
@@ -1,36 +1,188 @@
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django import http
+from django.db import router
 
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:  # Django < 1.10
+    MiddlewareMixin = object
 
-class URLChangePermanentRedirectMiddleware(object):
-    def __init__(self):
+from url_tracker.bloom import get_bloom_filter
+from url_tracker.cache import redirect_cache, shared_redirect_cache, MISSING
+from url_tracker.conf import get_setting
+from url_tracker.hits import record_hit
+from url_tracker.metrics import get_metrics, measure
+from url_tracker.normalize import normalize_url
+from url_tracker.rules import match_redirect_rule
+from url_tracker.snapshot import get_snapshot_lookup
+
+
+class URLChangePermanentRedirectMiddleware(MiddlewareMixin):
+    """
+    Redirects requests for old URLs to their new URL or returns a 410 for
+    URLs that are gone.
+
+    Like the flatpages middleware, the lookup only happens for responses
+    with a 404 status so that URLs that resolve don't cause any database
+    work. With ``URL_TRACKER_EAGER_LOOKUP`` enabled the lookup happens for
+    every request before it's passed to the view instead.
+
+    URLs that aren't tracked individually are matched against the
+    ``RedirectRule`` prefixes. Lookups are cached per process or, with
+    ``URL_TRACKER_SHARED_CACHE`` set, in a Django cache shared by all
+    processes.
+
+    Works with both ``MIDDLEWARE`` and ``MIDDLEWARE_CLASSES``.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
         if 'url_tracker' not in settings.INSTALLED_APPS:
             raise ImproperlyConfigured(
                 "You cannot use URLChangePermanentRedirectMiddleware when "
                 "url_tracker is not installed."
             )
+        if get_setting('BLOOM_FILTER'):
+            # mapped or built at startup instead of in the first request
+            get_bloom_filter()
 
     def process_request(self, request):
-        from url_tracker.models import OldURL
+        if get_setting('EAGER_LOOKUP'):
+            return self.get_redirect_response(request)
+
+    def process_response(self, request, response):
+        if response.status_code != 404 or get_setting('EAGER_LOOKUP'):
+            return response
+        return self.get_redirect_response(request) or response
+
+    def get_redirect_response(self, request):
+        """
+        Returns a redirect or gone response if the requested URL is tracked.
+        """
+        metrics = get_metrics()
+        if metrics is None:
+            new_url = self.get_new_url(request)
+        else:
+            from url_tracker.models import URLRedirect
+
+            with measure(metrics, 'lookup', router.db_for_read(URLRedirect)):
+                new_url = self.get_new_url(request, metrics)
+            metrics.increment(
+                'lookup_miss' if new_url is None else
+                'lookup_redirect' if new_url else 'lookup_gone'
+            )
+
+        if new_url is None:
+            return
+        if not new_url:
+            return http.HttpResponseGone()
+        return http.HttpResponsePermanentRedirect(new_url)
 
+    def get_new_url(self, request, metrics=None):
+        """
+        Returns the new URL of the request, ``''`` if it's gone or ``None``
+        if it isn't tracked. Lookups answered from memory are counted as
+        ``memory_hit`` in *metrics*, the others as ``memory_miss``.
+        """
         full_path = request.get_full_path()
+        candidates = self.get_candidates(request, full_path)
 
-        old_url = None
-        try:
-            old_url = OldURL.objects.get(url__exact=full_path)
-        except OldURL.DoesNotExist:
-            pass
-        if settings.APPEND_SLASH and not request.path.endswith('/'):
+        new_url = self.get_known_new_url(full_path, candidates)
+        if metrics is not None:
+            metrics.increment('memory_miss' if new_url is MISSING else 'memory_hit')
+        if new_url is MISSING:
+            new_url = self.lookup_new_url(candidates)
+            if shared_redirect_cache.cache is None:
+                redirect_cache.set(full_path, new_url)
+        if new_url == full_path:
+            # the requested URL is a variant of itself, don't redirect in a loop
+            new_url = None
+        if new_url is not None:
+            record_hit(candidates)
+        else:
+            new_url = match_redirect_rule(request.path)
+            query_string = request.META.get('QUERY_STRING', '')
+            if new_url and query_string:
+                new_url += '?' + query_string
+        return new_url
+
+    def get_candidates(self, request, full_path):
+        """
+        Returns the normalized URLs that are looked up for *full_path*, the
+        last one taking precedence. URLs that aren't in the bloom filter are
+        left out.
+        """
+        candidates = [normalize_url(full_path)]
+        if (settings.APPEND_SLASH and not request.path.endswith('/') and
+                not get_setting('NORMALIZE_TRAILING_SLASH')):
             # Try appending a trailing slash.
             path_len = len(request.path)
-            full_path = full_path[:path_len] + '/' + full_path[path_len:]
-            try:
-                old_url = OldURL.objects.get(url__exact=full_path)
-            except OldURL.DoesNotExist:
-                pass
-        if old_url:
-            new_url = old_url.get_new_url()
-            if not new_url:
-                return http.HttpResponseGone()
-            return http.HttpResponsePermanentRedirect(new_url)
+            candidates.append(normalize_url(
+                full_path[:path_len] + '/' + full_path[path_len:]
+            ))
+
+        bloom_filter = get_bloom_filter()
+        if bloom_filter is not None:
+            candidates = [url for url in candidates if url in bloom_filter]
+        return candidates
+
+    def get_known_new_url(self, full_path, candidates):
+        """
+        Returns the new URL for *full_path* if it's known without any I/O,
+        from the per-process cache or the snapshot, and ``MISSING`` if it
+        has to be looked up. Most requests are answered here, so that a
+        server handling requests asynchronously only has to hand the others
+        off to a thread.
+        """
+        if not candidates:
+            return None
+
+        snapshot_lookup = get_snapshot_lookup()
+        if snapshot_lookup is not None and not snapshot_lookup.needs_poll():
+            result = snapshot_lookup.lookup_many(candidates)
+            if result is not None and not result[1]:
+                return self.choose_new_url(candidates, result[0])
+
+        if shared_redirect_cache.cache is not None:
+            # entries of the per-process cache could be stale in this process
+            return MISSING
+        return redirect_cache.get(full_path)
+
+    def choose_new_url(self, candidates, targets):
+        for url in reversed(candidates):
+            if targets.get(url) is not None:
+                return targets[url]
+        return None
+
+    def lookup_new_url(self, candidates):
+        """
+        Returns the new URL for the *candidates*, ``''`` if the URL is gone
+        or ``None`` if the URL isn't tracked.
+        """
+        from url_tracker.models import URLRedirect
+
+        snapshot_lookup = get_snapshot_lookup()
+        result = snapshot_lookup and snapshot_lookup.lookup_many(candidates)
+        if result is not None:
+            targets, changed = result
+            if changed:
+                targets.update(URLRedirect.objects.lookup_many(changed))
+            return self.choose_new_url(candidates, targets)
+
+        if shared_redirect_cache.cache is None:
+            return URLRedirect.objects.lookup(candidates)
+
+        # read before the database so that targets looked up concurrently
+        # with a change are cached under the generation it invalidated
+        generation = shared_redirect_cache.get_generation()
+        targets = shared_redirect_cache.get_many(generation, candidates)
+        missing = [url for url in candidates if url not in targets]
+        if missing:
+            found = URLRedirect.objects.lookup_many(missing)
+            looked_up = dict((url, found.get(url)) for url in missing)
+            shared_redirect_cache.set_many(generation, looked_up)
+            targets.update(looked_up)
+        return self.choose_new_url(candidates, targets)
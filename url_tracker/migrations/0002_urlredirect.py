@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Max
+import django.db.models.deletion
+from django.utils.encoding import force_bytes
+
+
+def hash_url(url):
+    # frozen, the hash of the models depends on the settings
+    return hashlib.md5(force_bytes(url)).hexdigest()
+
+
+def create_redirects(apps, schema_editor):
+    OldURL = apps.get_model('url_tracker', 'OldURL')
+    URLRedirect = apps.get_model('url_tracker', 'URLRedirect')
+
+    old_urls = OldURL.objects.order_by('pk').annotate(
+        target=Max('model_method__current_url')
+    ).values_list('pk', 'url', 'target')
+    last_id = 0
+    while True:
+        batch = list(old_urls.filter(pk__gt=last_id)[:1000])
+        if not batch:
+            break
+        redirects = {}
+        for old_url_id, url, target in batch:
+            redirects[hash_url(url)] = URLRedirect(
+                url_hash=hash_url(url),
+                url=url,
+                old_url_id=old_url_id,
+                target=target or ''
+            )
+        URLRedirect.objects.bulk_create(redirects.values())
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='URLRedirect',
+            fields=[
+                ('url_hash', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('url', models.TextField()),
+                ('target', models.TextField(blank=True)),
+                ('old_url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redirects', to='url_tracker.OldURL')),
+            ],
+        ),
+        migrations.RunPython(create_redirects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+from django.utils.encoding import force_bytes
+
+
+def hash_target(target):
+    # frozen, the hash of the models depends on the settings
+    return hashlib.md5(force_bytes(target)).hexdigest() if target else ''
+
+
+def set_target_hashes(apps, schema_editor):
+    URLRedirect = apps.get_model('url_tracker', 'URLRedirect')
+
+    redirects = URLRedirect.objects.exclude(target='').order_by(
+        'url_hash'
+    ).values_list('url_hash', 'target')
+    last_hash = ''
+    while True:
+        batch = list(redirects.filter(url_hash__gt=last_hash)[:1000])
+        if not batch:
+            break
+        for url_hash, target in batch:
+            URLRedirect.objects.filter(url_hash=url_hash).update(
+                target_hash=hash_target(target)
+            )
+        last_hash = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0002_urlredirect'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlredirect',
+            name='target_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+        migrations.RunPython(set_target_hashes, migrations.RunPython.noop),
+    ]
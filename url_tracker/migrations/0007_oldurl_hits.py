@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0006_redirectrule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='oldurl',
+            name='hits',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='oldurl',
+            name='last_hit',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+from django.utils.encoding import force_bytes
+
+# each row binds three parameters, stay below SQLite's limit of 999
+BATCH_SIZE = 250
+
+
+def hash_current_url(url):
+    # frozen, the migration must not change with the models
+    return hashlib.md5(force_bytes(url)).hexdigest()
+
+
+def set_current_url_hashes(apps, schema_editor):
+    URLChangeMethod = apps.get_model('url_tracker', 'URLChangeMethod')
+
+    url_methods = URLChangeMethod.objects.order_by('pk').values_list(
+        'pk', 'current_url'
+    )
+    last_id = 0
+    while True:
+        batch = list(url_methods.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        URLChangeMethod.objects.filter(pk__in=[pk for pk, __ in batch]).update(
+            current_url_hash=Case(
+                *[When(pk=pk, then=Value(hash_current_url(url))) for pk, url in batch],
+                output_field=CharField()
+            )
+        )
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0008_oldurl_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='urlchangemethod',
+            name='current_url_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=32),
+        ),
+        migrations.RunPython(set_current_url_hashes, migrations.RunPython.noop),
+    ]
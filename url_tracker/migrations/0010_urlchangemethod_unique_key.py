@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Length
+from django.utils.encoding import force_bytes
+
+# the lengths of the columns once they are bounded
+MAX_LENGTHS = {'object_id': 128, 'method_name': 64}
+
+
+def hash_value(value):
+    # frozen, the migration must not change with the models
+    return hashlib.md5(force_bytes(value)).hexdigest()
+
+
+def check_lengths(apps, schema_editor):
+    """
+    Refuses to migrate rows whose values don't fit into the bounded
+    columns, which would fail or be truncated without notice on MySQL.
+    """
+    URLChangeMethod = apps.get_model('url_tracker', 'URLChangeMethod')
+
+    for field_name, max_length in MAX_LENGTHS.items():
+        too_long = URLChangeMethod.objects.annotate(
+            length=Length(field_name)
+        ).filter(length__gt=max_length)
+        count = too_long.count()
+        if count:
+            raise ValueError(
+                "%d URL change methods have a value of %s longer than %d "
+                "characters, e.g. the one with id %d. Shorten or delete them "
+                "before migrating." % (
+                    count, field_name, max_length,
+                    too_long.values_list('pk', flat=True)[0]
+                )
+            )
+
+
+def get_targets(OldURL, old_url_ids):
+    return dict(OldURL.objects.filter(pk__in=old_url_ids).annotate(
+        target=Max('model_method__current_url')
+    ).values_list('pk', 'target'))
+
+
+def merge_duplicate_url_methods(apps, schema_editor):
+    """
+    Merges URL change methods of the same object and method into the oldest
+    one, which keeps all their old URLs and the greatest current URL, the
+    one their redirects pointed at. The redirects of old URLs whose target
+    changed are updated.
+    """
+    URLChangeMethod = apps.get_model('url_tracker', 'URLChangeMethod')
+    OldURL = apps.get_model('url_tracker', 'OldURL')
+    URLRedirect = apps.get_model('url_tracker', 'URLRedirect')
+    Relation = URLChangeMethod.old_urls.through
+
+    duplicates = URLChangeMethod.objects.values(
+        'content_type', 'object_id', 'method_name'
+    ).annotate(count=Count('pk'), first=Min('pk')).filter(count__gt=1)
+    for duplicate in duplicates.iterator():
+        url_methods = list(URLChangeMethod.objects.filter(
+            content_type=duplicate['content_type'],
+            object_id=duplicate['object_id'],
+            method_name=duplicate['method_name']
+        ).exclude(pk=duplicate['first']))
+        ids = [url_method.pk for url_method in url_methods]
+        old_url_ids = set(Relation.objects.filter(
+            urlchangemethod__in=ids + [duplicate['first']]
+        ).values_list('oldurl', flat=True))
+        previous_targets = get_targets(OldURL, old_url_ids)
+        related = set(Relation.objects.filter(
+            urlchangemethod=duplicate['first']
+        ).values_list('oldurl', flat=True))
+        moved = set(Relation.objects.filter(
+            urlchangemethod__in=ids
+        ).values_list('oldurl', flat=True)) - related
+        Relation.objects.bulk_create([
+            Relation(urlchangemethod_id=duplicate['first'], oldurl_id=old_url_id)
+            for old_url_id in moved
+        ])
+        current_url = max(
+            [url_method.current_url for url_method in url_methods] +
+            [URLChangeMethod.objects.get(pk=duplicate['first']).current_url]
+        )
+        URLChangeMethod.objects.filter(pk=duplicate['first']).update(
+            current_url=current_url,
+            current_url_hash=hash_value(current_url)
+        )
+        Relation.objects.filter(urlchangemethod__in=ids).delete()
+        URLChangeMethod.objects.filter(pk__in=ids).delete()
+        for old_url_id, target in get_targets(OldURL, old_url_ids).items():
+            if target != previous_targets.get(old_url_id):
+                URLRedirect.objects.filter(old_url=old_url_id).update(
+                    target=target or '',
+                    target_hash=hash_value(target) if target else ''
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0009_urlchangemethod_current_url_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_lengths, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicate_url_methods, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='urlchangemethod',
+            name='method_name',
+            field=models.CharField(max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='urlchangemethod',
+            name='object_id',
+            field=models.CharField(max_length=128),
+        ),
+        migrations.AlterUniqueTogether(
+            name='urlchangemethod',
+            unique_together=set([('content_type', 'object_id', 'method_name')]),
+        ),
+    ]
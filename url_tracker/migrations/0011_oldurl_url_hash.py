@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+from django.utils.encoding import force_bytes
+
+# each row binds three parameters, stay below SQLite's limit of 999
+BATCH_SIZE = 250
+
+
+def hash_url(url):
+    # frozen, the hash of the models depends on the settings
+    return hashlib.md5(force_bytes(url)).hexdigest()
+
+
+def set_url_hashes(apps, schema_editor):
+    # The URLs are still unique, so are their hashes. Old URLs that only
+    # match after normalizing them are left to ``OldURL.objects.rehash()``.
+    OldURL = apps.get_model('url_tracker', 'OldURL')
+
+    old_urls = OldURL.objects.order_by('pk').values_list('pk', 'url')
+    last_id = 0
+    while True:
+        batch = list(old_urls.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        OldURL.objects.filter(pk__in=[pk for pk, __ in batch]).update(
+            url_hash=Case(
+                *[When(pk=pk, then=Value(hash_url(url))) for pk, url in batch],
+                output_field=CharField()
+            )
+        )
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0010_urlchangemethod_unique_key'),
+    ]
+
+    operations = [
+        # indexed by the next migration once all rows are filled in
+        migrations.AddField(
+            model_name='oldurl',
+            name='url_hash',
+            field=models.CharField(editable=False, max_length=32, null=True),
+        ),
+        migrations.RunPython(set_url_hashes, migrations.RunPython.noop),
+    ]
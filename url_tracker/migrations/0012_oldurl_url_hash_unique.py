@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('url_tracker', '0011_oldurl_url_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='oldurl',
+            name='url_hash',
+            field=models.CharField(editable=False, max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='oldurl',
+            name='url',
+            field=models.TextField(),
+        ),
+    ]
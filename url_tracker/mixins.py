@@ -2,6 +2,8 @@ class URLTrackingMixin(object):
     url_tracking_methods = [
         'get_absolute_url',
     ]
+    # optional mapping of method names to the fields their URL depends on
+    url_tracking_fields = {}
 
     @classmethod
     def get_url_tracking_methods(cls):
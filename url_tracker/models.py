@@ -1,5 +1,11 @@
-from django.db import models
+import hashlib
 import logging
+import time
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, IntegrityError
+from django.db.models import Max
+from django.utils.encoding import force_bytes
 
 from django.contrib.contenttypes.models import ContentType
 try:  # new import added in Django 1.7
@@ -8,17 +14,53 @@ except ImportError:
     from django.contrib.contenttypes import generic
     GenericForeignKey = generic.GenericForeignKey
 
+from url_tracker.cache import invalidate_redirect_cache
+from url_tracker.normalize import normalize_url
+from url_tracker.rules import is_nested
+from url_tracker.snapshot import log_redirect_changes
+
 
 logger = logging.getLogger(__file__)
 
+# the maximum length of a redirect chain that is followed to its end
+MAX_REDIRECT_HOPS = 20
+
+
+def hash_url(url):
+    """
+    Returns the fixed-length key under which redirects for *url* are stored,
+    the hash of its normalized form.
+    """
+    return hashlib.md5(force_bytes(normalize_url(url))).hexdigest()
+
+
+def hash_current_url(url):
+    """
+    Returns the hash the current URL of a ``URLChangeMethod`` is indexed by.
+    Unlike ``hash_url`` the URL isn't normalized, so it doesn't change with
+    the settings.
+    """
+    return hashlib.md5(force_bytes(url)).hexdigest()
+
+
+def hash_target(target):
+    """
+    Returns the hash stored for a redirect *target*, empty for gone URLs.
+    """
+    return hash_url(target) if target else ''
+
 
 class URLChangeMethod(models.Model):
     content_type = models.ForeignKey(ContentType)
-    object_id = models.TextField()
+    object_id = models.CharField(max_length=128)
     content_object = GenericForeignKey('content_type', 'object_id')
 
-    method_name = models.TextField()
+    method_name = models.CharField(max_length=64)
     current_url = models.TextField(blank=True)
+    # the URL can be too long to be indexed, searches in the admin use this
+    current_url_hash = models.CharField(
+        max_length=32, blank=True, db_index=True, editable=False
+    )
     old_urls = models.ManyToManyField(
         'OldURL',
         related_name='model_method'
@@ -26,6 +68,8 @@ class URLChangeMethod(models.Model):
 
     class Meta:
         app_label = 'url_tracker'
+        # the key every save of a tracked object looks its methods up by
+        unique_together = ('content_type', 'object_id', 'method_name')
 
     def __unicode__(self):
         return '{0}.{1}, with current url {2}'.format(
@@ -34,9 +78,130 @@ class URLChangeMethod(models.Model):
             self.current_url
         )
 
+    def save(self, *args, **kwargs):
+        self.current_url_hash = hash_current_url(self.current_url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'current_url' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['current_url_hash']
+        super(URLChangeMethod, self).save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(URLChangeMethod, cls).from_db(db, field_names, values)
+        # the redirects only need to be refreshed if it changes
+        instance._saved_current_url = instance.__dict__.get('current_url')
+        return instance
+
+
+class OldURLManager(models.Manager):
+    def prune(self, older_than=None, not_hit_since=None, orphans=False,
+              batch_size=1000, dry_run=False, sleep=0):
+        """
+        Deletes old URLs that were recorded before *older_than* and haven't
+        been requested since *not_hit_since*, along with their redirects,
+        and returns the number of deleted old URLs. Old URLs that were never
+        requested count as not hit since they were recorded. With *orphans*
+        set, old URLs that don't belong to any ``URLChangeMethod`` are
+        deleted as well.
+
+        The old URLs are deleted in separate transactions of *batch_size*
+        rows, optionally pausing *sleep* seconds between them, so that no
+        locks are held for long. ``URLChangeMethod``s that are left without
+        old URLs are deleted too. With *dry_run* set nothing is deleted.
+        """
+        conditions = models.Q()
+        if older_than is not None:
+            conditions &= models.Q(created__lt=older_than)
+        if not_hit_since is not None:
+            conditions &= (
+                models.Q(last_hit__lt=not_hit_since) |
+                models.Q(last_hit__isnull=True, created__lt=not_hit_since)
+            )
+        if older_than is None and not_hit_since is None:
+            conditions = None
+        if orphans:
+            orphaned = ~models.Q(pk__in=URLChangeMethod.old_urls.through.objects.values(
+                'oldurl'
+            ))
+            conditions = orphaned if conditions is None else conditions | orphaned
+        if conditions is None:
+            return 0
+
+        candidates = self.filter(conditions).order_by('pk').values_list('pk', 'url')
+        pruned = 0
+        last_id = 0
+        while True:
+            batch = list(candidates.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            pruned += len(batch)
+            if not dry_run:
+                self._delete_batch(batch)
+                if sleep:
+                    time.sleep(sleep)
+        return pruned
+
+    def rehash(self, ids):
+        """
+        Updates the hashes of the old URLs with the given ids, which change
+        with the ``URL_TRACKER_NORMALIZE_*`` settings. An old URL keeps its
+        previous hash if another old URL already has the new one, both are
+        resolved through the same redirect.
+        """
+        for pk, url, url_hash in self.filter(pk__in=ids).values_list(
+                'pk', 'url', 'url_hash'):
+            if hash_url(url) == url_hash:
+                continue
+            try:
+                with transaction.atomic(using=self.db):
+                    self.filter(pk=pk).update(url_hash=hash_url(url))
+            except IntegrityError:
+                pass
+
+    def _delete_batch(self, old_urls):
+        Relation = URLChangeMethod.old_urls.through
+        ids = [pk for pk, __ in old_urls]
+        with transaction.atomic():
+            url_method_ids = list(Relation.objects.filter(
+                oldurl__in=ids
+            ).values_list('urlchangemethod', flat=True).distinct())
+            URLRedirect.objects.filter(old_url__in=ids).delete()
+            Relation.objects.filter(oldurl__in=ids).delete()
+            # the dependent rows are deleted above, this skips the signals
+            # sent for every deleted object
+            queryset = self.filter(pk__in=ids)
+            queryset._raw_delete(queryset.db)
+            if url_method_ids:
+                URLChangeMethod.objects.filter(
+                    pk__in=url_method_ids,
+                    old_urls__isnull=True
+                ).delete()
+            log_redirect_changes(hash_url(url) for __, url in old_urls)
+        invalidate_redirect_cache(using=self.db)
+
 
 class OldURL(models.Model):
-    url = models.TextField(unique=True)
+    """
+    A URL an object was previously available at.
+
+    Old URLs are looked up by ``url_hash``, the fixed-length hash of the
+    normalized URL, so that the unique index doesn't grow with the length
+    of the URLs. The hash is set whenever an old URL is saved.
+    """
+    url = models.TextField()
+    url_hash = models.CharField(max_length=32, unique=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    # counted by the middleware with URL_TRACKER_HIT_COUNTS enabled
+    hits = models.PositiveIntegerField(default=0, editable=False)
+    last_hit = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True
+    )
+
+    objects = OldURLManager()
 
     class Meta:
         app_label = 'url_tracker'
@@ -44,8 +209,21 @@ class OldURL(models.Model):
     def __unicode__(self):
         return '{0}'.format(self.url)
 
+    def save(self, *args, **kwargs):
+        self.url_hash = hash_url(self.url)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'url' in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['url_hash']
+        super(OldURL, self).save(*args, **kwargs)
+
     def get_new_url(self):
-        all_new_urls = self.model_method.order_by('-current_url').values_list('current_url', flat=True)
+        """
+        Returns the URL this old URL redirects to, ``''`` if it's gone,
+        e.g. because it doesn't belong to any ``URLChangeMethod``.
+        """
+        all_new_urls = list(self.model_method.order_by('-current_url').values_list('current_url', flat=True))
+        if not all_new_urls:
+            return ''
         new_url = all_new_urls[0]
         if len(all_new_urls) > 1:
             logger.warning(
@@ -57,3 +235,392 @@ class OldURL(models.Model):
                  )
             )
         return new_url
+
+
+class PendingURLChange(models.Model):
+    """
+    A URL change waiting to be recorded by the ``QueueExecutor``.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.TextField()
+    method_name = models.TextField()
+    old_url = models.TextField()
+
+    class Meta:
+        app_label = 'url_tracker'
+
+    def __unicode__(self):
+        return '{0}.{1}, previously at {2}'.format(
+            self.object_id,
+            self.method_name,
+            self.old_url
+        )
+
+
+class URLRedirectManager(models.Manager):
+    def refresh(self, old_url_ids):
+        """
+        Updates the redirects for the ``OldURL``s with the given ids so that
+        they point at the new URL ``OldURL.get_new_url`` would return.
+
+        Redirect chains are collapsed in both directions: if the new URL is
+        an old URL itself the redirect points at the end of the chain, and
+        redirects that pointed at one of the refreshed URLs are updated to
+        point at its new target.
+        """
+        old_url_ids = set(old_url_ids)
+        if not old_url_ids:
+            return
+        targets = {}
+        for old_url_id, url, target in OldURL.objects.filter(
+                pk__in=old_url_ids).annotate(
+                    target=Max('model_method__current_url')).values_list(
+                        'pk', 'url', 'target'):
+            targets[hash_url(url)] = (old_url_id, url, target or '')
+
+        final_targets, __ = self.follow_chains(dict(
+            (url, target) for __, url, target in targets.values()
+        ))
+
+        existing = {}
+        for redirect in self.filter(
+                models.Q(old_url__in=old_url_ids) |
+                models.Q(url_hash__in=list(targets))):
+            existing[redirect.url_hash] = redirect
+
+        with transaction.atomic():
+            stale = [
+                url_hash for url_hash in existing if url_hash not in targets
+            ]
+            if stale:
+                self.filter(url_hash__in=stale).delete()
+            changed = []
+            for url_hash, (old_url_id, url, __) in targets.items():
+                target = final_targets[url]
+                redirect = existing.get(url_hash)
+                if redirect is None or (
+                        (redirect.old_url_id, redirect.target) != (old_url_id, target)):
+                    changed.append(self.model(
+                        url_hash=url_hash,
+                        url=url,
+                        old_url_id=old_url_id,
+                        target=target,
+                        target_hash=hash_target(target)
+                    ))
+            # changed redirects are replaced to update them in bulk
+            outdated = [
+                redirect.url_hash for redirect in changed
+                if redirect.url_hash in existing
+            ]
+            if outdated:
+                self.filter(url_hash__in=outdated).delete()
+            self._create(changed)
+            log_redirect_changes(
+                stale + [redirect.url_hash for redirect in changed]
+            )
+            self._collapse_into(final_targets)
+
+    def _create(self, redirects):
+        try:
+            with transaction.atomic():
+                self.bulk_create(redirects)
+        except IntegrityError:
+            # a concurrent refresh created some of them in the meantime
+            for redirect in redirects:
+                self.update_or_create(
+                    url_hash=redirect.url_hash,
+                    defaults={
+                        'url': redirect.url,
+                        'old_url_id': redirect.old_url_id,
+                        'target': redirect.target,
+                        'target_hash': redirect.target_hash,
+                    }
+                )
+
+    def _collapse_into(self, final_targets):
+        """
+        Points redirects whose target is one of the URLs in *final_targets*
+        at the target of that URL instead.
+        """
+        by_hash = dict(
+            (hash_url(url), target)
+            for url, target in final_targets.items() if target
+        )
+        if not by_hash:
+            return
+        chained = {}
+        for target_hash, url_hash in self.filter(
+                target_hash__in=list(by_hash)).values_list(
+                    'target_hash', 'url_hash'):
+            target = by_hash[target_hash]
+            # never turn a redirect into one to itself
+            if url_hash != hash_url(target):
+                chained.setdefault(target_hash, []).append(url_hash)
+        for target_hash, url_hashes in chained.items():
+            target = by_hash[target_hash]
+            self.filter(url_hash__in=url_hashes).update(
+                target=target,
+                target_hash=hash_url(target)
+            )
+        log_redirect_changes(
+            url_hash for url_hashes in chained.values() for url_hash in url_hashes
+        )
+
+    def follow_chains(self, targets):
+        """
+        Takes a dict of URLs and the URL they redirect to and returns a dict
+        with the URL at the end of each redirect chain instead, along with
+        the set of URLs that are part of a redirect cycle. URLs in a cycle
+        keep their original target.
+
+        Targets are looked up in *targets* first, then in the table, using
+        one query per hop for all URLs.
+        """
+        final_targets = dict(targets)
+        visited = dict((url, set([url])) for url in targets)
+        # a URL pointing at itself is a leftover of a URL change that is
+        # being recorded, not a cycle
+        pending = set(
+            url for url, target in targets.items()
+            if target and normalize_url(target) != normalize_url(url)
+        )
+        cycles = set()
+        for __ in range(MAX_REDIRECT_HOPS):
+            if not pending:
+                break
+            hops = self._next_hops(
+                set(final_targets[url] for url in pending),
+                targets
+            )
+            for url in list(pending):
+                target = final_targets[url]
+                next_target = hops.get(target)
+                if not next_target or next_target == target:
+                    pending.discard(url)
+                elif next_target in visited[url]:
+                    pending.discard(url)
+                    cycles.add(url)
+                else:
+                    visited[url].add(target)
+                    final_targets[url] = next_target
+        for url in cycles | pending:
+            final_targets[url] = targets[url]
+            logger.warning('the url %s is part of a redirect cycle', url)
+        return final_targets, cycles | pending
+
+    def _next_hops(self, urls, targets):
+        hops = dict((url, targets[url]) for url in urls if url in targets)
+        hashes = dict(
+            (hash_url(url), url) for url in urls if url not in targets
+        )
+        if hashes:
+            for url_hash, url, target in self.filter(
+                    url_hash__in=list(hashes)).values_list(
+                        'url_hash', 'url', 'target'):
+                if normalize_url(hashes[url_hash]) == normalize_url(url):
+                    hops[hashes[url_hash]] = target
+        return hops
+
+    def collapse_chains(self, batch_size=1000, dry_run=False):
+        """
+        Points every redirect whose target is an old URL itself at the end
+        of the chain. Returns the number of collapsed redirects and the set
+        of URLs that are part of a redirect cycle.
+        """
+        chained = self.filter(
+            target_hash__in=self.values('url_hash')
+        ).order_by('url_hash').values_list('url_hash', 'url', 'target')
+        collapsed = 0
+        cycles = set()
+        last_hash = ''
+        while True:
+            batch = list(chained.filter(url_hash__gt=last_hash)[:batch_size])
+            if not batch:
+                break
+            last_hash = batch[-1][0]
+            final_targets, batch_cycles = self.follow_chains(dict(
+                (url, target) for __, url, target in batch
+            ))
+            cycles |= batch_cycles
+            for url_hash, url, target in batch:
+                if final_targets[url] == target:
+                    continue
+                collapsed += 1
+                if not dry_run:
+                    self.filter(url_hash=url_hash).update(
+                        target=final_targets[url],
+                        target_hash=hash_target(final_targets[url])
+                    )
+                    log_redirect_changes([url_hash])
+        if collapsed and not dry_run:
+            invalidate_redirect_cache(using=self.db)
+        return collapsed, cycles
+
+    def rebuild(self, batch_size=1000):
+        """
+        Recreates the redirects for all ``OldURL``s, updating their hashes
+        first.
+        """
+        self.all().delete()
+        old_url_ids = OldURL.objects.order_by('pk').values_list('pk', flat=True)
+        last_id = 0
+        while True:
+            batch = list(old_url_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            OldURL.objects.rehash(batch)
+            self.refresh(batch)
+            last_id = batch[-1]
+        invalidate_redirect_cache(using=self.db)
+
+    def lookup_many(self, urls):
+        """
+        Returns the redirect targets of those *urls* that are tracked as a
+        dictionary, using a single indexed query.
+        """
+        hashes = dict((hash_url(url), url) for url in urls)
+        found = {}
+        for url_hash, url, target in self.filter(
+                url_hash__in=list(hashes)).values_list(
+                    'url_hash', 'url', 'target'):
+            if normalize_url(hashes[url_hash]) == normalize_url(url):
+                found[hashes[url_hash]] = target
+        return found
+
+    def lookup(self, urls):
+        """
+        Returns the redirect for the last of *urls* that is tracked or
+        ``None`` if none of them is, using a single indexed query.
+        """
+        found = self.lookup_many(urls)
+        for url in reversed(urls):
+            if url in found:
+                return found[url]
+        return None
+
+
+class URLRedirect(models.Model):
+    """
+    Denormalized redirect for an ``OldURL`` that stores the new URL it
+    resolves to, keyed by a hash of the old URL. An empty ``target`` means
+    that the URL is gone. If the new URL is an old URL itself, ``target``
+    is the URL at the end of that redirect chain.
+
+    It is kept up to date by signal receivers whenever old URLs or
+    ``URLChangeMethod``s change, so that requests can be answered with a
+    single primary key lookup.
+    """
+    url_hash = models.CharField(max_length=32, primary_key=True)
+    url = models.TextField()
+    old_url = models.ForeignKey(
+        OldURL,
+        related_name='redirects',
+        on_delete=models.CASCADE
+    )
+    target = models.TextField(blank=True)
+    target_hash = models.CharField(max_length=32, blank=True, db_index=True)
+
+    objects = URLRedirectManager()
+
+    class Meta:
+        app_label = 'url_tracker'
+
+    def __unicode__(self):
+        return '{0} -> {1}'.format(self.url, self.target)
+
+
+class RedirectRule(models.Model):
+    """
+    Redirects all URLs below ``old_prefix`` to the same path below
+    ``new_prefix``, or marks them as gone if ``new_prefix`` is empty.
+    """
+    old_prefix = models.TextField(unique=True)
+    new_prefix = models.TextField(blank=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'url_tracker'
+
+    def __unicode__(self):
+        return '{0} -> {1}'.format(self.old_prefix, self.new_prefix)
+
+    def clean(self):
+        if is_nested(self.old_prefix, self.new_prefix):
+            raise ValidationError({
+                'new_prefix': "The new prefix can't be below the old prefix, "
+                              "the rule would redirect its own targets."
+            })
+
+
+class URLRedirectChange(models.Model):
+    """
+    Log of changed redirects, used to tell which entries of the redirect
+    snapshot are outdated. The id of the last change when the snapshot was
+    built is its generation.
+    """
+    url_hash = models.CharField(max_length=32)
+
+    class Meta:
+        app_label = 'url_tracker'
+
+    def __unicode__(self):
+        return '{0}'.format(self.url_hash)
+
+
+def update_redirects_for_old_url(instance, raw=False, **kwargs):
+    """
+    Signal receiver refreshing the redirect of a saved ``OldURL``.
+    """
+    if raw:
+        return
+    URLRedirect.objects.refresh([instance.pk])
+
+
+def update_redirects_for_url_method(instance, raw=False, created=False, **kwargs):
+    """
+    Signal receiver refreshing the redirects of all old URLs of a saved
+    ``URLChangeMethod`` if its ``current_url`` changed. New methods don't
+    have any old URLs yet, those are refreshed when they are added.
+    """
+    saved_current_url = instance.__dict__.get('_saved_current_url')
+    instance._saved_current_url = instance.current_url
+    if raw or created or saved_current_url == instance.current_url:
+        return
+    URLRedirect.objects.refresh(
+        instance.old_urls.values_list('pk', flat=True)
+    )
+
+
+def update_redirects_for_deleted_url_method(instance, signal, **kwargs):
+    """
+    Signal receiver refreshing the redirects of the old URLs of a deleted
+    ``URLChangeMethod``. The old URLs are remembered on ``pre_delete`` as
+    the relation is gone by the time ``post_delete`` is sent.
+    """
+    if signal is models.signals.pre_delete:
+        instance._url_tracker_old_urls = list(
+            instance.old_urls.values_list('pk', flat=True)
+        )
+    else:
+        URLRedirect.objects.refresh(
+            instance.__dict__.pop('_url_tracker_old_urls', [])
+        )
+
+
+def update_redirects_for_relation(instance, action, reverse, pk_set, **kwargs):
+    """
+    Signal receiver refreshing redirects when old URLs are added to or
+    removed from a ``URLChangeMethod``.
+    """
+    if reverse:
+        # *instance* is the OldURL whose methods changed
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            URLRedirect.objects.refresh([instance.pk])
+    elif action == 'pre_clear':
+        instance._url_tracker_cleared = list(
+            instance.old_urls.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        URLRedirect.objects.refresh(instance.__dict__.pop('_url_tracker_cleared', []))
+    elif action in ('post_add', 'post_remove'):
+        URLRedirect.objects.refresh(pk_set)
@@ -0,0 +1,61 @@
+"""
+Normalization of URLs before they are stored and looked up.
+
+Old URLs are stored and redirects are keyed by their normalized form, and
+requested URLs are normalized the same way, so that all variants of a URL,
+e.g. with tracking parameters or a different case, resolve with a single
+lookup of the same key. Without any of the ``URL_TRACKER_NORMALIZE_*``
+settings URLs are used as they are.
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+from url_tracker.conf import get_setting
+
+QUERY_MODES = (None, 'sort', 'ignore')
+
+
+def normalize_url(url):
+    """
+    Returns the normalized form of *url*. Normalizing a normalized URL
+    doesn't change it.
+    """
+    lowercase = get_setting('NORMALIZE_LOWERCASE')
+    trailing_slash = get_setting('NORMALIZE_TRAILING_SLASH')
+    query_mode = get_setting('NORMALIZE_QUERY')
+    strip_params = get_setting('NORMALIZE_STRIP_PARAMS')
+    if not (lowercase or trailing_slash or query_mode or strip_params):
+        return url
+    if query_mode not in QUERY_MODES:
+        raise ImproperlyConfigured(
+            "URL_TRACKER_NORMALIZE_QUERY must be one of %s" % (QUERY_MODES,)
+        )
+
+    path, __, query_string = url.partition('?')
+    if lowercase:
+        path = path.lower()
+    if trailing_slash:
+        path = path.rstrip('/') or '/'
+    if query_mode == 'ignore':
+        return path
+
+    params = [param for param in query_string.split('&') if param]
+    if strip_params:
+        params = [
+            param for param in params
+            if not is_stripped(param.partition('=')[0], strip_params)
+        ]
+    if query_mode == 'sort':
+        params.sort()
+    if params:
+        return path + '?' + '&'.join(params)
+    return path
+
+
+def is_stripped(name, strip_params):
+    for stripped in strip_params:
+        if stripped.endswith('*'):
+            if name.startswith(stripped[:-1]):
+                return True
+        elif name == stripped:
+            return True
+    return False
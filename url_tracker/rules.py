@@ -0,0 +1,213 @@
+"""
+Prefix redirect rules for moving whole sections of a site.
+
+A ``RedirectRule`` redirects every URL below its old prefix to the same
+path below its new prefix, e.g. ``/blog/2019/`` to ``/articles/`` redirects
+``/blog/2019/some-post/`` to ``/articles/some-post/``. A ``*`` segment in
+the old prefix matches any single path segment.
+
+The rules are compiled into a trie of path segments, so matching a path
+takes one dictionary lookup per segment regardless of the number of rules.
+The middleware only checks the rules for URLs that aren't tracked
+individually. Old prefixes and requested paths are normalized like old
+URLs before they are matched.
+"""
+import threading
+import time
+
+from url_tracker.conf import get_setting
+from url_tracker.normalize import normalize_url
+
+WILDCARD = '*'
+# the key of a node's rule, segments are always strings
+RULE = None
+
+
+def split_prefix(prefix):
+    """
+    Returns the path segments of *prefix*, without the empty segment of a
+    trailing slash.
+    """
+    segments = prefix.split('/')
+    if len(segments) > 1 and not segments[-1]:
+        segments.pop()
+    return segments
+
+
+def is_nested(old_prefix, new_prefix):
+    """
+    Returns whether *new_prefix* is *old_prefix* or below it, so that the
+    rule would match its own targets and redirect in a loop.
+    """
+    if not new_prefix:
+        return False
+    old_segments = split_prefix(normalize_url(old_prefix))
+    new_segments = split_prefix(normalize_url(new_prefix.split('?')[0]))
+    return len(new_segments) >= len(old_segments) and all(
+        old in (new, WILDCARD) for old, new in zip(old_segments, new_segments)
+    )
+
+
+def join_target(new_prefix, remainder):
+    if not new_prefix or not remainder:
+        return new_prefix
+    return new_prefix.rstrip('/') + '/' + remainder
+
+
+class RuleTrie(object):
+    """
+    Trie of the path segments of old prefixes. The longest matching prefix
+    wins, a literal segment wins over a wildcard at the same depth.
+    """
+
+    def __init__(self, rules=()):
+        self.root = {}
+        self.count = 0
+        for old_prefix, new_prefix in rules:
+            self.add(old_prefix, new_prefix)
+
+    def add(self, old_prefix, new_prefix):
+        node = self.root
+        for segment in split_prefix(normalize_url(old_prefix)):
+            node = node.setdefault(segment, {})
+        if RULE not in node:
+            self.count += 1
+        node[RULE] = new_prefix
+
+    def match(self, path):
+        """
+        Returns the new URL for the normalized *path*, ``''`` if it's gone or
+        ``None`` if no rule matches.
+        """
+        segments = path.split('/')
+        nodes = [self.root]
+        match = None
+        for depth, segment in enumerate(segments):
+            nodes = [
+                node[key] for node in nodes for key in (segment, WILDCARD)
+                if key in node
+            ]
+            if not nodes:
+                break
+            for node in nodes:
+                if RULE in node:
+                    match = (depth + 1, node[RULE])
+                    break
+        if match is None:
+            return None
+        depth, new_prefix = match
+        return join_target(new_prefix, '/'.join(segments[depth:]))
+
+    def __len__(self):
+        return self.count
+
+
+class RedirectRules(object):
+    """
+    The compiled rules of this process. They are compiled again when rules
+    are changed in this process, and when a check of the rule table, at most
+    every ``URL_TRACKER_RULES_POLL_INTERVAL`` seconds, finds a change made by
+    another process.
+    """
+
+    def __init__(self):
+        self.trie = None
+        self._version = None
+        self._last_poll = None
+        self._lock = threading.Lock()
+
+    def get_trie(self):
+        from django.db.models import Count, Max
+        from url_tracker.models import RedirectRule
+
+        now = time.time()
+        if self.trie is not None and self._last_poll is not None and (
+                now - self._last_poll < get_setting('RULES_POLL_INTERVAL')):
+            return self.trie
+        with self._lock:
+            self._last_poll = now
+            version = RedirectRule.objects.aggregate(
+                count=Count('pk'),
+                modified=Max('modified')
+            )
+            if self.trie is None or version != self._version:
+                self.trie = RuleTrie(RedirectRule.objects.values_list(
+                    'old_prefix', 'new_prefix'
+                ).iterator())
+                self._version = version
+        return self.trie
+
+    def reset(self):
+        with self._lock:
+            self.trie = None
+            self._version = None
+
+
+redirect_rules = RedirectRules()
+
+
+def match_redirect_rule(path):
+    """
+    Returns the new URL for *path* according to the redirect rules, ``''``
+    if it's gone or ``None`` if no rule matches.
+    """
+    trie = redirect_rules.get_trie()
+    if not trie:
+        return None
+    return trie.match(normalize_url(path))
+
+
+def reset_redirect_rules(**kwargs):
+    """
+    Signal receiver compiling the rules again after a rule changed.
+    """
+    redirect_rules.reset()
+
+
+def suggest_rules(min_urls=100, batch_size=1000):
+    """
+    Finds groups of redirects that only replace a prefix of the old URL and
+    could be replaced by a single ``RedirectRule``. Returns a list of
+    ``(old_prefix, new_prefix, count, conflicts)`` tuples for groups of at
+    least *min_urls* redirects, largest first. ``conflicts`` is the number
+    of other redirects below the old prefix that the rule would not match.
+    Rules whose new prefix is below the old one are left out.
+    """
+    from url_tracker.models import URLRedirect
+
+    groups = {}
+    totals = {}
+    redirects = URLRedirect.objects.exclude(target='').order_by(
+        'url_hash'
+    ).values_list('url_hash', 'url', 'target')
+    last_hash = ''
+    while True:
+        batch = list(redirects.filter(url_hash__gt=last_hash)[:batch_size])
+        if not batch:
+            break
+        last_hash = batch[-1][0]
+        for __, url, target in batch:
+            old_segments = url.split('?')[0].split('/')
+            new_segments = target.split('?')[0].split('/')
+            # strip the common tail of both URLs, keeping the leading slash
+            common = 0
+            while (common < min(len(old_segments), len(new_segments)) - 1 and
+                   old_segments[-common - 1] == new_segments[-common - 1]):
+                common += 1
+            if not any(old_segments[len(old_segments) - common:]):
+                continue
+            old_prefix = '/'.join(old_segments[:len(old_segments) - common]) + '/'
+            new_prefix = '/'.join(new_segments[:len(new_segments) - common]) + '/'
+            if is_nested(old_prefix, new_prefix):
+                continue
+            key = (old_prefix, new_prefix)
+            groups[key] = groups.get(key, 0) + 1
+            totals[old_prefix] = totals.get(old_prefix, 0) + 1
+
+    suggestions = [
+        (old_prefix, new_prefix, count, totals[old_prefix] - count)
+        for (old_prefix, new_prefix), count in groups.items()
+        if count >= min_urls
+    ]
+    suggestions.sort(key=lambda suggestion: (-suggestion[2], suggestion[0]))
+    return suggestions
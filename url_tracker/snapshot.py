@@ -0,0 +1,360 @@
+"""
+A precompiled, memory-mapped snapshot of all redirects.
+
+The ``url_tracker_snapshot`` management command writes every redirect to a
+file sorted by the hash of the old URL, which the middleware maps read-only
+and binary searches. All worker processes share the pages of the file
+through the OS page cache instead of each holding the redirects in memory.
+
+Every change to a redirect is logged in the ``URLRedirectChange`` table
+while ``URL_TRACKER_SNAPSHOT_FILE`` is set. The snapshot stores the id of
+the last logged change when it was built, its generation, and each process
+polls the changes logged since. Only the URLs changed after the snapshot
+was built are looked up in the database.
+
+Ids are assigned when a change is logged but only become visible when its
+transaction commits, so a change can show up after changes with higher
+ids. The last ``URL_TRACKER_CHANGE_LOG_OVERLAP`` ids are read again until
+the missing ones show up.
+"""
+import binascii
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.utils.encoding import force_bytes, force_text
+
+from url_tracker.conf import get_setting
+from url_tracker.normalize import normalize_url
+
+HEADER = struct.Struct('<4sQQQ')
+MAGIC = b'UTRS'
+# the digest of the old URL and the offset of its record
+INDEX_ENTRY = struct.Struct('<16sQ')
+# the lengths of the old URL and the target that follow
+RECORD = struct.Struct('<II')
+# above this many missing ids the whole window is read again
+MAX_MISSING_IDS = 100
+
+
+class RedirectSnapshot(object):
+    """
+    Read-only view of a snapshot file. The file starts with a header, then
+    the records of normalized old URL and target, followed by the index of URL digests
+    and record offsets, sorted by digest.
+    """
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self._map = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.count, self.index_offset = HEADER.unpack(
+            self._map[:HEADER.size]
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("'%s' is not a URL tracker snapshot" % file_obj.name)
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'rb'))
+
+    def get(self, url, url_hash=None):
+        """
+        Returns the target of *url*, ``''`` if it's gone or ``None`` if the
+        URL isn't part of the snapshot.
+        """
+        from url_tracker.models import hash_url
+
+        digest = binascii.unhexlify(url_hash or hash_url(url))
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self.index_offset + middle * INDEX_ENTRY.size
+            key, offset = INDEX_ENTRY.unpack(
+                self._map[start:start + INDEX_ENTRY.size]
+            )
+            if key < digest:
+                low = middle + 1
+            elif key > digest:
+                high = middle
+            else:
+                url_length, target_length = RECORD.unpack(
+                    self._map[offset:offset + RECORD.size]
+                )
+                offset += RECORD.size
+                if self._map[offset:offset + url_length] != force_bytes(normalize_url(url)):
+                    return None
+                offset += url_length
+                return force_text(self._map[offset:offset + target_length])
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+def build_snapshot(path, batch_size=10000):
+    """
+    Writes all redirects to a temporary file, which then atomically replaces
+    the snapshot at *path*, and returns the number of written redirects.
+    Changes logged before the window of the previous snapshot at *path* are
+    deleted, processes that still use it switch to the new file first.
+    """
+    from django.db.models import Max
+    from url_tracker.models import URLRedirect, URLRedirectChange
+
+    previous_generation = 0
+    if os.path.exists(path):
+        previous = RedirectSnapshot.open(path)
+        previous_generation = previous.generation
+        previous.close()
+
+    # changes logged while the snapshot is written are polled by the workers
+    generation = URLRedirectChange.objects.aggregate(
+        generation=Max('pk')
+    )['generation'] or 0
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    count = 0
+    try:
+        with os.fdopen(fd, 'w+b') as file_obj, tempfile.TemporaryFile(dir=directory) as index:
+            file_obj.write(HEADER.pack(MAGIC, 0, 0, 0))
+            redirects = URLRedirect.objects.order_by('url_hash').values_list(
+                'url_hash', 'url', 'target'
+            )
+            last_hash = ''
+            while True:
+                batch = list(redirects.filter(url_hash__gt=last_hash)[:batch_size])
+                if not batch:
+                    break
+                for url_hash, url, target in batch:
+                    url = force_bytes(normalize_url(url))
+                    target = force_bytes(target)
+                    index.write(INDEX_ENTRY.pack(
+                        binascii.unhexlify(url_hash),
+                        file_obj.tell()
+                    ))
+                    file_obj.write(RECORD.pack(len(url), len(target)))
+                    file_obj.write(url)
+                    file_obj.write(target)
+                count += len(batch)
+                last_hash = batch[-1][0]
+
+            index_offset = file_obj.tell()
+            index.seek(0)
+            for chunk in iter(lambda: index.read(1024 * 1024), b''):
+                file_obj.write(chunk)
+            file_obj.seek(0)
+            file_obj.write(HEADER.pack(MAGIC, generation, count, index_offset))
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    URLRedirectChange.objects.filter(
+        pk__lte=previous_generation - get_setting('CHANGE_LOG_OVERLAP')
+    ).delete()
+    return count
+
+
+class ChangeLogCursor(object):
+    """
+    Reads the changes logged after *last_id*. The first read also returns
+    the changes in the window of ``URL_TRACKER_CHANGE_LOG_OVERLAP`` ids
+    below *last_id*, which may have been committed later, and every read
+    returns the changes with missing ids of the window that showed up since.
+    """
+
+    def __init__(self, last_id):
+        self.last_id = last_id
+        self.missing = None
+
+    def read(self):
+        """
+        Returns the set of URL hashes of the changes not read before.
+        """
+        from django.db.models import Q
+        from url_tracker.models import URLRedirectChange
+
+        overlap = get_setting('CHANGE_LOG_OVERLAP')
+        changes = URLRedirectChange.objects.order_by('pk')
+        if self.missing is None:
+            start = max(self.last_id - overlap, 0)
+            self.missing = set(range(start + 1, self.last_id + 1))
+            changes = changes.filter(pk__gt=start)
+        elif not self.missing:
+            changes = changes.filter(pk__gt=self.last_id)
+        elif len(self.missing) <= MAX_MISSING_IDS:
+            changes = changes.filter(Q(pk__gt=self.last_id) | Q(pk__in=self.missing))
+        else:
+            changes = changes.filter(pk__gte=min(self.missing))
+
+        url_hashes = set()
+        for change_id, url_hash in changes.values_list('pk', 'url_hash'):
+            if change_id > self.last_id:
+                self.missing.update(range(self.last_id + 1, change_id))
+                self.last_id = change_id
+            elif change_id in self.missing:
+                self.missing.discard(change_id)
+            else:
+                continue
+            url_hashes.add(url_hash)
+        self.missing = set(
+            change_id for change_id in self.missing
+            if change_id > self.last_id - overlap
+        )
+        return url_hashes
+
+
+class SnapshotLookup(object):
+    """
+    Looks up URLs in the snapshot at *path*, except for those changed after
+    it was built. The file and the change log are checked at most every
+    ``URL_TRACKER_SNAPSHOT_POLL_INTERVAL`` seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        self.changed = set()
+        self._stat = None
+        self._cursor = None
+        self._last_poll = None
+        self._lock = threading.Lock()
+
+    def needs_poll(self):
+        """
+        Returns whether the next lookup checks for changes in the database.
+        """
+        return self._last_poll is None or (
+            time.time() - self._last_poll >= get_setting('SNAPSHOT_POLL_INTERVAL')
+        )
+
+    def poll(self):
+        if not self.needs_poll():
+            return
+        now = time.time()
+        with self._lock:
+            self._last_poll = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._close()
+                return
+            if (stat.st_ino, stat.st_mtime) != self._stat:
+                # a new snapshot replaced the file
+                self._close()
+                self.snapshot = RedirectSnapshot.open(self.path)
+                self._stat = (stat.st_ino, stat.st_mtime)
+                self._cursor = ChangeLogCursor(self.snapshot.generation)
+            self.changed.update(self._cursor.read())
+
+    def _close(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.snapshot = None
+        self.changed = set()
+        self._stat = None
+        self._cursor = None
+
+    def lookup_many(self, urls):
+        """
+        Returns the targets of those *urls* that are in the snapshot as a
+        dictionary, and the list of URLs that changed since it was built.
+        Returns ``None`` instead if there is no snapshot file.
+        """
+        from url_tracker.models import hash_url
+
+        self.poll()
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        found = {}
+        changed = []
+        for url in urls:
+            url_hash = hash_url(url)
+            if url_hash in self.changed:
+                changed.append(url)
+                continue
+            target = snapshot.get(url, url_hash)
+            if target is not None:
+                found[url] = target
+        return found, changed
+
+    def mark_changed(self, url_hashes):
+        self.changed.update(url_hashes)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+_snapshot_lookup = None
+_snapshot_lookup_lock = threading.Lock()
+
+
+def get_snapshot_lookup():
+    """
+    Returns the snapshot lookup of this process or ``None`` if
+    ``URL_TRACKER_SNAPSHOT_FILE`` is not set.
+    """
+    global _snapshot_lookup
+    path = get_setting('SNAPSHOT_FILE')
+    if not path:
+        return None
+    if _snapshot_lookup is None or _snapshot_lookup.path != path:
+        with _snapshot_lookup_lock:
+            if _snapshot_lookup is None or _snapshot_lookup.path != path:
+                if _snapshot_lookup is not None:
+                    _snapshot_lookup.close()
+                _snapshot_lookup = SnapshotLookup(path)
+    return _snapshot_lookup
+
+
+def reset_snapshot_lookup():
+    """
+    Closes the snapshot of this process, it's mapped again on next use.
+    """
+    global _snapshot_lookup
+    with _snapshot_lookup_lock:
+        if _snapshot_lookup is not None:
+            _snapshot_lookup.close()
+        _snapshot_lookup = None
+
+
+def log_redirect_changes(url_hashes):
+    """
+    Logs changes to the redirects of the old URLs with the given hashes so
+    that lookups don't use their outdated entries in the snapshot, and
+    incremental exports pick them up.
+    """
+    from url_tracker.models import URLRedirectChange
+
+    if not (get_setting('SNAPSHOT_FILE') or get_setting('CHANGE_LOG')):
+        return
+    url_hashes = set(url_hashes)
+    if not url_hashes:
+        return
+    URLRedirectChange.objects.bulk_create([
+        URLRedirectChange(url_hash=url_hash) for url_hash in url_hashes
+    ])
+    if _snapshot_lookup is not None:
+        # visible in this process before the next poll
+        _snapshot_lookup.mark_changed(url_hashes)
+
+
+def log_deleted_old_url(instance, **kwargs):
+    """
+    Signal receiver logging the change of a deleted ``OldURL``'s redirect,
+    which is removed by the cascading delete.
+    """
+    from url_tracker.models import hash_url
+
+    log_redirect_changes([hash_url(instance.url)])
@@ -1,13 +1,28 @@
+import copy
 import logging
+import threading
 import warnings
+from contextlib import contextmanager
 
-from django.db.models import signals
-from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction, IntegrityError
+from django.db.models import signals, Q, Case, When, Value, CharField, TextField
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.utils.encoding import force_text
+
+from url_tracker.cache import RedirectCache, MISSING
+from url_tracker.conf import get_setting
+from url_tracker.executors import get_executor, defer_url_changes
+from url_tracker.metrics import call_url_method, instrumented
+from url_tracker.normalize import normalize_url
 
 logger = logging.getLogger(__file__)
 
+# number of rows changed by a single ``UPDATE ... CASE`` statement
+UPDATE_BATCH_SIZE = 250
+
 
-def lookup_previous_url(instance, **kwargs):
+@instrumented('pre_save')
+def lookup_previous_url(instance, update_fields=None, **kwargs):
     """
     Gets the previous urls for the model. It will save them too a
     URLChangeMethod object, as OldURLs. If the url method won't resolve
@@ -16,20 +31,177 @@ def lookup_previous_url(instance, **kwargs):
     url of that model
 
     When this method is called `instance` represents the presaved version of the instance.
-    So to get the old URL, we get the object from the database, to get its current state
+    So to get the old URL, we get the object from the database, to get its current state.
+    The object is fetched once for all tracked methods, limited to the fields
+    declared in ``url_tracking_fields`` if the model declares them for every method.
+
+    Methods with declared fields are skipped if none of their fields are in
+    *update_fields* or changed since the instance was loaded. Their old URL
+    is computed from the values at load time without fetching the object.
     """
+    # If the instance is new then don't create a url change
+    if instance.pk is None:
+        return
+    model = instance.__class__
+    declared = getattr(model, 'url_tracking_fields', None) or {}
+    snapshot = getattr(instance, '_url_tracking_snapshot', None)
+
+    unchanged = set()
+    from_snapshot = []
+    method_names = []
     for method_name in instance.get_url_tracking_methods():
+        if method_name not in declared:
+            method_names.append(method_name)
+            continue
+        attnames = get_attnames(model, declared[method_name])
+        if update_fields is not None and not attnames & get_attnames(model, update_fields):
+            unchanged.add(method_name)
+        elif snapshot is None or not attnames <= set(snapshot):
+            method_names.append(method_name)
+        elif all(snapshot[attname] == instance.__dict__.get(attname) for attname in attnames):
+            unchanged.add(method_name)
+        else:
+            from_snapshot.append(method_name)
+    # track_changed_url doesn't need to look at these either
+    instance._url_tracking_unchanged = unchanged
 
-        # If the instance is new then don't create a url change
+    previous_instances = []
+    if from_snapshot:
+        previous_instances.append((from_snapshot, get_snapshot_instance(instance)))
+    if method_names:
+        queryset = model._default_manager.all()
+        fields = get_url_tracking_fields(model, method_names)
+        if fields is not None:
+            queryset = queryset.only(*fields)
         try:
-            instance = instance.__class__.objects.get(pk=instance.pk)
-        except instance.__class__.DoesNotExist:
-            continue
+            previous_instances.append((method_names, queryset.get(pk=instance.pk)))
+        except model.DoesNotExist:
+            pass
 
-        old_url = getattr(instance, method_name)()
-        if not old_url:
-            return
-        add_old_url(instance, method_name, old_url)
+    # recorded by track_changed_url, only for the URLs that changed
+    instance._url_tracker_old_urls = [
+        (previous, method_name, get_tracked_url(previous, method_name) or '')
+        for method_names, previous in previous_instances
+        for method_name in method_names
+    ]
+
+
+def get_attnames(model, field_names):
+    """
+    Returns the attribute names of the fields with the given names, e.g.
+    ``category_id`` for the foreign key ``category``.
+    """
+    attnames = set()
+    for name in field_names:
+        try:
+            attnames.add(model._meta.get_field(name).attname)
+        except FieldDoesNotExist:
+            attnames.add(name)
+    return attnames
+
+
+def take_url_tracking_snapshot(instance, **kwargs):
+    """
+    Remembers the values of all fields declared in ``url_tracking_fields``
+    so that ``lookup_previous_url`` can tell whether they changed. Connected
+    to ``post_init`` and run again after each save.
+    """
+    declared = getattr(instance.__class__, 'url_tracking_fields', None) or {}
+    attnames = set()
+    for field_names in declared.values():
+        attnames |= get_attnames(instance.__class__, field_names)
+    # deferred fields are not loaded and can't be compared
+    instance._url_tracking_snapshot = dict(
+        (attname, instance.__dict__[attname])
+        for attname in attnames if attname in instance.__dict__
+    )
+
+
+def get_snapshot_instance(instance):
+    """
+    Returns a copy of *instance* with the field values of its snapshot.
+    """
+    previous = copy.copy(instance)
+    previous.__dict__.update(instance._url_tracking_snapshot)
+    for field in instance._meta.concrete_fields:
+        if field.is_relation and field.attname in instance._url_tracking_snapshot:
+            # the cached related object might belong to the new value
+            previous.__dict__.pop(field.get_cache_name(), None)
+    return previous
+
+
+class ReverseCache(RedirectCache):
+    """
+    Least recently used map of the URLs computed by the URL methods of
+    tracked models, keyed by the model, the method and the values of the
+    fields declared for it in ``url_tracking_fields``. Holds at most
+    ``URL_TRACKER_REVERSE_CACHE_SIZE`` URLs.
+    """
+
+    @property
+    def max_size(self):
+        return get_setting('REVERSE_CACHE_SIZE')
+
+    @property
+    def timeout(self):
+        # computed URLs only change with the values they are keyed by
+        return None
+
+
+reverse_cache = ReverseCache()
+
+
+def get_tracked_url(instance, method_name):
+    """
+    Returns the URL of *instance* for *method_name*.
+
+    If the fields of the method are declared in ``url_tracking_fields`` the
+    URL is computed at most once for the same values of these fields: it's
+    remembered on the instance, and copies made for its previous state, so
+    that the URL computed after one save is the previous URL of the next.
+    With ``URL_TRACKER_REVERSE_CACHE_SIZE`` set, URLs are shared by all
+    instances of the model as well.
+    """
+    model = instance.__class__
+    declared = getattr(model, 'url_tracking_fields', None) or {}
+    if method_name not in declared:
+        return call_url_method(instance, method_name)
+    attnames = sorted(get_attnames(model, declared[method_name]))
+    if not all(attname in instance.__dict__ for attname in attnames):
+        # deferred fields would be fetched one by one
+        return call_url_method(instance, method_name)
+    values = tuple(instance.__dict__[attname] for attname in attnames)
+
+    urls = instance.__dict__.setdefault('_url_tracking_urls', {})
+    if method_name in urls and urls[method_name][0] == values:
+        return urls[method_name][1]
+    cache_key = (model._meta.app_label, model._meta.model_name, method_name, values)
+    try:
+        url = reverse_cache.get(cache_key)
+    except TypeError:
+        # values that can't be hashed aren't cached
+        cache_key = url = MISSING
+    if url is MISSING:
+        url = call_url_method(instance, method_name)
+        if cache_key is not MISSING:
+            reverse_cache.set(cache_key, url)
+    urls[method_name] = (values, url)
+    return url
+
+
+def get_url_tracking_fields(model, method_names):
+    """
+    Returns the names of the fields the *method_names* of *model* depend on
+    according to its ``url_tracking_fields`` or ``None`` if that isn't
+    declared for all of them.
+    """
+    declared = getattr(model, 'url_tracking_fields', None) or {}
+    fields = set()
+    for method_name in method_names:
+        if method_name not in declared:
+            return None
+        fields.update(declared[method_name])
+    return fields
 
 
 def add_old_url(instance, method_name, old_url):
@@ -38,52 +210,409 @@ def add_old_url(instance, method_name, old_url):
 
     It will create a OldUrl object for that url and add it to the url_method for that instance.
     '''
-    from url_tracker.models import URLChangeMethod, OldURL
+    add_old_urls([(instance, method_name, old_url)])
+
+
+def add_old_urls(old_urls, refresh=True):
+    """
+    Saves old URLs given as ``(instance, method_name, old_url)`` tuples.
+
+    Works like ``add_old_url`` but writes the ``URLChangeMethod``s, ``OldURL``s
+    and the relation between them with a constant number of bulk queries,
+    independent of the number of URLs. Without *refresh* the caller has to
+    refresh their redirects. Returns the ids of the ``URLChangeMethod``s
+    keyed by ``instance_key``.
+    """
+    from url_tracker.models import URLChangeMethod, OldURL, URLRedirect, hash_url
+    from url_tracker.bloom import add_to_bloom_filter
+    from url_tracker.cache import invalidate_redirect_cache
+
+    if not old_urls:
+        return {}
+    old_urls = [
+        (instance, method_name, normalize_url(url))
+        for instance, method_name, url in old_urls
+    ]
+
+    def find_old_urls(urls):
+        # looked up by hash, the URLs are compared in case of collisions
+        hashes = dict((hash_url(url), url) for url in urls)
+        found = {}
+        for url_hash, url, pk in OldURL.objects.filter(
+                url_hash__in=list(hashes)).values_list('url_hash', 'url', 'pk'):
+            if normalize_url(url) == hashes[url_hash]:
+                found[hashes[url_hash]] = pk
+        return found
+
+    with transaction.atomic():
+        url_methods = get_or_create_url_methods(
+            (instance, method_name) for instance, method_name, __ in old_urls
+        )
+        urls = set(url for __, __, url in old_urls)
+        existing = find_old_urls(urls)
+        created = [url for url in urls if url not in existing]
+        if created:
+            bulk_create_ignoring_conflicts(
+                OldURL,
+                [OldURL(url=url, url_hash=hash_url(url)) for url in created],
+                ['url_hash']
+            )
+            existing.update(find_old_urls(created))
+
+        Relation = URLChangeMethod.old_urls.through
+        wanted = set(
+            (url_methods[instance_key(instance, method_name)], existing[url])
+            for instance, method_name, url in old_urls
+            if url in existing
+        )
+        related = set(Relation.objects.filter(
+            urlchangemethod__in=set(pk for pk, __ in wanted),
+            oldurl__in=set(pk for __, pk in wanted)
+        ).values_list('urlchangemethod', 'oldurl'))
+        Relation.objects.bulk_create([
+            Relation(urlchangemethod_id=url_method_id, oldurl_id=old_url_id)
+            for url_method_id, old_url_id in wanted - related
+        ])
+
+        if refresh:
+            # bulk queries don't send the signals that keep these up to date
+            URLRedirect.objects.refresh(pk for __, pk in wanted)
+    for url in created:
+        add_to_bloom_filter(url)
+    invalidate_redirect_cache()
+    return url_methods
+
+
+def instance_key(instance, method_name):
     from django.contrib.contenttypes.models import ContentType
 
-    content_type = ContentType.objects.get_for_model(instance.__class__)
-    url_method, created = URLChangeMethod.objects.get_or_create(
-        content_type=content_type,
-        object_id=instance.pk,
-        method_name=method_name
+    return (
+        ContentType.objects.get_for_model(instance.__class__).pk,
+        force_text(instance.pk),
+        method_name
+    )
+
+
+def get_or_create_url_methods(instance_methods, create=True):
+    """
+    Returns a dict of the ids of the ``URLChangeMethod``s for the given
+    ``(instance, method_name)`` pairs keyed by ``instance_key``, creating
+    missing ones in bulk unless *create* is ``False``.
+    """
+    from url_tracker.models import URLChangeMethod
+
+    keys = set(
+        instance_key(instance, method_name)
+        for instance, method_name in instance_methods
     )
-    old_url, __ = OldURL.objects.get_or_create(url=old_url)
-    url_method.old_urls.add(old_url)
-    url_method.save()
+    url_methods = {}
+
+    object_ids = {}
+    for content_type_id, object_id, method_name in keys:
+        object_ids.setdefault((content_type_id, method_name), set()).add(object_id)
+    lookup = Q()
+    for (content_type_id, method_name), ids in object_ids.items():
+        lookup |= Q(
+            content_type=content_type_id,
+            method_name=method_name,
+            object_id__in=ids
+        )
+
+    def fetch():
+        for pk, content_type_id, object_id, method_name in URLChangeMethod.objects.filter(
+                lookup).order_by('pk').values_list(
+                    'pk', 'content_type', 'object_id', 'method_name'):
+            url_methods.setdefault((content_type_id, object_id, method_name), pk)
+
+    if not keys:
+        return url_methods
+    fetch()
+    missing = keys.difference(url_methods)
+    if missing and create:
+        bulk_create_ignoring_conflicts(
+            URLChangeMethod,
+            [
+                URLChangeMethod(
+                    content_type_id=content_type_id,
+                    object_id=object_id,
+                    method_name=method_name
+                )
+                for content_type_id, object_id, method_name in missing
+            ],
+            ['content_type_id', 'object_id', 'method_name']
+        )
+        fetch()
+    return url_methods
 
 
+def bulk_create_ignoring_conflicts(model, objs, unique_fields):
+    """
+    Creates *objs* in bulk, skipping those that already exist because
+    another process created them concurrently. *unique_fields* are the
+    names of the fields of the unique key the conflicts are detected by.
+    """
+    try:
+        with transaction.atomic():
+            model._default_manager.bulk_create(objs)
+    except IntegrityError:
+        for obj in objs:
+            lookup = dict(
+                (field_name, getattr(obj, field_name))
+                for field_name in unique_fields
+            )
+            model._default_manager.get_or_create(defaults=dict(
+                (field.attname, getattr(obj, field.attname))
+                for field in model._meta.concrete_fields
+                if not field.primary_key and field.attname not in lookup
+            ), **lookup)
+
+
+@instrumented('post_save')
 def track_changed_url(instance, **kwargs):
     """
     Saves the current_url for an instance.
 
     If that instance has not URLChangeMethod, then it will not create one.
+    The previous URLs looked up by ``lookup_previous_url`` are only recorded
+    for the methods whose URL changed, with the bulk queries of
+    ``record_url_changes``, so saves that don't change any URL don't write
+    anything. With ``URL_TRACKER_EXECUTOR`` set, the URLs that changed are
+    handed to the executor after the transaction commits instead.
+    Updating the URLChangeMethod updates its redirects, which also points
+    existing redirects to any of its old URLs at the new current_url.
     """
-    from url_tracker.models import URLChangeMethod
+    from url_tracker.models import URLChangeMethod, OldURL, hash_url
     from django.contrib.contenttypes.models import ContentType
 
-    for method_name in instance.get_url_tracking_methods():
-        content_type = ContentType.objects.get_for_model(instance.__class__)
-        try:
-            url_method = URLChangeMethod.objects.get(
-                content_type=content_type,
-                object_id=instance.pk,
-                method_name=method_name
+    unchanged = instance.__dict__.pop('_url_tracking_unchanged', ())
+    old_urls = instance.__dict__.pop('_url_tracker_old_urls', None)
+    if hasattr(instance, '_url_tracking_snapshot'):
+        take_url_tracking_snapshot(instance)
+
+    if old_urls is not None:
+        changes = [
+            (instance, method_name, old_url, get_tracked_url(instance, method_name) or '')
+            for __, method_name, old_url in old_urls
+        ]
+        changes = [
+            change for change in changes
+            if normalize_url(change[2]) != normalize_url(change[3])
+        ]
+        if get_executor() is None:
+            record_url_changes(changes)
+        else:
+            # without an old URL the current URL is still updated
+            defer_url_changes(
+                [
+                    (instance, method_name, old_url)
+                    for __, method_name, old_url, __ in changes
+                ],
+                using=kwargs.get('using') or instance._state.db
             )
-        except URLChangeMethod.DoesNotExist:
-            continue
-        current_url = getattr(instance, method_name)()
+        return
+    if get_executor() is not None:
+        return
+
+    method_names = [
+        method_name for method_name in instance.get_url_tracking_methods()
+        if method_name not in unchanged
+    ]
+    if not method_names:
+        return
+    # a single lookup by the unique key for all methods
+    url_methods = URLChangeMethod.objects.filter(
+        content_type=ContentType.objects.get_for_model(instance.__class__),
+        object_id=force_text(instance.pk),
+        method_name__in=method_names
+    )
+    for url_method in url_methods:
+        current_url = get_tracked_url(instance, url_method.method_name)
 
         logger.debug(
             "tracking URL change for instance '%s' URL",
             instance.__class__.__name__
         )
 
-        url_method.current_url = current_url
-        url_method.old_urls.filter(url=current_url).delete()
-        if not url_method.old_urls.exists():
+        returned = list(url_method.old_urls.filter(
+            url_hash=hash_url(current_url)
+        ).values_list('pk', flat=True))
+        if returned:
+            OldURL.objects.filter(pk__in=returned).delete()
+        if returned and not url_method.old_urls.exists():
             url_method.delete()
             continue
-        url_method.save()
+        if url_method.current_url != current_url:
+            url_method.current_url = current_url
+            url_method.save(update_fields=['current_url'])
+
+
+def record_url_changes(changes):
+    """
+    Records URL changes given as ``(instance, method_name, old_url, new_url)``
+    tuples the way ``lookup_previous_url`` and ``track_changed_url`` do for
+    a single save, using a constant number of bulk queries.
+    """
+    from url_tracker.models import (
+        URLChangeMethod, OldURL, URLRedirect, hash_url, hash_current_url
+    )
+    from url_tracker.cache import invalidate_redirect_cache
+
+    # an old URL is never recorded for the URL it changed to
+    changes = [
+        change for change in changes
+        if normalize_url(change[2] or '') != normalize_url(change[3] or '')
+    ]
+    if not changes:
+        return
+
+    with transaction.atomic():
+        # their redirects are refreshed below, with the new URLs
+        url_methods = add_old_urls([
+            (instance, method_name, old_url)
+            for instance, method_name, old_url, __ in changes if old_url
+        ], refresh=False)
+        without_old_url = [
+            (instance, method_name)
+            for instance, method_name, __, __ in changes
+            if instance_key(instance, method_name) not in url_methods
+        ]
+        if without_old_url:
+            url_methods.update(
+                get_or_create_url_methods(without_old_url, create=False)
+            )
+        current_urls = {}
+        for instance, method_name, __, new_url in changes:
+            url_method_id = url_methods.get(instance_key(instance, method_name))
+            if url_method_id is not None:
+                current_urls[url_method_id] = new_url or ''
+        if not current_urls:
+            return
+
+        items = list(current_urls.items())
+        for start in range(0, len(items), UPDATE_BATCH_SIZE):
+            batch = items[start:start + UPDATE_BATCH_SIZE]
+            URLChangeMethod.objects.filter(pk__in=[pk for pk, __ in batch]).update(
+                current_url=Case(
+                    *[When(pk=pk, then=Value(url)) for pk, url in batch],
+                    output_field=TextField()
+                ),
+                current_url_hash=Case(
+                    *[When(pk=pk, then=Value(hash_current_url(url))) for pk, url in batch],
+                    output_field=CharField()
+                )
+            )
+
+        # URLs that are current again are no longer old
+        returned = [
+            old_url_id
+            for old_url_id, url, url_method_id in OldURL.objects.filter(
+                url_hash__in=set(hash_url(url) for url in current_urls.values()),
+                model_method__in=list(current_urls)
+            ).values_list('pk', 'url', 'model_method')
+            if normalize_url(current_urls[url_method_id]) == normalize_url(url)
+        ]
+        if returned:
+            OldURL.objects.filter(pk__in=returned).delete()
+            URLChangeMethod.objects.filter(
+                pk__in=list(current_urls),
+                old_urls__isnull=True
+            ).delete()
+
+        # bulk updates don't send the signals that keep these up to date
+        URLRedirect.objects.refresh(
+            URLChangeMethod.old_urls.through.objects.filter(
+                urlchangemethod__in=list(current_urls)
+            ).values_list('oldurl', flat=True)
+        )
+    invalidate_redirect_cache()
+
+
+_deleted = threading.local()
+
+
+def capture_deleted_urls(instance, using=None, **kwargs):
+    """
+    Remembers the current URLs of an instance that is about to be deleted.
+
+    ``pre_delete`` is sent for every object collected by a delete, including
+    the objects of a ``QuerySet.delete()`` and those deleted by a cascade,
+    before any row is deleted, so the URLs are computed while all related
+    objects still exist.
+    """
+    urls = []
+    for method_name in instance.get_url_tracking_methods():
+        url = get_tracked_url(instance, method_name)
+        if url:
+            urls.append((method_name, url))
+    if not urls:
+        return
+    key = (using or instance._state.db, instance.__class__)
+    if not hasattr(_deleted, 'instances'):
+        _deleted.instances = {}
+    _deleted.instances.setdefault(key, []).append((instance, urls))
+
+
+def track_deleted_urls(sender, instance, using=None, **kwargs):
+    """
+    Records the URLs captured by ``capture_deleted_urls`` as gone.
+
+    ``post_delete`` is sent once the rows of all collected objects of a model
+    are deleted, so the URLs of all of them are recorded together with the
+    first signal, using the bulk queries of ``record_url_changes``.
+    """
+    key = (using or instance._state.db, sender)
+    deleted = getattr(_deleted, 'instances', {}).pop(key, None)
+    if not deleted:
+        return
+    # objects of a delete that failed after pre_delete still exist
+    existing = set(
+        force_text(pk) for pk in sender._base_manager.using(key[0]).filter(
+            pk__in=[obj.pk for obj, __ in deleted]
+        ).values_list('pk', flat=True)
+    )
+    record_url_changes([
+        (obj, method_name, url, '')
+        for obj, urls in deleted if force_text(obj.pk) not in existing
+        for method_name, url in urls
+    ])
+
+
+@contextmanager
+def track_bulk_changes(queryset, batch_size=500):
+    """
+    Records the URL changes of all objects in *queryset* caused by the code
+    run inside the ``with`` block, e.g. a ``QuerySet.update()``::
+
+        with track_bulk_changes(Project.objects.filter(category=category)):
+            Project.objects.filter(category=category).update(slug=...)
+
+    The URLs of all objects are computed with a single query before the
+    block runs and the objects are fetched again in batches of *batch_size*
+    afterwards. Only fields declared in ``url_tracking_fields`` are fetched
+    if the model declares them for all tracked methods.
+    """
+    model = queryset.model
+    method_names = model.get_url_tracking_methods()
+    fields = get_url_tracking_fields(model, method_names)
+
+    def get_urls(objects):
+        if fields is not None:
+            objects = objects.only(*fields)
+        for obj in objects.iterator():
+            yield obj, [get_tracked_url(obj, method_name) for method_name in method_names]
+
+    previous = dict((obj.pk, urls) for obj, urls in get_urls(queryset))
+    yield
+
+    pks = list(previous)
+    for start in range(0, len(pks), batch_size):
+        changes = []
+        for obj, urls in get_urls(model._default_manager.filter(
+                pk__in=pks[start:start + batch_size])):
+            for method_name, old_url, new_url in zip(
+                    method_names, previous[obj.pk], urls):
+                changes.append((obj, method_name, old_url, new_url))
+        record_url_changes(changes)
 
 
 def track_url_changes_for_model(model, absolute_url_method='get_absolute_url'):
@@ -95,7 +624,8 @@ def track_url_changes_for_model(model, absolute_url_method='get_absolute_url'):
 
     The ``pre_save`` and ``post_save`` methods are connected
     to different tracking methods for *model* and create/update
-    ``URLChangeRecord``s as required.
+    ``URLChangeRecord``s as required. The URLs of deleted objects are
+    recorded as gone through ``pre_delete`` and ``post_delete``.
     """
     if not hasattr(model, 'get_url_tracking_methods'):
         from url_tracker.mixins import URLTrackingMixin
@@ -121,5 +651,13 @@ def track_url_changes_for_model(model, absolute_url_method='get_absolute_url'):
                 )
             )
 
+    if getattr(model, 'url_tracking_fields', None):
+        signals.post_init.connect(
+            take_url_tracking_snapshot,
+            sender=model,
+            weak=False
+        )
     signals.pre_save.connect(lookup_previous_url, sender=model, weak=False)
     signals.post_save.connect(track_changed_url, sender=model, weak=False)
+    signals.pre_delete.connect(capture_deleted_urls, sender=model, weak=False)
+    signals.post_delete.connect(track_deleted_urls, sender=model, weak=False)